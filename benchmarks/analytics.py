@@ -0,0 +1,92 @@
+"""
+Times building an `EventHistory` of a synthetic chat (see `benchmarks.synthetic`) with weekly events over several
+years and computing each of its statistics, in pure Python and with NumPy (if it is installed). Exits with 1 if both
+return different results.
+
+    python -m benchmarks.analytics --users 10,40 --years 1,5,20
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Dict, Any, List, Callable
+
+from dicers_bot.analytics import EventHistory, get_numpy
+from .synthetic import synthetic_chat
+
+STATISTICS: Dict[str, Callable[[EventHistory], Any]] = {
+    "rolling_average": lambda history: history.rolling_average(4),
+    "roll_histogram": EventHistory.roll_histogram,
+    "streaks": EventHistory.streaks,
+    "weekdays": EventHistory.weekdays,
+}
+
+
+def _best_of(func: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def run(users: int, years: int, repeat: int = 5) -> Dict[str, Any]:
+    events = synthetic_chat(-1, users, years * 52, random.Random(0))["events"]
+    backends = [False] + ([True] if get_numpy() else [])
+
+    timings: Dict[str, Dict[str, float]] = {}
+    results: Dict[str, List[Any]] = {}
+    for vectorized in backends:
+        backend = "numpy" if vectorized else "python"
+        history = EventHistory(events, vectorized)
+        timings[backend] = {"build": _best_of(lambda: EventHistory(events, vectorized), repeat)}
+        results[backend] = []
+        for name, statistic in STATISTICS.items():
+            timings[backend][name] = _best_of(lambda: statistic(history), repeat)
+            results[backend].append(statistic(history))
+
+    return {
+        "users": users,
+        "years": years,
+        "events": len(events),
+        "timings": timings,
+        "equal": all(result == results["python"] for result in results.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="10,40", help="Comma separated numbers of users per chat")
+    parser.add_argument("--years", default="1,5,20", help="Comma separated numbers of years of weekly events")
+    parser.add_argument("--repeat", type=int, default=5, help="Best of this many runs")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    if not get_numpy():
+        print("NumPy isn't installed, only the pure Python implementation is timed")
+
+    measurements = []
+    columns = ["build"] + list(STATISTICS)
+    print(f"{'users':>5} {'events':>6} {'backend':<7} " + " ".join(f"{column:>15}" for column in columns))
+    for users in map(int, args.users.split(",")):
+        for years in map(int, args.years.split(",")):
+            measurement = run(users, years, args.repeat)
+            measurements.append(measurement)
+            for backend, timings in measurement["timings"].items():
+                print(f"{users:5} {measurement['events']:6} {backend:<7} "
+                      + " ".join(f"{timings[column] * 1000:13.2f}ms" for column in columns))
+            if not measurement["equal"]:
+                print("The results differ between the implementations")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(measurements, f, indent=2)
+
+    sys.exit(0 if all(measurement["equal"] for measurement in measurements) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+A local stand-in for the Telegram Bot API which serves the methods the bot uses and lets tests inject updates.
+
+    python -m benchmarks.fake_telegram --port 8081
+    python main.py --base-url http://127.0.0.1:8081/bot
+"""
+import argparse
+import itertools
+import json
+import queue
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Event, Lock, Thread
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Regular Dicers", "username": "regular_dicers_bot"}
+ADMIN_USER = {"id": 1001, "is_bot": False, "first_name": "admin", "username": "admin"}
+
+
+class Call:
+    __slots__ = ("time", "method", "params")
+
+    def __init__(self, method: str, params: Dict[str, Any]):
+        self.time = time.perf_counter()
+        self.method = method
+        self.params = params
+
+    def chat_id(self) -> Optional[int]:
+        chat_id = self.params.get("chat_id")
+        try:
+            return int(chat_id) if chat_id is not None else None
+        except ValueError:
+            return None
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The bot process is killed at the end of a benchmark
+        pass
+
+
+class FakeBotApi:
+    """
+    Answers Bot API methods with plausible results without any network, see `FakeTelegram` for the HTTP server.
+    Every call is counted and passed to the listeners registered for its chat (`chat_id`) or query
+    (`callback_query_id`/`inline_query_id`).
+    """
+
+    def __init__(self):
+        self._message_ids = itertools.count(1)
+        self._lock = Lock()
+        self._listeners: Dict[Tuple[str, Any], "queue.Queue[Call]"] = {}
+        self.counts: Dict[str, int] = {}
+        self.administrators: List[Dict[str, Any]] = [ADMIN_USER]
+        self._methods: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+            "getMe": lambda params: BOT_USER,
+            "setWebhook": lambda params: True,
+            "deleteWebhook": lambda params: True,
+            "sendMessage": self._message,
+            "sendDocument": self._message,
+            "editMessageText": self._message,
+            "editMessageReplyMarkup": self._message,
+            "pinChatMessage": lambda params: True,
+            "unpinChatMessage": lambda params: True,
+            "restrictChatMember": lambda params: True,
+            "kickChatMember": lambda params: True,
+            "answerCallbackQuery": lambda params: True,
+            "answerInlineQuery": lambda params: True,
+            "getChatAdministrators": lambda params: [{"user": user, "status": "administrator"}
+                                                     for user in self.administrators],
+        }
+
+    def next_message_id(self) -> int:
+        return next(self._message_ids)
+
+    def listen(self, kind: str, key: Any, listener: Optional["queue.Queue[Call]"] = None) -> "queue.Queue[Call]":
+        """
+        :param kind: `chat` (key is the chat id) or `query` (key is the callback/inline query id)
+        :param listener: The queue to use, a new one if `None`
+        :return: A queue which receives every call for `key`
+        """
+        if listener is None:
+            listener = queue.Queue()
+
+        with self._lock:
+            self._listeners[(kind, key)] = listener
+
+        return listener
+
+    def forget(self, kind: str, key: Any) -> None:
+        with self._lock:
+            self._listeners.pop((kind, key), None)
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        message_id = params.get("message_id") or self.next_message_id()
+        return {
+            "message_id": int(message_id),
+            "from": BOT_USER,
+            "chat": {"id": int(params.get("chat_id") or 0), "type": "group", "title": "load test"},
+            "date": int(time.time()),
+            "text": params.get("text", "")
+        }
+
+    def _record(self, call: Call) -> None:
+        with self._lock:
+            self.counts[call.method] = self.counts.get(call.method, 0) + 1
+            listeners = [self._listeners.get(("chat", call.chat_id()))]
+            for query_key in ("callback_query_id", "inline_query_id"):
+                if query_key in call.params:
+                    listeners.append(self._listeners.get(("query", call.params[query_key])))
+
+        for listener in listeners:
+            if listener:
+                listener.put(call)
+
+    def handle(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        handler = self._methods.get(method)
+        if handler is None:
+            return {"ok": False, "error_code": 404, "description": f"Not Found: method {method} is not faked"}
+
+        if method != "getUpdates":
+            self._record(Call(method, params))
+
+        return {"ok": True, "result": handler(params)}
+
+
+class FakeTelegram(FakeBotApi):
+    """
+    Serves the Bot API over HTTP, `getUpdates` is served from an in-memory queue filled with `push_update`.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__()
+        self._updates: List[Dict[str, Any]] = []
+        self._updates_condition = Condition()
+        self._update_ids = itertools.count(1)
+        self.polling = Event()
+        self._methods["getUpdates"] = self._get_updates
+        self._server = _Server((host, port), self._handler_class())
+        self._thread: Optional[Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self) -> "FakeTelegram":
+        self._thread = Thread(target=self._server.serve_forever, name="fake_telegram", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def push_update(self, update: Dict[str, Any]) -> int:
+        """
+        Queues `update` (without `update_id`) for the next `getUpdates`.
+
+        :return: The assigned update id
+        """
+        with self._updates_condition:
+            update["update_id"] = next(self._update_ids)
+            self._updates.append(update)
+            self._updates_condition.notify_all()
+
+        return update["update_id"]
+
+    def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        self.polling.set()
+
+        with self._updates_condition:
+            # Updates before `offset` have been confirmed by the client
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_condition.wait(remaining)
+
+            return self._updates[:limit]
+
+    def _handler_class(self):
+        fake = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                params: Dict[str, Any] = {}
+                if body and self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body.decode("utf-8"))
+
+                # /bot<token>/<method>
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                content = json.dumps(fake.handle(method, params)).encode("utf-8")
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return _Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.host, args.port).start()
+    print(f"Serving the Bot API at {fake.base_url}")
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(fake.counts))
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
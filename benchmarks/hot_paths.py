@@ -0,0 +1,348 @@
+"""
+Micro benchmarks of the bot's hot paths (spam detection, keyboard messages, statistics commands, saving/loading the
+state, the inline query and the `Command` decorator) on synthetic chats (see `benchmarks.synthetic`) with a stubbed
+Telegram API. Every benchmark runs for each combination of the parameters it depends on.
+
+The results can be written as json and compared with a previous run:
+
+    python -m benchmarks.hot_paths --users 10,40 --events 50,250 --chats 1,50 --output before.json
+    python -m benchmarks.hot_paths --users 10,40 --events 50,250 --chats 1,50 --compare before.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Tuple, Iterator
+
+import telegram
+from telegram import Update, Message
+from telegram.ext import Updater, CallbackContext
+
+from dicers_bot import Bot, bot as bot_module
+from dicers_bot.chat import Chat
+from dicers_bot.chat_store import ChatStore
+from dicers_bot.cocktails import Cocktail, Ingredient
+from dicers_bot.decorators import Command
+from .load import REPOSITORY, TOKEN, write_config
+from .replay import StubRequest
+from .fake_telegram import FakeBotApi
+from .synthetic import synthetic_state
+
+PARAMETERS = ("chats", "users", "events", "messages")
+
+
+class Fixture:
+    """
+    A `Bot` with `chats` synthetic chats of `users` users and `events` historical events each, its state is kept in
+    `directory`. The first chat is the one the updates are sent to.
+    """
+
+    def __init__(self, directory: str, chats: int, users: int, events: int):
+        self.api = FakeBotApi()
+        self.updater = Updater(bot=telegram.Bot(TOKEN, request=StubRequest(self.api)), use_context=True)
+        self.bot = Bot(self.updater, write_config(directory))
+
+        state = synthetic_state(chats, users, events)
+        self.bot.state["main_id"] = state["main_id"]
+        self.bot.chats = ChatStore(self.updater.bot, state["chats"])
+        # Only chats which have been accessed are saved
+        chats = [self.bot.chats[chat["id"]] for chat in state["chats"]]
+        self.chat: Chat = chats[0]
+        self.user = sorted(self.chat.users, key=lambda user: user.id)[0]
+        self._update_ids = itertools.count(1)
+        # Writes every chat, later saves only write the changed ones
+        self.bot.save_state()
+
+    def message(self, text: str) -> Update:
+        return Update.de_json({
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": self.api.next_message_id(),
+                "from": {"id": self.user.id, "is_bot": False, "first_name": self.user.name},
+                "chat": {"id": self.chat.id, "type": "group", "title": self.chat.title},
+                "date": int(time.time()),
+                "text": text
+            }
+        }, self.updater.bot)
+
+    def inline_query(self, query: str) -> Update:
+        return Update.de_json({
+            "update_id": next(self._update_ids),
+            "inline_query": {
+                "id": str(next(self._update_ids)),
+                "from": {"id": self.user.id, "is_bot": False, "first_name": self.user.name},
+                "query": query,
+                "offset": ""
+            }
+        }, self.updater.bot)
+
+    def context(self, update: Update) -> CallbackContext:
+        return CallbackContext.from_update(update, self.updater.dispatcher)
+
+
+class Fixtures:
+    """
+    Creates every `Fixture` once, the benchmarks of the same size share it.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._fixtures: Dict[Tuple[int, int, int], Fixture] = {}
+
+    def get(self, chats: int = 1, users: int = 10, events: int = 0) -> Fixture:
+        key = (chats, users, events)
+        if key not in self._fixtures:
+            directory = os.path.join(self.directory, "_".join(map(str, key)))
+            os.makedirs(directory)
+            self._fixtures[key] = Fixture(directory, chats, users, events)
+
+        return self._fixtures[key]
+
+
+def _check_user_spam(fixtures: Fixtures, messages: int) -> Callable[[], Any]:
+    chat = telegram.Chat(-1, "group")
+    user = telegram.User(1, "user1", False)
+    now = datetime.now()
+    # Non-consecutive ids and a few different texts, so each check of `_check_user_spam` has to look at all messages
+    user_messages = [Message(i * 2, user, now, chat, text=f"Nachricht {i % 5}") for i in range(messages)]
+    spam_config = fixtures.get().bot.config.get("spam", {})
+
+    return lambda: Bot._check_user_spam(user_messages, spam_config)
+
+
+def _build_attend_message(fixtures: Fixtures, users: int) -> Callable[[], Any]:
+    return fixtures.get(users=users).chat._build_attend_message
+
+
+def _build_dice_message(fixtures: Fixtures, users: int) -> Callable[[], Any]:
+    return fixtures.get(users=users).chat._build_dice_message
+
+
+def _command(name: str, text: str) -> Callable[..., Callable[[], Any]]:
+    def _setup(fixtures: Fixtures, users: int, events: int) -> Callable[[], Any]:
+        fixture = fixtures.get(users=users, events=events)
+        update = fixture.message(text)
+        context = fixture.context(update)
+        handler = getattr(fixture.bot, name)
+
+        return lambda: handler(update, context)
+
+    return _setup
+
+
+def _save_state(changed: str) -> Callable[..., Callable[[], Any]]:
+    def _setup(fixtures: Fixtures, chats: int, users: int, events: int) -> Callable[[], Any]:
+        fixture = fixtures.get(chats, users, events)
+        chats_to_change = fixture.bot.chats.loaded() if changed == "all" else [fixture.chat]
+
+        def _save():
+            for chat in chats_to_change:
+                chat.dirty = True
+            fixture.bot.save_state()
+
+        return _save
+
+    return _setup
+
+
+def _load_state(fixtures: Fixtures, chats: int, users: int, events: int) -> Callable[[], Any]:
+    fixture = fixtures.get(chats, users, events)
+
+    def _load():
+        fixture.bot.load_state()
+        # Chats and their events are loaded on first access
+        for chat in fixture.bot.chats.values():
+            chat.events
+
+    return _load
+
+
+def _inline_query(fixtures: Fixtures) -> Callable[[], Any]:
+    fixture = fixtures.get()
+    # `get_cocktails` would fetch the cocktails from the backend
+    cocktails = [Cocktail(i, f"Cocktail {i}", i % 3 == 0, i % 7 != 0, "Longdrink", [Ingredient("Rum")])
+                 for i in range(200)]
+    bot_module.get_cocktails = lambda: cocktails
+    update = fixture.inline_query("cocktail 1")
+    context = fixture.context(update)
+
+    return lambda: fixture.bot.handle_inline_query(update, context)
+
+
+def _command_dispatch(fixtures: Fixtures, chats: int) -> Callable[[], Any]:
+    fixture = fixtures.get(chats=chats)
+
+    # noinspection PyUnusedLocal
+    def noop(self, update: Update, context: CallbackContext) -> None:
+        return None
+
+    command = Command()(noop)
+    update = fixture.message("/noop")
+    context = fixture.context(update)
+
+    return lambda: command(fixture.bot, update, context)
+
+
+# name -> (parameters the benchmark depends on, setup which returns the function to time)
+BENCHMARKS: Dict[str, Tuple[Tuple[str, ...], Callable[..., Callable[[], Any]]]] = {
+    "check_user_spam": (("messages",), _check_user_spam),
+    "build_attend_message": (("users",), _build_attend_message),
+    "build_dice_message": (("users",), _build_dice_message),
+    "price_stats": (("users", "events"), _command("price_stats", "/price_stats")),
+    "show_users": (("users", "events"), _command("show_users", "/users")),
+    "save_state (all changed)": (("chats", "users", "events"), _save_state("all")),
+    "save_state (one changed)": (("chats", "users", "events"), _save_state("one")),
+    "load_state": (("chats", "users", "events"), _load_state),
+    "inline_query": ((), _inline_query),
+    "command_dispatch": (("chats",), _command_dispatch),
+}
+
+
+@contextmanager
+def _silenced() -> Iterator[None]:
+    """
+    Sends everything written to stdout (the bot logs every step on DEBUG) to /dev/null, the logging still costs the
+    same as in production.
+    """
+    sys.stdout.flush()
+    stdout = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(stdout, 1)
+        os.close(stdout)
+        os.close(devnull)
+
+
+def _time(func: Callable[[], Any], min_time: float, repeat: int) -> Dict[str, Any]:
+    timer = timeit.Timer(func)
+    # Warm up (e.g. lazily deserialized events) and find a number of calls which takes at least `min_time`
+    func()
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+
+    times = [duration / number for duration in timer.repeat(repeat, number)]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times)
+    }
+
+
+def run(grid: Dict[str, List[int]], selected: Optional[List[str]] = None, min_time: float = 0.1,
+        repeat: int = 5) -> List[Dict[str, Any]]:
+    """
+    :param grid: Parameter -> values, every benchmark runs for each combination of the parameters it depends on
+    :param selected: Only run the benchmarks whose name contains one of these
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = Fixtures(directory)
+        for name, (parameters, setup) in BENCHMARKS.items():
+            if selected and not any(pattern in name for pattern in selected):
+                continue
+
+            for values in itertools.product(*(grid[parameter] for parameter in parameters)):
+                params = dict(zip(parameters, values))
+                with _silenced():
+                    timing = _time(setup(fixtures, **params), min_time, repeat)
+
+                result = dict(name=name, params=params, **timing)
+                _print(result)
+                results.append(result)
+
+    return results
+
+
+def _key(result: Dict[str, Any]) -> str:
+    return result["name"] + "".join(f" {key}={value}" for key, value in sorted(result["params"].items()))
+
+
+def _format(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:8.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:8.1f}ms"
+
+    return f"{seconds:8.2f}s "
+
+
+def _print(result: Dict[str, Any]) -> None:
+    print(f"{_key(result):<56} {_format(result['min'])} {_format(result['median'])}", flush=True)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPOSITORY,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict[str, Any]], previous: List[Dict[str, Any]]) -> None:
+    previous_by_key = {_key(result): result for result in previous}
+    print(f"\n{'':<56} {'median':>10} {'before':>10} {'ratio':>7}")
+    for result in results:
+        before = previous_by_key.get(_key(result))
+        if before:
+            print(f"{_key(result):<56} {_format(result['median'])} {_format(before['median'])} "
+                  f"{result['median'] / before['median']:6.2f}x")
+
+
+def _values(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=_values, default=[1, 20], help="Comma separated chat counts")
+    parser.add_argument("--users", type=_values, default=[10, 40], help="Comma separated users per chat")
+    parser.add_argument("--events", type=_values, default=[50, 250], help="Comma separated events per chat")
+    parser.add_argument("--messages", type=_values, default=[10, 100], help="Comma separated messages per user")
+    parser.add_argument("--min-time", type=float, default=0.1, help="Minimum seconds per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="Measurements per benchmark")
+    parser.add_argument("--only", nargs="+", help="Only run the benchmarks whose name contains one of these")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    parser.add_argument("--compare", help="Compare the medians with the results of a previous run")
+    args = parser.parse_args()
+
+    grid = {parameter: getattr(args, parameter) for parameter in PARAMETERS}
+    print(f"{'':<56} {'min':>10} {'median':>10}")
+    results = run(grid, args.only, args.min_time, args.repeat)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "grid": grid,
+                "results": results
+            }, f, indent=2)
+
+    sys.stdout.flush()
+    # Pending mute timers would keep the process alive
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
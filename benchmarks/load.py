@@ -0,0 +1,267 @@
+"""
+Starts the bot (`main.py`) against `FakeTelegram` and simulates chats whose users vote, roll dice, chat and run
+commands. Reports the end-to-end latency (update queued until the first API call the bot makes in response) per kind
+of update and the throughput.
+
+    python -m benchmarks.load --chats 20 --users 10 --actions 50
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from threading import Thread
+from typing import Dict, Any, List, Optional, Iterator
+
+from .fake_telegram import FakeTelegram, Call
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:load-test"
+COMMANDS = ["/users", "/price_stats", "/status", "/show_dice", "/server_time", "/remind_me"]
+# kind -> weight
+ACTIONS = {"vote": 0.25, "dice": 0.25, "chat": 0.35, "command": 0.15}
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def _chat(chat_id: int) -> Dict[str, Any]:
+    return {"id": chat_id, "type": "group", "title": f"load test {chat_id}"}
+
+
+class SimulatedChat:
+    """
+    Sends the updates of one chat one after another and waits for the bot's response to each of them.
+    """
+
+    def __init__(self, fake: FakeTelegram, chat_id: int, users: int, rng: random.Random, timeout: float):
+        self.fake = fake
+        self.chat = _chat(chat_id)
+        self.users = [_user(abs(chat_id) * 10000 + i) for i in range(users)]
+        self.rng = rng
+        self.timeout = timeout
+        self.listener: "queue.Queue[Call]" = fake.listen("chat", chat_id)
+        self.latencies: Dict[str, List[float]] = {kind: [] for kind in ACTIONS}
+        self.sent = 0
+        self.timeouts = 0
+
+    def message(self, user: Dict[str, Any], text: str) -> Dict[str, Any]:
+        message = {
+            "message_id": self.fake.next_message_id(),
+            "from": user,
+            "chat": self.chat,
+            "date": int(time.time()),
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+
+        return {"message": message}
+
+    def callback(self, user: Dict[str, Any], data: str) -> Dict[str, Any]:
+        return {
+            "callback_query": {
+                "id": f"{self.chat['id']}_{self.sent}",
+                "from": user,
+                "chat_instance": str(self.chat["id"]),
+                "data": data,
+                "message": {"message_id": 1, "from": {"id": 1000, "is_bot": True, "first_name": "Regular Dicers"},
+                            "chat": self.chat, "date": int(time.time()), "text": "keyboard"}
+            }
+        }
+
+    def send(self, kind: str, update: Dict[str, Any]) -> None:
+        query = update.get("callback_query")
+        if query:
+            self.fake.listen("query", query["id"], self.listener)
+
+        # Drop late calls for previous updates
+        while not self.listener.empty():
+            self.listener.get_nowait()
+
+        start = time.perf_counter()
+        self.fake.push_update(update)
+        self.sent += 1
+
+        try:
+            # Plain messages (spam detection) usually don't cause any calls
+            if kind != "chat":
+                call = self.listener.get(timeout=self.timeout)
+                self.latencies[kind].append(call.time - start)
+        except queue.Empty:
+            self.timeouts += 1
+        finally:
+            if query:
+                self.fake.forget("query", query["id"])
+
+    def step(self) -> None:
+        kind = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        user = self.rng.choice(self.users)
+
+        if kind == "vote":
+            update = self.callback(user, self.rng.choice(["attend_True"] * 3 + ["attend_False"]))
+        elif kind == "dice":
+            update = self.callback(user, "dice_" + self.rng.choice(["1", "2", "3", "4", "5", "6", "+1", "alcoholic"]))
+        elif kind == "command":
+            update = self.message(user, self.rng.choice(COMMANDS))
+        else:
+            update = self.message(user, self.rng.choice(["Prost", "Wer kommt heute?", "🎲", "Bin dabei"]))
+
+        self.send(kind, update)
+
+    def run(self, actions: int, think: float) -> None:
+        self.send("command", self.message(self.users[0], "/remind_me"))
+        for _ in range(actions):
+            if think:
+                time.sleep(self.rng.expovariate(1 / think))
+            self.step()
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def summarize(latencies: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(latencies),
+        "p50": _percentile(latencies, 50),
+        "p90": _percentile(latencies, 90),
+        "p99": _percentile(latencies, 99),
+        "max": max(latencies, default=0.0)
+    }
+
+
+def write_config(directory: str, overrides: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    """
+    Writes the repository's config with the state and every other file in `directory`.
+
+    :param overrides: Section -> options to override
+    :return: The path of the config file
+    """
+    with open(os.path.join(REPOSITORY, "config.json")) as f:
+        config = json.load(f)
+
+    config["state"] = dict(config.get("state", {}), directory=os.path.join(directory, "state"),
+                           legacy_file=os.path.join(directory, "state.json"))
+    config["archive"] = dict(config.get("archive", {}), directory=os.path.join(directory, "archive"))
+    config["outbox"] = dict(config.get("outbox", {}), filename=os.path.join(directory, "outbox.json"), enabled=False)
+    config["recording"] = dict(config.get("recording", {}), filename=None)
+    config["logging"] = dict(config.get("logging", {}), directory=os.path.join(directory, "logs"))
+    config["profiling"] = dict(config.get("profiling", {}), directory=os.path.join(directory, "profiles"))
+    for section, options in (overrides or {}).items():
+        config[section] = dict(config.get(section, {}), **options)
+
+    filename = os.path.join(directory, "config.json")
+    with open(filename, "w") as f:
+        json.dump(config, f)
+
+    return filename
+
+
+@contextmanager
+def running_bot(fake: FakeTelegram, overrides: Optional[Dict[str, Dict[str, Any]]] = None,
+                bot_log: Optional[str] = None) -> Iterator[subprocess.Popen]:
+    """
+    Runs `main.py` against `fake` with a temporary state (see `write_config`) until the context is left,
+    `fake` is stopped afterwards.
+    """
+    with tempfile.TemporaryDirectory() as directory, open(bot_log or os.devnull, "w") as log:
+        config_file = write_config(directory, overrides)
+        process = subprocess.Popen(
+            [sys.executable, "-O", "main.py", "--base-url", fake.base_url, "--config", config_file],
+            cwd=REPOSITORY, env=dict(os.environ, BOT_TOKEN=TOKEN), stdout=log, stderr=subprocess.STDOUT
+        )
+        try:
+            if not fake.polling.wait(60):
+                raise TimeoutError("The bot didn't start polling within 60s")
+
+            yield process
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                # Pending mute timers keep the process alive
+                process.kill()
+            fake.stop()
+
+
+def run(chats: int, users: int, actions: int, think: float = 0, timeout: float = 10, seed: int = 0,
+        bot_log: Optional[str] = None) -> Dict[str, Any]:
+    fake = FakeTelegram().start()
+    rng = random.Random(seed)
+    simulated = [SimulatedChat(fake, -(i + 1), users, random.Random(rng.random()), timeout) for i in range(chats)]
+
+    with running_bot(fake, bot_log=bot_log):
+        threads = [Thread(target=chat.run, args=(actions, think), daemon=True) for chat in simulated]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+
+    latencies: Dict[str, List[float]] = {kind: [] for kind in ACTIONS}
+    for chat in simulated:
+        for kind, values in chat.latencies.items():
+            latencies[kind].extend(values)
+
+    sent = sum(chat.sent for chat in simulated)
+    result = {
+        "chats": chats,
+        "users": users,
+        "actions": actions,
+        "seconds": duration,
+        "updates": sent,
+        "timeouts": sum(chat.timeouts for chat in simulated),
+        "updates_per_second": sent / duration,
+        "latency": {kind: summarize(values) for kind, values in latencies.items() if values},
+        "api_calls": dict(fake.counts)
+    }
+    result["latency"]["all"] = summarize([value for values in latencies.values() for value in values])
+
+    return result
+
+
+def _print(result: Dict[str, Any]) -> None:
+    print(f"{result['chats']} chats x {result['users']} users, {result['updates']} updates in "
+          f"{result['seconds']:.1f}s: {result['updates_per_second']:.1f} updates/s, {result['timeouts']} timeouts")
+    print(f"{'':<10} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for kind, summary in result["latency"].items():
+        print(f"{kind:<10} {summary['count']:>7} " + " ".join(f"{summary[key] * 1000:7.1f}ms"
+                                                             for key in ("p50", "p90", "p99", "max")))
+    print("API calls: " + ", ".join(f"{method} {count}" for method, count in sorted(result["api_calls"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--actions", type=int, default=50, help="Updates per chat")
+    parser.add_argument("--think", type=float, default=0, help="Mean pause between the updates of a chat in seconds")
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds to wait for a response")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bot-log", help="Write the bot's output to this file")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    result = run(args.chats, args.users, args.actions, args.think, args.timeout, args.seed, args.bot_log)
+    _print(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Measures the memory used per `User`, `Event` and `Chat` with `tracemalloc`.
+
+    python -m benchmarks.memory --count 10000
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Any, List
+
+from dicers_bot.chat import Chat
+from dicers_bot.event import Event
+from dicers_bot.user import User
+from .synthetic import synthetic_user, synthetic_event, synthetic_chat
+
+
+def _bytes_per_object(create: Callable[[], Any], count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    objects = [create() for _ in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del objects
+    return (after - before) / count
+
+
+def run(count: int, users_per_event: int = 10) -> List[Dict[str, Any]]:
+    rng = random.Random(0)
+    serialized_user = synthetic_user(1, rng)
+    users = [synthetic_user(i, rng) for i in range(users_per_event)]
+    serialized_event = synthetic_event(datetime(2019, 1, 7), users, rng)
+    empty_event = synthetic_event(datetime(2019, 1, 7), [], rng)
+    serialized_chat = synthetic_chat(-1, 0, 0, rng)
+    serialized_chat["current_event"] = None
+
+    measurements = [
+        ("user", count, lambda: User.deserialize(serialized_user)),
+        ("event (empty)", count, lambda: Event.deserialize(empty_event)),
+        (f"event ({users_per_event} votes)", count // 10, lambda: Event.deserialize(serialized_event)),
+        ("chat (empty)", count // 10, lambda: Chat.deserialize(serialized_chat, None)),
+    ]
+
+    results = []
+    for name, n, create in measurements:
+        per_object = _bytes_per_object(create, n)
+        print(f"{name:<20} {per_object:10.0f} bytes")
+        results.append({"name": name, "count": n, "bytes_per_object": per_object})
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+
+    run(args.count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Measures how long attend votes (callback queries) take to be answered while the bot works through a flood of plain
+text messages, with and without the priority lanes of the worker pool.
+
+    python -m benchmarks.priority --rate 1500 --callbacks 20 --workers 2
+"""
+import argparse
+import json
+import random
+import time
+from threading import Thread, Event
+from typing import Dict, Any, Optional
+
+from .fake_telegram import FakeTelegram
+from .load import SimulatedChat, running_bot, summarize
+
+
+def run(lanes: bool, rate: float, flood_chats: int, callbacks: int, workers: int, timeout: float = 30,
+        seed: int = 0, bot_log: Optional[str] = None) -> Dict[str, Any]:
+    """
+    :param rate: Plain text messages per second sent while the votes are sent one after another
+    """
+    fake = FakeTelegram().start()
+    rng = random.Random(seed)
+    flooders = [SimulatedChat(fake, -(i + 1), 10, random.Random(rng.random()), timeout) for i in range(flood_chats)]
+    voters = SimulatedChat(fake, -(flood_chats + 1), 10, random.Random(rng.random()), timeout)
+
+    overrides = {"workers": {"lanes": lanes, "adaptive": False, "workers": workers}}
+    with running_bot(fake, overrides, bot_log):
+        voters.send("command", voters.message(voters.users[0], "/remind_me"))
+
+        stopped = Event()
+        sent = [0]
+
+        def _flood():
+            flood_rng = random.Random(seed)
+            while not stopped.wait(0.01):
+                due = int((time.perf_counter() - start) * rate)
+                for i in range(sent[0], due):
+                    chat = flooders[i % flood_chats]
+                    fake.push_update(chat.message(flood_rng.choice(chat.users), f"Nachricht {i}"))
+                sent[0] = max(sent[0], due)
+
+        start = time.perf_counter()
+        flood = Thread(target=_flood, daemon=True)
+        flood.start()
+        # Let a backlog build up
+        time.sleep(1)
+        for _ in range(callbacks):
+            voters.send("vote", voters.callback(rng.choice(voters.users), rng.choice(["attend_True", "attend_False"])))
+            time.sleep(0.05)
+        stopped.set()
+        flood.join()
+        duration = time.perf_counter() - start
+
+    return {
+        "lanes": lanes,
+        "workers": workers,
+        "rate": rate,
+        "flood": sent[0],
+        "callbacks": callbacks,
+        "seconds": duration,
+        "timeouts": voters.timeouts,
+        "callback_latency": summarize(voters.latencies["vote"])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=1500, help="Plain text messages per second")
+    parser.add_argument("--flood-chats", type=int, default=20)
+    parser.add_argument("--callbacks", type=int, default=20, help="Votes sent one after another during the flood")
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds to wait for a vote to be answered")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--bot-log", help="Write the bot's output to this file")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'lanes':<6} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'timeouts':>9} {'flood':>7}")
+    for lanes in (False, True):
+        result = run(lanes, args.rate, args.flood_chats, args.callbacks, args.workers, args.timeout,
+                     bot_log=args.bot_log)
+        summary = result["callback_latency"]
+        print(f"{'on' if lanes else 'off':<6} {summary['count']:>7} "
+              + " ".join(f"{summary[key] * 1000:7.1f}ms" for key in ("p50", "p90", "p99", "max"))
+              + f" {result['timeouts']:>9} {result['flood']:>7}")
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
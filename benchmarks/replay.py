@@ -0,0 +1,221 @@
+"""
+Feeds a recording of `UpdateRecorder` into the dispatcher with the bot's handlers, with a stubbed Telegram API
+instead of the network. Reports the handler latencies per command/kind of update and optionally compares the final
+state of the chats with a previous run.
+
+    python -m benchmarks.replay updates.jsonl --speed 10 --save-state replayed.json
+    python -m benchmarks.replay updates.jsonl --speed 0 --compare replayed.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List, Optional
+
+import telegram
+from telegram import Update, TelegramError
+from telegram.ext import Updater
+
+from dicers_bot import Bot
+from dicers_bot.recorder import read_recording
+from main import register_handlers
+from .fake_telegram import FakeBotApi
+from .load import TOKEN, summarize, write_config
+
+DATE_KEYS = {"date", "edit_date", "forward_date"}
+
+
+class StubRequest:
+    """
+    Drop-in for `telegram.utils.request.Request` which answers from a `FakeBotApi` instead of Telegram.
+    """
+    con_pool_size = 8
+
+    def __init__(self, api: FakeBotApi):
+        self.api = api
+
+    def post(self, url: str, data: Optional[Dict[str, Any]], timeout: Optional[float] = None) -> Any:
+        response = self.api.handle(url.rsplit("/", 1)[-1], dict(data or {}))
+        if not response["ok"]:
+            raise TelegramError(response["description"])
+
+        return response["result"]
+
+    def get(self, url: str, timeout: Optional[float] = None) -> Any:
+        return self.post(url, None, timeout)
+
+    def stop(self) -> None:
+        pass
+
+
+def _shift_dates(value: Any, delta: int) -> Any:
+    if isinstance(value, list):
+        return [_shift_dates(item, delta) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    return {key: item + delta if key in DATE_KEYS and isinstance(item, int) else _shift_dates(item, delta)
+            for key, item in value.items()}
+
+
+def _kind(update: Update) -> str:
+    if update.callback_query:
+        return f"callback {(update.callback_query.data or '').split('_')[0]}"
+    if update.inline_query:
+        return "inline_query"
+
+    message = update.effective_message
+    if message and message.text and message.text.startswith("/"):
+        return message.text.split()[0].split("@")[0]
+    if message:
+        return "message"
+
+    return "other"
+
+
+def _normalize(value: Any) -> Any:
+    """
+    Sorts lists of objects with an `id` (serialized sets of users) so they can be compared.
+    """
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [_normalize(item) for item in value]
+        if all(isinstance(item, dict) and "id" in item for item in items):
+            items.sort(key=lambda item: item["id"])
+        return items
+
+    return value
+
+
+def diff_states(expected: Dict[str, Any], actual: Dict[str, Any]) -> List[str]:
+    """
+    :return: A line per chat which is missing, unexpected or has a different value for a key
+    """
+    differences = []
+    for chat_id in sorted(set(expected) | set(actual)):
+        if chat_id not in actual:
+            differences.append(f"{chat_id}: missing")
+        elif chat_id not in expected:
+            differences.append(f"{chat_id}: unexpected")
+        else:
+            for key in sorted(set(expected[chat_id]) | set(actual[chat_id])):
+                before, after = _normalize(expected[chat_id].get(key)), _normalize(actual[chat_id].get(key))
+                if before == after:
+                    continue
+
+                if isinstance(before, list) and isinstance(after, list):
+                    differences.append(f"{chat_id}: {key} differs ({len(before)} items expected, got {len(after)})")
+                else:
+                    differences.append(f"{chat_id}: {key} differs ({before!r} expected, got {after!r})")
+
+    return differences
+
+
+def replay(recording: str, speed: float = 1, state: Optional[str] = None) -> Dict[str, Any]:
+    """
+    :param speed: Multiple of the recorded pace, `0` to replay as fast as possible
+    :param state: State directory to start from (copied, it isn't modified)
+    """
+    entries = list(read_recording(recording))
+    if not entries:
+        raise ValueError(f"{recording} doesn't contain any updates")
+
+    api = FakeBotApi()
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = write_config(directory)
+        if state:
+            shutil.copytree(state, os.path.join(directory, "state"))
+
+        updater = Updater(bot=telegram.Bot(TOKEN, request=StubRequest(api)), use_context=True)
+        bot = Bot(updater, config_file)
+        register_handlers(updater.dispatcher, bot)
+        bot.load_state()
+
+        latencies: Dict[str, List[float]] = {}
+        delays: List[float] = []
+        first = entries[0][0]
+        # Move the message dates to the time of the replay, so time based checks (spam, mutes) behave as recorded
+        delta = int(time.time() - first)
+        start = time.perf_counter()
+        for recorded, content in entries:
+            scheduled = start + (recorded - first) / speed if speed else time.perf_counter()
+            pause = scheduled - time.perf_counter()
+            if pause > 0:
+                time.sleep(pause)
+
+            update = Update.de_json(_shift_dates(content, delta), updater.bot)
+            handler_start = time.perf_counter()
+            updater.dispatcher.process_update(update)
+            end = time.perf_counter()
+
+            latencies.setdefault(_kind(update), []).append(end - handler_start)
+            delays.append(end - scheduled)
+
+        duration = time.perf_counter() - start
+        chats = {str(chat_id): chat.serialize() for chat_id, chat in bot.chats.items()}
+
+    return {
+        "recording": recording,
+        "speed": speed,
+        "updates": len(entries),
+        "seconds": duration,
+        "updates_per_second": len(entries) / duration if duration else 0.0,
+        "latency": {kind: summarize(values) for kind, values in sorted(latencies.items())},
+        # Time from the scheduled arrival until the update has been handled, includes waiting for previous updates
+        "delay": summarize(delays),
+        "api_calls": dict(api.counts),
+        "chats": chats
+    }
+
+
+def _print(result: Dict[str, Any]) -> None:
+    print(f"{result['updates']} updates at {result['speed'] or 'max'}x in {result['seconds']:.1f}s: "
+          f"{result['updates_per_second']:.1f} updates/s")
+    print(f"{'':<24} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for kind, summary in list(result["latency"].items()) + [("delay", result["delay"])]:
+        print(f"{kind:<24} {summary['count']:>7} " + " ".join(f"{summary[key] * 1000:7.1f}ms"
+                                                             for key in ("p50", "p90", "p99", "max")))
+    print("API calls: " + ", ".join(f"{method} {count}" for method, count in sorted(result["api_calls"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=float, default=1, help="Multiple of the recorded pace, 0 for max speed")
+    parser.add_argument("--state", help="State directory to start from")
+    parser.add_argument("--save-state", help="Write the final state of the chats to this file")
+    parser.add_argument("--compare", help="Compare the final state of the chats with this file")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    result = replay(args.recording, args.speed, args.state)
+    _print(result)
+
+    if args.save_state:
+        with open(args.save_state, "w") as f:
+            json.dump(result["chats"], f, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    differences = []
+    if args.compare:
+        with open(args.compare) as f:
+            differences = diff_states(json.load(f), result["chats"])
+
+        print(f"{len(differences)} differences to {args.compare}")
+        for difference in differences:
+            print(f"  {difference}")
+
+    sys.stdout.flush()
+    # Pending mute timers would keep the process alive
+    os._exit(1 if differences else 0)
+
+
+if __name__ == "__main__":
+    main()
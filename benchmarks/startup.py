@@ -0,0 +1,83 @@
+"""
+Measures how long loading a (large) state file takes and how much memory it needs.
+
+    python -m benchmarks.startup --chats 50 --users 40 --events 250
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Any
+
+from dicers_bot.chat import Chat
+from dicers_bot.chat_store import ChatStore
+from .synthetic import synthetic_state
+
+
+def _measure(name: str, load: Callable[[], Any]) -> Dict[str, Any]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del result
+    print(f"{name:<24} {duration * 1000:10.1f}ms {peak / 2 ** 20:10.1f}MiB")
+
+    return {"name": name, "seconds": duration, "peak_bytes": peak}
+
+
+def run(chats: int, users: int, events: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        state_file = os.path.join(directory, "state.json")
+        with open(state_file, "w") as f:
+            json.dump(synthetic_state(chats, users, events), f)
+
+        print(f"{chats} chats, {users} users, {events} events: {os.path.getsize(state_file) / 2 ** 20:.1f}MiB")
+
+        def _read():
+            with open(state_file) as file:
+                return json.load(file)
+
+        def _eager():
+            state = _read()
+            result = {serialized["id"]: Chat.deserialize(serialized, None) for serialized in state["chats"]}
+            for chat in result.values():
+                assert chat.events is not None
+
+            return result
+
+        def _lazy():
+            return ChatStore(None, _read()["chats"])
+
+        def _lazy_one_chat():
+            store = _lazy()
+            store[next(iter(store))]
+
+            return store
+
+        results = [
+            _measure("json.load", _read),
+            _measure("eager (all events)", _eager),
+            _measure("lazy", _lazy),
+            _measure("lazy, one chat accessed", _lazy_one_chat),
+        ]
+
+    return {"chats": chats, "users": users, "events": events, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--events", type=int, default=250)
+    args = parser.parse_args()
+
+    run(args.chats, args.users, args.events)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+Stress test of the bot's concurrency, in-process with a stubbed Telegram API. Producer threads send the updates of
+many chats (attend votes, dice rolls, plain messages and commands) through the worker pool while other threads mute
+users with short timers (which unmute them when they expire), run the scheduled jobs and save the state.
+
+Every round has a vote phase (jobs: `remind_users` and `show_dice_keyboards`) and a reset phase (job: `reset_all`,
+no votes or rolls). After each phase the bot is left to settle and the invariants are checked:
+
+- no exception in a handler, job, timer or while saving (e.g. "dictionary changed size during iteration")
+- no lost votes: the attendance of every voter is the last vote they've sent, everybody who rolls attends
+- nobody is attendee and absentee of the same event
+- after `reset_all` there are no events and no rolls
+- the saved state equals the state in memory (after the last round)
+
+Reports the throughput per phase. The exit status is 1 if an invariant has been violated.
+
+    python -m benchmarks.stress --chats 8 --users 12 --producers 6 --rounds 3 --duration 2
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+import telegram
+from telegram import Update
+from telegram.ext import Updater
+
+from dicers_bot import Bot
+from dicers_bot.chat import Chat
+from dicers_bot.state import StateStore
+from main import register_handlers
+from .fake_telegram import FakeBotApi
+from .load import TOKEN, write_config
+from .replay import StubRequest, diff_states
+
+COMMANDS = ["/users", "/price_stats", "/status", "/server_time"]
+DICE = ["dice_1", "dice_2", "dice_3", "dice_4", "dice_5", "dice_6", "dice_+1", "dice_alcoholic"]
+
+
+class StressTest:
+    """
+    A `Bot` with its handlers and worker pool, `chats` chats of `users` users each. Every third user of a chat votes
+    to attend once per vote phase and rolls afterwards, the other users change their vote.
+    """
+
+    def __init__(self, directory: str, chats: int, users: int, workers: int, seed: int, max_backlog: int,
+                 idle_time: Optional[float] = None):
+        overrides: Dict[str, Dict[str, Any]] = {
+            "workers": {"workers": workers, "adaptive": False},
+            "logging": {"level": "CRITICAL", "flight_recorder": False},
+        }
+        if idle_time is not None:
+            overrides["state"] = {"idle_time": idle_time, "max_loaded_chats": max(1, chats // 2)}
+
+        self.directory = directory
+        self.api = FakeBotApi()
+        self.updater = Updater(bot=telegram.Bot(TOKEN, request=StubRequest(self.api)), use_context=True)
+        self.bot = Bot(self.updater, write_config(directory, overrides))
+        register_handlers(self.updater.dispatcher, self.bot)
+        self.updater.dispatcher.add_error_handler(lambda update, context: self.error("handler", context.error))
+        self.bot.worker_pool.attach(self.updater.dispatcher)
+        self.bot.worker_pool.start()
+        self.bot.load_state()
+
+        self.chat_ids = [-(i + 1) for i in range(chats)]
+        self.bot.state["main_id"] = self.chat_ids[0]
+        self.users = {chat_id: [abs(chat_id) * 10000 + i for i in range(users)] for chat_id in self.chat_ids}
+        self.rng = random.Random(seed)
+        self.max_backlog = max_backlog
+        self.submitted = 0
+        self.counts: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.violations: List[str] = []
+        # (chat id, user id) -> last vote sent
+        self.votes: Dict[Tuple[int, int], bool] = {}
+        self._lock = threading.Lock()
+        self._update_ids = itertools.count(1)
+
+    @staticmethod
+    def is_voter(user_id: int) -> bool:
+        return user_id % 3 != 0
+
+    def error(self, source: str, error: BaseException) -> None:
+        with self._lock:
+            key = f"{source}: {type(error).__name__}: {error}"
+            if key not in self.errors:
+                trace = "".join(traceback.format_exception(type(error), error, error.__traceback__)[-3:])
+                print(f"{key}\n{trace}", file=sys.stderr)
+            self.errors[key] += 1
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            self.counts[kind] += 1
+
+    def submit(self, payload: Dict[str, Any]) -> None:
+        # Don't let the backlog grow without bounds, the throughput is what the pool gets through
+        while self.submitted - self.bot.worker_pool.stats()["processed"] > self.max_backlog:
+            time.sleep(0.001)
+
+        update = Update.de_json(dict(payload, update_id=next(self._update_ids)), self.updater.bot)
+        with self._lock:
+            self.submitted += 1
+        self.updater.dispatcher.process_update(update)
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def message(self, chat_id: int, user_id: int, text: str) -> Dict[str, Any]:
+        message = {
+            "message_id": self.api.next_message_id(),
+            "from": self._user(user_id),
+            "chat": {"id": chat_id, "type": "group", "title": f"stress {chat_id}"},
+            "date": int(time.time()),
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+
+        return {"message": message}
+
+    def callback(self, chat_id: int, user_id: int, data: str) -> Dict[str, Any]:
+        return {
+            "callback_query": {
+                "id": str(self.api.next_message_id()),
+                "from": self._user(user_id),
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": {"message_id": 1, "from": {"id": 1000, "is_bot": True, "first_name": "Regular Dicers"},
+                            "chat": {"id": chat_id, "type": "group", "title": f"stress {chat_id}"},
+                            "date": int(time.time()), "text": "keyboard"}
+            }
+        }
+
+    def settle(self, timeout: float = 60) -> bool:
+        """
+        Waits until the worker pool has handled every submitted update.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stats = self.bot.worker_pool.stats()
+            if stats["processed"] >= self.submitted and not stats["busy"]:
+                return True
+            time.sleep(0.01)
+
+        self.violations.append(f"{self.submitted - self.bot.worker_pool.stats()['processed']} updates still pending "
+                               f"after {timeout}s")
+        return False
+
+    def setup(self) -> None:
+        for chat_id in self.chat_ids:
+            self.submit(self.message(chat_id, self.users[chat_id][0], "/remind_me"))
+            for user_id in self.users[chat_id]:
+                self.submit(self.message(chat_id, user_id, "Hallo"))
+        self.settle()
+
+    # Actors, each runs until `stopped` is set
+
+    def _produce(self, owned: List[Tuple[int, int]], votes: bool, seed: int, stopped: threading.Event) -> None:
+        rng = random.Random(seed)
+        attending = set()
+        while not stopped.is_set():
+            chat_id, user_id = rng.choice(owned)
+            kind = rng.choices(["vote", "chat", "command"], weights=[0.5 if votes else 0, 0.35, 0.15])[0]
+            if kind == "vote" and not self.is_voter(user_id):
+                if (chat_id, user_id) in attending:
+                    self.submit(self.callback(chat_id, user_id, rng.choice(DICE)))
+                    self._count("dice")
+                    continue
+
+                attending.add((chat_id, user_id))
+                attends = True
+            elif kind == "vote":
+                attends = rng.random() < 0.7
+            elif kind == "chat":
+                self.submit(self.message(chat_id, user_id, rng.choice(["Prost", "Wer kommt heute?", "Bin dabei"])))
+                self._count("message")
+                continue
+            else:
+                self.submit(self.message(chat_id, user_id, rng.choice(COMMANDS)))
+                self._count("command")
+                continue
+
+            # Every user is owned by one producer, its votes are handled in the order they've been sent
+            self.votes[(chat_id, user_id)] = attends
+            self.submit(self.callback(chat_id, user_id, f"attend_{attends}"))
+            self._count("vote")
+
+    def _mute(self, seed: int, stopped: threading.Event) -> None:
+        rng = random.Random(seed)
+        while not stopped.wait(0.002):
+            chat_id = rng.choice(self.chat_ids)
+            chat: Chat = self.bot.chats[chat_id]
+            user = chat.get_user_by_id(rng.choice(self.users[chat_id]))
+            if user and not user.muted:
+                # The timer of `mute_user` unmutes the user again
+                self.bot.mute_user(chat_id, user, timedelta(seconds=rng.uniform(0.005, 0.05)), reason="stress")
+                self._count("mute")
+
+    def _run_jobs(self, jobs: List[Callable[[], Any]], interval: float, stopped: threading.Event) -> None:
+        for job in itertools.cycle(jobs):
+            if stopped.wait(interval):
+                return
+            job()
+            self._count("job")
+
+    def _save(self, stopped: threading.Event) -> None:
+        while not stopped.wait(0.02):
+            self.bot.save_state()
+            # Like an export, reads every chat while the handlers change them
+            for chat in self.bot.chats.loaded():
+                chat.serialize()
+            self._count("save")
+
+    def _guarded(self, source: str, func: Callable, *args) -> threading.Thread:
+        def _run():
+            try:
+                func(*args)
+            except Exception as e:
+                self.error(source, e)
+
+        thread = threading.Thread(target=_run, name=f"stress_{source}", daemon=True)
+        thread.start()
+        return thread
+
+    def phase(self, name: str, duration: float, producers: int, seed: int) -> Dict[str, Any]:
+        votes = name == "vote"
+        if votes:
+            self.votes.clear()
+            self.bot.remind_users(None, None)
+            jobs = [lambda: self.bot.remind_users(None, None), lambda: self.bot.show_dice_keyboards(None, None)]
+        else:
+            jobs = [lambda: self.bot.reset_all(None, None)]
+
+        pairs = [(chat_id, user_id) for chat_id in self.chat_ids for user_id in self.users[chat_id]]
+        processed = self.bot.worker_pool.stats()["processed"]
+        counts = Counter(self.counts)
+        stopped = threading.Event()
+        start = time.perf_counter()
+        threads = [self._guarded("producer", self._produce, pairs[i::producers], votes, seed + i, stopped)
+                   for i in range(producers)]
+        threads.append(self._guarded("timer", self._mute, seed, stopped))
+        threads.append(self._guarded("job", self._run_jobs, jobs, duration / 10, stopped))
+        threads.append(self._guarded("save", self._save, stopped))
+
+        time.sleep(duration)
+        stopped.set()
+        for thread in threads:
+            thread.join()
+        if not votes:
+            # The producers may have sent updates after the last reset
+            self.bot.reset_all(None, None)
+        self.settle()
+        elapsed = time.perf_counter() - start
+        # Let the last mute timers expire
+        time.sleep(0.1)
+
+        violations = len(self.violations)
+        self.check_votes() if votes else self.check_reset()
+        updates = self.bot.worker_pool.stats()["processed"] - processed
+
+        return {
+            "phase": name,
+            "seconds": elapsed,
+            "updates": updates,
+            "updates_per_second": updates / elapsed,
+            "handler_p95": self.bot.worker_pool.stats()["duration_p95"],
+            "counts": dict(self.counts - counts),
+            "threads": threading.active_count(),
+            "violations": len(self.violations) - violations,
+        }
+
+    # Invariants
+
+    def check_votes(self) -> None:
+        for chat_id in self.chat_ids:
+            event = self.bot.chats[chat_id].current_event
+            if event is None:
+                self.violations.append(f"{chat_id}: no event after the vote phase")
+                continue
+
+            attendees = {user.id for user in event.attendees}
+            absentees = {user.id for user in event.absentees}
+            if attendees & absentees:
+                self.violations.append(f"{chat_id}: {sorted(attendees & absentees)} attend and are absent")
+
+            for user_id in self.users[chat_id]:
+                vote = self.votes.get((chat_id, user_id))
+                if vote is None:
+                    continue
+                if vote and user_id not in attendees:
+                    self.violations.append(f"{chat_id}: vote of {user_id} to attend is lost")
+                elif not vote and user_id not in absentees:
+                    self.violations.append(f"{chat_id}: vote of {user_id} to be absent is lost")
+
+            for user in self.bot.chats[chat_id].users:
+                if user.roll != -1 and user.id not in attendees:
+                    self.violations.append(f"{chat_id}: {user.id} has rolled without attending")
+
+    def check_reset(self) -> None:
+        for chat_id in self.chat_ids:
+            chat = self.bot.chats[chat_id]
+            if chat.current_event is not None:
+                self.violations.append(f"{chat_id}: event left after reset_all")
+            rolled = [user.id for user in chat.users if user.roll != -1]
+            if rolled:
+                self.violations.append(f"{chat_id}: {rolled} have a roll after reset_all")
+
+    def check_saved_state(self) -> None:
+        self.bot.save_state()
+        self.bot.state_store.wait()
+        _, saved = StateStore(os.path.join(self.directory, "state")).load(self.updater.bot)
+        memory = {chat_id: self.bot.chats[chat_id].serialize() for chat_id in self.chat_ids}
+        disk = {chat_id: saved[chat_id].serialize() for chat_id in saved}
+        self.violations.extend(f"saved state: {difference}" for difference in diff_states(memory, disk))
+
+
+def run(chats: int, users: int, producers: int, workers: int, rounds: int, duration: float, seed: int = 0,
+        max_backlog: int = 200, idle_time: Optional[float] = None) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        test = StressTest(directory, chats, users, workers, seed, max_backlog, idle_time)
+        test.setup()
+
+        phases = []
+        for i in range(rounds):
+            for name in ("vote", "reset"):
+                result = test.phase(name, duration, producers, seed + i * producers)
+                phases.append(result)
+                print(f"round {i + 1} {name:<6} {result['updates']:7} updates {result['updates_per_second']:8.0f}/s "
+                      f"p95 {result['handler_p95'] * 1000:6.1f}ms {result['threads']:6} threads "
+                      f"{result['violations']:4} violations  {result['counts']}", flush=True)
+
+        test.check_saved_state()
+
+    return {
+        "chats": chats,
+        "users": users,
+        "producers": producers,
+        "workers": workers,
+        "phases": phases,
+        "errors": dict(test.errors),
+        "violations": test.violations,
+        "api_calls": test.api.counts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=8)
+    parser.add_argument("--users", type=int, default=12, help="Users per chat")
+    parser.add_argument("--producers", type=int, default=6, help="Threads sending updates")
+    parser.add_argument("--workers", type=int, default=4, help="Worker threads handling the updates")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=2, help="Seconds per phase")
+    parser.add_argument("--max-backlog", type=int, default=200, help="Updates waiting for a worker at most")
+    parser.add_argument("--idle-time", type=float, help="Evict chats idle for this many seconds (see `ChatStore`)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    result = run(args.chats, args.users, args.producers, args.workers, args.rounds, args.duration, args.seed,
+                 args.max_backlog, args.idle_time)
+
+    for error, count in result["errors"].items():
+        print(f"{count:6}x {error}")
+    for violation in result["violations"][:50]:
+        print(violation)
+    if len(result["violations"]) > 50:
+        print(f"... {len(result['violations']) - 50} more violations")
+    print(f"{sum(result['errors'].values())} errors, {len(result['violations'])} violations")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    sys.stdout.flush()
+    # Pending mute timers would keep the process alive
+    os._exit(1 if result["errors"] or result["violations"] else 0)
+
+
+if __name__ == "__main__":
+    main()
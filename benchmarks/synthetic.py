@@ -0,0 +1,64 @@
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+
+
+def synthetic_user(user_id: int, rng: random.Random) -> Dict[str, Any]:
+    return {
+        "name": f"user{user_id}",
+        "roll": rng.choice([-1, 1, 2, 3, 4, 5, 6]),
+        "jumbo": rng.random() < 0.3,
+        "muted": False,
+        "id": user_id,
+        "alcoholic": rng.random() < 0.9,
+        "drink_name": None
+    }
+
+
+def synthetic_event(timestamp: datetime, users: List[Dict[str, Any]], rng: random.Random) -> Dict[str, Any]:
+    attendees = []
+    absentees = []
+    for user in users:
+        vote = rng.random()
+        if vote < 0.6:
+            attendee = dict(user)
+            attendee["roll"] = rng.randint(1, 6)
+            attendee["jumbo"] = rng.random() < 0.3
+            attendee["alcoholic"] = rng.random() < 0.9
+            attendees.append(attendee)
+        elif vote < 0.8:
+            absentees.append(dict(user))
+
+    return {
+        "timestamp": timestamp.strftime("%d.%m.%Y"),
+        "attendees": attendees,
+        "absentees": absentees
+    }
+
+
+def synthetic_chat(chat_id: int, users: int, events: int, rng: random.Random) -> Dict[str, Any]:
+    chat_users = [synthetic_user(abs(chat_id) * 10000 + i, rng) for i in range(users)]
+    first_monday = datetime(2015, 1, 5)
+
+    return {
+        "id": chat_id,
+        "current_event": synthetic_event(first_monday + timedelta(weeks=events), chat_users, rng),
+        "pinned_message_id": None,
+        "events": [synthetic_event(first_monday + timedelta(weeks=i), chat_users, rng) for i in range(events)],
+        "users": chat_users,
+        "title": f"chat {chat_id}",
+        "spam_detection": True
+    }
+
+
+def synthetic_state(chats: int, users: int, events: int, seed: int = 0) -> Dict[str, Any]:
+    """
+    Builds a state in the legacy single file format (`state.json`, which `StateStore` migrates) with `chats` chats
+    with `users` users and `events` weekly historical events each.
+    """
+    rng = random.Random(seed)
+
+    return {
+        "main_id": -1,
+        "chats": [synthetic_chat(-(i + 1), users, events, rng) for i in range(chats)]
+    }
@@ -1,2 +1,11 @@
-from .bot import Bot
 from .logger import create_logger
+
+
+def __getattr__(name: str):
+    # `bot` imports every module and `telegram.ext`, e.g. `dicers_bot.startup` can be imported without them
+    if name == "Bot":
+        from .bot import Bot
+
+        return Bot
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
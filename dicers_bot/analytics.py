@@ -0,0 +1,248 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+# `numpy` once it has been imported, `False` if it isn't installed
+_numpy: Any = None
+
+
+def get_numpy() -> Any:
+    """
+    :return: The `numpy` module or `None` if it isn't installed. It's imported on first use, since importing it takes
+             longer than importing the rest of the bot.
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+
+    return _numpy or None
+
+
+@dataclass
+class RollHistogram:
+    # Number of rolls of 1 to 6
+    rolls: List[int]
+    # Rolls with a jumbo
+    jumbo: int
+    # Attendances without alcohol
+    non_alcoholic: int
+
+
+@dataclass
+class WeekdayStats:
+    weekday: int
+    events: int
+    average_attendees: float
+    # `None` if nobody has rolled at an event on this weekday
+    average_price: Optional[float]
+
+
+class EventHistory:
+    """
+    Views of the (serialized) events of a chat as matrices with a row per event, oldest first, and a column per user
+    (`user_ids`) who has attended or been absent at least once:
+
+    - `attendance`: 1 attended, -1 absent, 0 didn't vote
+    - `rolls`: 1 to 6, 0 if the user hasn't rolled (or attended)
+    - `jumbo`, `alcoholic`: the flags of the attendees
+
+    With `vectorized` and NumPy (see `get_numpy`) the views are arrays and the statistics are computed with vectorized
+    operations, otherwise they are lists of rows and the statistics are computed in pure Python. Both return the same
+    results as plain Python values.
+    """
+
+    def __init__(self, events: Iterable[Dict[str, Any]], vectorized: bool = True):
+        self.np = get_numpy() if vectorized else None
+        self.user_ids: List[int] = []
+        # User id -> name at the last event
+        self.names: Dict[int, str] = {}
+        user_columns: Dict[int, int] = {}
+        days: List[int] = []
+        # Cells of the attendees and of the absentees, a list per field
+        attended: Tuple[List[int], ...] = ([], [], [], [], [])
+        absent: Tuple[List[int], List[int]] = ([], [])
+        rows, columns, rolls, jumbos, alcoholics = attended
+
+        def _column(user: Dict[str, Any]) -> int:
+            column = user_columns.get(user["id"])
+            if column is None:
+                column = user_columns[user["id"]] = len(self.user_ids)
+                self.user_ids.append(user["id"])
+            self.names[user["id"]] = user.get("name")
+
+            return column
+
+        for row, event in enumerate(events):
+            # `Event.date_format`, `strptime` would take most of the time
+            day, month, year = event["timestamp"].split(".")
+            days.append(date(int(year), int(month), int(day)).toordinal())
+            for user in event.get("attendees", []):
+                rows.append(row)
+                columns.append(_column(user))
+                rolls.append(max(int(user.get("roll", -1)), 0))
+                jumbos.append(bool(user.get("jumbo")))
+                alcoholics.append(bool(user.get("alcoholic", True)))
+            for user in event.get("absentees", []):
+                absent[0].append(row)
+                absent[1].append(_column(user))
+
+        shape = (len(days), len(self.user_ids))
+        if self.np is not None:
+            np = self.np
+            self.days = np.array(days, dtype=np.int64)
+            self.attendance = np.zeros(shape, dtype=np.int8)
+            self.rolls = np.zeros(shape, dtype=np.int8)
+            self.jumbo = np.zeros(shape, dtype=bool)
+            self.alcoholic = np.zeros(shape, dtype=bool)
+            absent_cells = (np.array(absent[0], dtype=np.intp), np.array(absent[1], dtype=np.intp))
+            attended_cells = (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp))
+            self.attendance[absent_cells] = -1
+            self.attendance[attended_cells] = 1
+            self.rolls[attended_cells] = rolls
+            self.jumbo[attended_cells] = jumbos
+            self.alcoholic[attended_cells] = alcoholics
+        else:
+            self.days = days
+            self.attendance = [[0] * shape[1] for _ in days]
+            self.rolls = [[0] * shape[1] for _ in days]
+            self.jumbo = [[False] * shape[1] for _ in days]
+            self.alcoholic = [[False] * shape[1] for _ in days]
+            for row, column in zip(*absent):
+                self.attendance[row][column] = -1
+            for row, column, roll, jumbo, alcoholic in zip(*attended):
+                self.attendance[row][column] = 1
+                self.rolls[row][column] = roll
+                self.jumbo[row][column] = jumbo
+                self.alcoholic[row][column] = alcoholic
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def _event_prices(self) -> Tuple[List[int], List[int]]:
+        """
+        :return: The sum of the prices (roll, +1 with a jumbo) and the number of rolls per event
+        """
+        if self.np is not None:
+            rolled = self.rolls > 0
+            prices = self.rolls.astype(self.np.int64) + (self.jumbo & rolled)
+            return self.np.where(rolled, prices, 0).sum(axis=1).tolist(), rolled.sum(axis=1).tolist()
+
+        sums, counts = [], []
+        for rolls, jumbos in zip(self.rolls, self.jumbo):
+            sums.append(sum(roll + jumbo for roll, jumbo in zip(rolls, jumbos) if roll > 0))
+            counts.append(sum(1 for roll in rolls if roll > 0))
+
+        return sums, counts
+
+    def average_prices(self) -> List[Optional[float]]:
+        """
+        :return: The average price per roll of each event, `None` if nobody has rolled
+        """
+        return [total / count if count else None for total, count in zip(*self._event_prices())]
+
+    def rolling_average(self, window: int) -> List[Optional[float]]:
+        """
+        :return: For each event, the average price per roll of the last `window` events up to it, `None` if nobody
+                 has rolled at them
+        """
+        sums, counts = self._event_prices()
+        if self.np is not None:
+            np = self.np
+            # Prefix sums, the window of event i is (i - window, i]
+            sum_prefix = np.concatenate(([0], np.cumsum(sums, dtype=np.int64)))
+            count_prefix = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+            ends = np.arange(1, len(sums) + 1)
+            starts = np.maximum(ends - window, 0)
+            sums = (sum_prefix[ends] - sum_prefix[starts]).tolist()
+            counts = (count_prefix[ends] - count_prefix[starts]).tolist()
+        else:
+            window_sum = window_count = 0
+            rolling_sums, rolling_counts = [], []
+            for i, (total, count) in enumerate(zip(sums, counts)):
+                window_sum += total
+                window_count += count
+                if i >= window:
+                    window_sum -= sums[i - window]
+                    window_count -= counts[i - window]
+                rolling_sums.append(window_sum)
+                rolling_counts.append(window_count)
+            sums, counts = rolling_sums, rolling_counts
+
+        return [total / count if count else None for total, count in zip(sums, counts)]
+
+    def roll_histogram(self) -> RollHistogram:
+        if self.np is not None:
+            np = self.np
+            rolled = self.rolls > 0
+            rolls = np.bincount(self.rolls.ravel(), minlength=7)[1:7].tolist()
+            return RollHistogram(rolls, int((self.jumbo & rolled).sum()),
+                                 int(((self.attendance == 1) & ~self.alcoholic).sum()))
+
+        counts = [0] * 7
+        jumbo = non_alcoholic = 0
+        for rolls, jumbos, attendances, alcoholics in zip(self.rolls, self.jumbo, self.attendance, self.alcoholic):
+            for roll, is_jumbo, attendance, alcoholic in zip(rolls, jumbos, attendances, alcoholics):
+                counts[roll] += 1
+                jumbo += roll > 0 and is_jumbo
+                non_alcoholic += attendance == 1 and not alcoholic
+
+        return RollHistogram(counts[1:], jumbo, non_alcoholic)
+
+    def streaks(self) -> Dict[int, Tuple[int, int]]:
+        """
+        :return: User id -> the number of consecutive events the user has attended up to the last event and the
+                 highest number of consecutive events the user has attended
+        """
+        if not len(self):
+            return {}
+
+        if self.np is not None:
+            np = self.np
+            attended = self.attendance == 1
+            # The length of the run of attended events ending at each event is the number of attended events minus
+            # the number at the last event which hasn't been attended
+            attended_count = attended.cumsum(axis=0, dtype=np.int32)
+            runs = attended_count - np.maximum.accumulate(np.where(attended, 0, attended_count), axis=0)
+            return dict(zip(self.user_ids, zip(runs[-1].tolist(), runs.max(axis=0).tolist())))
+
+        current = [0] * len(self.user_ids)
+        longest = [0] * len(self.user_ids)
+        for attendances in self.attendance:
+            for column, attendance in enumerate(attendances):
+                current[column] = current[column] + 1 if attendance == 1 else 0
+                longest[column] = max(longest[column], current[column])
+
+        return dict(zip(self.user_ids, zip(current, longest)))
+
+    def weekdays(self) -> List[WeekdayStats]:
+        """
+        :return: The number of events, the average number of attendees and the average price per roll of the events
+                 on each weekday which has had an event, Monday first
+        """
+        sums, counts = self._event_prices()
+        if self.np is not None:
+            np = self.np
+            # Day 1 (0001-01-01) is a Monday
+            weekdays = (self.days - 1) % 7
+            events = np.bincount(weekdays, minlength=7).tolist()
+            attendees = np.bincount(weekdays, weights=(self.attendance == 1).sum(axis=1), minlength=7).tolist()
+            prices = np.bincount(weekdays, weights=sums, minlength=7).tolist()
+            rolls = np.bincount(weekdays, weights=counts, minlength=7).tolist()
+        else:
+            events, attendees, prices, rolls = ([0] * 7 for _ in range(4))
+            for day, attendances, total, count in zip(self.days, self.attendance, sums, counts):
+                weekday = (day - 1) % 7
+                events[weekday] += 1
+                attendees[weekday] += sum(1 for attendance in attendances if attendance == 1)
+                prices[weekday] += total
+                rolls[weekday] += count
+
+        return [WeekdayStats(weekday, int(events[weekday]), attendees[weekday] / events[weekday],
+                             prices[weekday] / rolls[weekday] if rolls[weekday] else None)
+                for weekday in range(7) if events[weekday]]
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import gzip
+import itertools
+import json
+import os
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from .event import Event
+from .logger import create_logger
+from .tracking import Tracked
+
+if TYPE_CHECKING:
+    from .chat import Chat
+
+
+class ArchiveSummary(Tracked):
+    """
+    Aggregates of the archived events of a chat, which is all `/users` and `/price_stats` need of them.
+    """
+    __slots__ = ("event_count", "first", "last", "_users")
+
+    tracked = frozenset({"event_count", "first", "last"})
+
+    def __init__(self):
+        self.dirty = True
+        self.event_count = 0
+        # Timestamps (`Event.date_format`) of the oldest and newest archived event
+        self.first: Optional[str] = None
+        self.last: Optional[str] = None
+        # User id -> [attended events, attended events with a roll, sum of the prices of those]
+        self._users: Dict[int, List[int]] = {}
+
+    def add(self, event: Dict[str, Any]) -> None:
+        self.event_count += 1
+        self.first = self.first or event["timestamp"]
+        self.last = event["timestamp"]
+        for attendee in event.get("attendees", []):
+            counts = self._users.setdefault(attendee["id"], [0, 0, 0])
+            counts[0] += 1
+            roll = int(attendee.get("roll", -1))
+            if roll > 0:
+                counts[1] += 1
+                counts[2] += roll + (1 if attendee.get("jumbo") else 0)
+
+        self.dirty = True
+
+    def attended(self, user_id: int) -> int:
+        return self._users.get(user_id, [0, 0, 0])[0]
+
+    def prices(self, user_id: int) -> Tuple[int, int]:
+        """
+        :return: The number of archived events the user has rolled at and the sum of their prices
+        """
+        _, rolled, total = self._users.get(user_id, [0, 0, 0])
+        return rolled, total
+
+    def last_timestamp(self) -> Optional[datetime]:
+        return datetime.strptime(self.last, Event.date_format) if self.last else None
+
+    @classmethod
+    def deserialize(cls, json: Optional[Dict[str, Any]]) -> ArchiveSummary:
+        summary = ArchiveSummary()
+        if json:
+            summary.event_count = json.get("event_count", 0)
+            summary.first = json.get("first")
+            summary.last = json.get("last")
+            summary._users = {int(user_id): list(counts) for user_id, counts in json.get("users", {}).items()}
+        summary.dirty = False
+
+        return summary
+
+    def serialize(self) -> Dict[str, Any]:
+        return {
+            "event_count": self.event_count,
+            "first": self.first,
+            "last": self.last,
+            "users": {str(user_id): counts for user_id, counts in self._users.items()}
+        }
+
+
+class EventArchive:
+    """
+    Moves the historical events which are older than `max_age` days out of the chats into a gzip compressed file per
+    chat (`<directory>/<chat id>.jsonl.gz`), the chats only keep an `ArchiveSummary` of them.
+    The archived events are streamed from the file when they are needed in detail (exports, analytics), they are
+    never kept in memory. A `max_age` of `None` disables archiving.
+    """
+
+    def __init__(self, directory: str = "state/archive", max_age: Optional[int] = 365):
+        self.directory = directory
+        self.max_age = max_age
+        self.logger = create_logger("archive")
+        self._lock = Lock()
+
+    def path(self, chat_id: Any) -> str:
+        return os.path.join(self.directory, f"{chat_id}.jsonl.gz")
+
+    def archive(self, chat: Chat, now: Optional[datetime] = None) -> int:
+        """
+        Archives the events of `chat` which are older than `max_age` days.
+
+        :return: The number of archived events
+        """
+        if self.max_age is None:
+            return 0
+
+        before = (now or datetime.now()) - timedelta(days=self.max_age)
+
+        def _store(events: List[Dict[str, Any]]) -> None:
+            with self._lock:
+                # Events from an earlier run which haven't made it into the chat's state are still in the chat
+                archived = itertools.islice(self._read(chat.id), chat.archive_summary.event_count)
+                self._write(chat.id, itertools.chain(archived, events))
+
+        count = chat.archive_events(before, _store)
+        if count:
+            self.logger.info(f"Archived {count} events of chat {chat.id}")
+
+        return count
+
+    def events(self, chat: Chat, since: Optional[datetime] = None,
+               until: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the archived events of `chat` which took place between `since` and `until` (both inclusive), oldest
+        first, while reading them from the file. The file isn't opened if there are none after `since`.
+        """
+        summary = chat.archive_summary
+        if not summary.event_count or (since and summary.last_timestamp() < since):
+            return
+
+        self.logger.debug(f"Read archive of chat {chat.id}")
+        # The file is replaced when events are archived, an open file keeps reading the previous one
+        for event in itertools.islice(self._read(chat.id), summary.event_count):
+            if since or until:
+                timestamp = datetime.strptime(event["timestamp"], Event.date_format)
+                if until and timestamp > until:
+                    return
+                if since and timestamp < since:
+                    continue
+
+            yield event
+
+    def remove(self, chat_id: Any) -> None:
+        with self._lock:
+            try:
+                os.remove(self.path(chat_id))
+            except FileNotFoundError:
+                pass
+
+    def _read(self, chat_id: Any) -> Iterator[Dict[str, Any]]:
+        try:
+            f = gzip.open(self.path(chat_id), "rt", encoding="utf-8")
+        except FileNotFoundError:
+            return
+
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _write(self, chat_id: Any, events: Iterable[Dict[str, Any]]) -> None:
+        path = self.path(chat_id)
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as raw:
+            with gzip.open(raw, "wt", encoding="utf-8") as f:
+                for event in events:
+                    f.write(json.dumps(event))
+                    f.write("\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        os.replace(temp_path, path)
@@ -1,30 +1,41 @@
-import itertools
-import json
+import io
+import os
 import re
 import tempfile
-import time
 from collections import Counter
 from datetime import datetime, timedelta
 from enum import Enum
-from itertools import zip_longest
+from itertools import chain, zip_longest
 from threading import Timer
 from typing import Any, List, Optional, Dict, Iterable, Set, Tuple, Sequence
 
-import sentry_sdk
 from telegram import ParseMode, TelegramError, Update, CallbackQuery, Message, ChatPermissions, InputTextMessageContent, \
     InlineQueryResultArticle
 from telegram.error import BadRequest
 from telegram.ext import CallbackContext, Updater
 
-from . import partyamt
+from . import graphql, partyamt
+from .analytics import EventHistory, WEEKDAYS
+from .archive import EventArchive
 from .calendar import Calendar
 from .chat import Chat, ChatType, User, Keyboard
+from .chat_store import ChatStore
+from .cocktail_browser import CocktailBrowser
 from .cocktails import get_cocktails
 from .config import Config
 from .decorators import Command
+from .errors import ErrorReporter
 from .event import Event
-from .insult import Insult
-from .logger import create_logger
+from .export import ExportFormat, export_chat
+from .insult import InsultStore
+from .outbox import Outbox
+from .logger import create_logger, configure_logging, recorder
+from .profiler import Profiler, ProfilerError
+from .rate_limit import RateLimiter
+from .recorder import UpdateRecorder
+from .restrictions import FOREVER
+from .state import StateStore
+from .worker_pool import WorkerPool
 
 
 def grouper(iterable, n, fillvalue=None) -> Iterable[Tuple[Any, Any]]:
@@ -41,15 +52,36 @@ class SpamType(Enum):
 
 
 class Bot:
-    def __init__(self, updater: Updater):
-        self.chats: Dict[str, Chat] = {}
+    def __init__(self, updater: Updater, config_file: str = "config.json", name: Optional[str] = None,
+                 worker_pool: Optional[WorkerPool] = None, cocktail_browser: Optional[CocktailBrowser] = None):
+        """
+        :param name: Name of the tenant if the process hosts several bots, which share `worker_pool` and
+                     `cocktail_browser` (created from the config if not given)
+        """
+        self.chats: ChatStore = ChatStore(updater.bot)
+        self.name = name
         self.updater = updater
         self.state: Dict[str, Any] = {
             "main_id": None
         }
-        self.calendar = Calendar()
         self.logger = create_logger("regular_dicers_bot")
-        self.config = Config("config.json")
+        self.config = Config(config_file)
+        configure_logging(**self.config.get("logging", {}))
+        self.errors = ErrorReporter(**self.config.get("errors", {}))
+        graphql.configure(**self.config.get("graphql", {}))
+        self.calendar = Calendar(**self.config.get("calendar", {}))
+        self.profiler = Profiler(**self.config.get("profiling", {}))
+        self.state_store = StateStore(**self.config.get("state", {}))
+        self.archive = EventArchive(**self.config.get("archive", {}))
+        self.cocktail_browser = cocktail_browser or CocktailBrowser()
+        self.insults = InsultStore(**self.config.get("insults", {}))
+        self.outbox = Outbox(**self.config.get("outbox", {}))
+        self.outbox.register("calendar", self._create_calendar_event)
+        self.outbox.register("partyamt", self._create_partyamt_event)
+        self.outbox.start()
+        self.recorder = UpdateRecorder(**self.config.get("recording", {}))
+        self.rate_limiter = RateLimiter(**self.config.get("rate_limit", {}))
+        self.worker_pool = worker_pool or WorkerPool(**self.config.get("workers", {}))
 
     @Command()
     def show_dice(self, update: Update, context: CallbackContext) -> Optional[Message]:
@@ -73,9 +105,10 @@ class Bot:
         return chat.hide_attend()
 
     def save_state(self) -> None:
-        self.state["chats"] = [chat.serialize() for chat in self.chats.values()]
-        with open("state.json", "w+") as f:
-            json.dump(self.state, f)
+        for chat_id in self.state_store.save(self.state, self.chats):
+            chat_data = self.updater.dispatcher.chat_data.get(chat_id)
+            if chat_data:
+                chat_data.pop("chat", None)
 
     @Command(chat_admin=True)
     def delete_chat(self, update: Update, context: CallbackContext) -> None:
@@ -84,6 +117,7 @@ class Bot:
         if chat.id in self.chats:
             self.logger.info(f"Deleting chat ({chat}) from state.")
             del self.chats[chat.id]
+            self.archive.remove(chat.id)
             del context.chat_data["chat"]
 
     @Command()
@@ -121,8 +155,18 @@ class Bot:
     def set_user_restriction(self, chat_id: str, user: User, until_date: timedelta, permissions: ChatPermissions,
                              reason: str = None) -> bool:
         timestamp: int = int((datetime.now() + until_date).timestamp())
+        chat: Optional[Chat] = self.chats.get(chat_id)
         try:
-            result: bool = self.updater.bot.restrict_chat_member(chat_id, user.id, permissions, until_date=timestamp)
+            result: bool = self.rate_limiter.call(self.updater.bot.restrict_chat_member, chat_id, user.id, permissions,
+                                                  until_date=timestamp)
+            if chat and result:
+                if permissions.can_send_messages:
+                    chat.restrictions.lift(user.id)
+                elif timedelta(seconds=30) <= until_date <= timedelta(days=366):
+                    chat.restrictions.restrict(user.id, timestamp)
+                else:
+                    chat.restrictions.restrict(user.id, FOREVER)
+
             if not permissions.can_send_messages:
                 datestring: str = str(until_date).rsplit(".")[0]  # str(timedelta) -> [D day[s], ][H]H:MM:SS[.UUUUUU]
                 message = f"{user.name} has been restricted for {datestring}."
@@ -131,6 +175,10 @@ class Bot:
                 self.updater.bot.send_message(chat_id=chat_id,
                                               text=message, disable_notification=True)
         except TelegramError as e:
+            if chat and ("chat creator" in e.message or "administrator" in e.message):
+                # Creators and administrators can't be restricted at all
+                chat.restrictions.lift(user.id)
+
             if e.message == "Can't demote chat creator" and not permissions.can_send_messages:
                 message = "Sadly, user {} couldn't be restricted due to: `{}`. Shame on {}".format(user.name,
                                                                                                    e.message,
@@ -142,7 +190,15 @@ class Bot:
 
         return result
 
-    def unmute_user(self, chat_id: str, user: User) -> bool:
+    def unmute_user(self, chat_id: str, user: User, force: bool = False) -> bool:
+        """
+        :param force: Call the API even if the user isn't restricted according to the chat's `restrictions`
+        """
+        chat: Optional[Chat] = self.chats.get(chat_id)
+        if not force and chat and not chat.restrictions.is_restricted(user.id):
+            user.muted = False
+            return True
+
         result = False
         permissions = ChatPermissions(can_send_messages=True, can_send_media_messages=True,
                                       can_send_other_messages=True, can_add_web_page_previews=True)
@@ -159,6 +215,22 @@ class Bot:
 
         return result
 
+    def unmute_restricted(self, chat: Chat) -> List[User]:
+        """
+        Unmutes the users of `chat` which are actually restricted, the API calls are rate limited.
+
+        :return: The users who couldn't be unmuted
+        """
+        failed = []
+        for user in chat.users:
+            if chat.restrictions.is_restricted(user.id):
+                if not self.unmute_user(chat.id, user, force=True):
+                    failed.append(user)
+            else:
+                user.muted = False
+
+        return failed
+
     def mute_user(self, chat_id: str, user: User, until_date: timedelta, reason: Optional[str] = None) -> bool:
         if user.muted:
             return True
@@ -172,18 +244,68 @@ class Bot:
 
             # We'd need to parse the exception before assigning user.muted differently
             def _set_user_unmute():
-                user.muted = False
+                # The chat might have been evicted and loaded again since, `user` would be stale then
+                chat = self.chats.get(chat_id)
+                current_user = chat.get_user_by_id(user.id) if chat else None
+                if current_user:
+                    current_user.muted = False
 
             self.logger.info(f"Set timer for {until_date.total_seconds()}s to set user mute state to `False`")
             Timer(until_date.total_seconds(), _set_user_unmute).start()
 
         return result
 
+    def create_remote_events(self, event: Event) -> None:
+        """
+        Creates the calendar and partyamt events for the day of `event` in the background (see `Outbox`).
+        Both are only created once per day, no matter how many chats attend.
+        """
+        day = datetime.today()
+        if day.date() != event.timestamp.date():
+            self.logger.debug(f"Not creating remote events, {event.timestamp} is not today")
+            return
+
+        key = day.strftime("%Y-%m-%d")
+        self.outbox.enqueue("calendar", f"calendar_{key}", {"day": key})
+        timestamp = int(day.replace(hour=22, minute=0, second=0, microsecond=0).timestamp())
+        self.outbox.enqueue("partyamt", f"partyamt_{key}", {"timestamp": timestamp})
+
+    def _create_calendar_event(self, key: str, payload: Dict[str, Any]) -> None:
+        self.calendar.create(event_id=key, day=datetime.strptime(payload["day"], "%Y-%m-%d"))
+
+    def _create_partyamt_event(self, key: str, payload: Dict[str, Any]) -> None:
+        # `key` can't be passed to partyamt, see `partyamt.add_event`
+        partyamt.add_event(payload["timestamp"])
+
+    def answer_callback(self, callback: CallbackQuery) -> None:
+        """
+        Answers `callback` before the (slow) work of a handler, Telegram clients show a spinner until it's answered.
+        """
+        try:
+            callback.answer()
+        except TelegramError:
+            self.logger.warning("Couldn't answer callback query", exc_info=True)
+
+    def _load_chat(self, chat_id: Any) -> Optional[Chat]:
+        """
+        :return: The chat `chat_id` for a job which iterates every chat, `None` if its file can't be read
+        """
+        try:
+            return self.chats[chat_id]
+        except (OSError, ValueError):
+            self.logger.error(f"Failed to load chat {chat_id}", exc_info=True)
+            return None
+
     # noinspection PyUnusedLocal
     @Command(main_admin=True)
     def remind_users(self, update: Optional[Update], context: Optional[CallbackContext]) -> bool:
         result = True
-        for chat in self.chats.values():
+        for chat_id in self.chats:
+            chat = self._load_chat(chat_id)
+            if chat is None:
+                result = False
+                continue
+
             try:
                 if not chat.show_attend_keyboard():
                     result = False
@@ -196,6 +318,7 @@ class Bot:
     @Command()
     def handle_attend_callback(self, update: Update, context: CallbackContext) -> bool:
         callback: CallbackQuery = update.callback_query
+        self.answer_callback(callback)
         chat: Chat = context.chat_data["chat"]
         user = context.user_data["user"]
 
@@ -205,7 +328,7 @@ class Bot:
 
         def _mute_user_if_absent() -> None:
             if user in chat.current_event.absentees:
-                insult = Insult.random().text
+                insult = self.insults.random(chat.id)
                 if "{username}" in insult:
                     insult = insult.replace("{username}", user.name)
 
@@ -220,9 +343,8 @@ class Bot:
         if attends:
             chat.current_event.add_attendee(user)
 
-            if chat.current_event.remote_created:
-                self.calendar.create()
-                partyamt.add_event()
+            if not chat.current_event.remote_created:
+                self.create_remote_events(chat.current_event)
                 chat.current_event.remote_created = True
 
             self.unmute_user(chat.id, user)
@@ -235,13 +357,11 @@ class Bot:
                 return False
 
             chat.current_event.add_absentee(user)
-            try:
-                self.logger.info("Give user time to explain himself (15m), mute him afterwards.")
-                Timer(15 * 60, _mute_user_if_absent).start()
+            self.logger.info("Give user time to explain himself (15m), mute him afterwards.")
+            Timer(15 * 60, _mute_user_if_absent).start()
+            # Users can vote against attending without having voted for it
+            if user in chat.current_event.attendees:
                 chat.current_event.remove_attendee(user)
-            except KeyError as e:
-                sentry_sdk.capture_exception()
-                self.logger.exception(e, exc_info=True)
 
             if chat.current_keyboard == Keyboard.DICE:
                 chat.update_dice_message()
@@ -249,7 +369,7 @@ class Bot:
         try:
             chat.update_attend_message()
         except Exception as e:
-            sentry_sdk.capture_exception()
+            self.errors.report(e)
             self.logger.exception(e, exc_info=True)
 
         if not user_has_voted_already:
@@ -267,6 +387,7 @@ class Bot:
     @Command()
     def handle_dice_callback(self, update: Update, context: CallbackContext) -> None:
         callback: CallbackQuery = update.callback_query
+        self.answer_callback(callback)
         chat: Chat = context.chat_data["chat"]
         user = chat.get_user_by_id(update.effective_user.id)
 
@@ -282,7 +403,6 @@ class Bot:
                 self.send_message(chat_id=chat.id, text=message)
                 self.mute_user(chat.id, user, timedelta(hours=1), reason="I fucking told you")
 
-            callback.answer()
             return
 
         attendee = [attendee for attendee in attendees if attendee.id == user.id][0]
@@ -297,6 +417,27 @@ class Bot:
 
         chat.update_dice_message()
 
+    def archive_events(self) -> int:
+        """
+        Moves the old events of every chat to the archive (see `EventArchive`). Chats which are only loaded for this
+        are evicted again right away if they don't have events to archive.
+
+        :return: The number of archived events
+        """
+        count = 0
+        for chat_id in self.chats:
+            try:
+                with self.chats.borrow(chat_id) as chat:
+                    count += self.archive.archive(chat)
+            except (OSError, ValueError):
+                # The chat's file might be missing or corrupt, which mustn't stop archiving the other chats
+                self.logger.error(f"Failed to archive the events of chat {chat_id}", exc_info=True)
+
+        if count:
+            self.save_state()
+
+        return count
+
     @Command()
     def remind_chat(self, update: Update, context: CallbackContext) -> bool:
         chat: Chat = context.chat_data["chat"]
@@ -321,8 +462,9 @@ class Bot:
 
         try:
             chat.reset()
-            for user in chat.users:
-                self.unmute_user(chat.id, user)
+            failed = self.unmute_restricted(chat)
+            if failed:
+                message += f"\nCouldn't unmute {', '.join(user.name for user in failed)}."
         except TelegramError:
             self.logger.warning(f"Could not reset for chat {chat.id}", exc_info=True)
             message = "Could not perform reset."
@@ -337,7 +479,12 @@ class Bot:
         self.logger.debug("Attempting to reset all chats")
 
         success = {}
-        for chat in self.chats.values():
+        for chat_id in self.chats:
+            chat = self._load_chat(chat_id)
+            if chat is None:
+                success[chat_id] = False
+                continue
+
             message = "Reset has been performed successfully."
             try:
                 chat.reset()
@@ -451,7 +598,7 @@ class Bot:
 
     @Command()
     def handle_message(self, update: Update, context: CallbackContext) -> None:
-        self.logger.info("Handle message: {}".format(update.effective_message.text))
+        self.logger.debug("Handle message: %s", update.effective_message.text)
         chat: Chat = context.chat_data["chat"]
         user: User = chat.get_user_by_id(update.effective_user.id)
 
@@ -459,7 +606,7 @@ class Bot:
             if chat.spam_detection:
                 self.check_for_spam(user, chat)
         except Exception as e:
-            sentry_sdk.capture_exception()
+            self.errors.report(e)
             self.logger.exception(e, exc_info=True)
         else:
             self.logger.debug("Handled message")
@@ -474,13 +621,12 @@ class Bot:
             except IndexError:
                 self.logger.error("Couldn't find user in chat")
             else:
-                chat.users.remove(user)
+                chat.remove_user(user)
                 update.effective_message.reply_text("Bye bye birdie")
 
-    def set_state(self, state: Dict[str, Any]) -> None:
-        self.state = state
+    def load_state(self) -> None:
+        self.state, self.chats = self.state_store.load(self.updater.bot)
         self.state["main_id"] = self.state.get("main_id", "")
-        self.chats = {schat["id"]: Chat.deserialize(schat, self.updater.bot) for schat in state.get("chats", [])}
 
     def send_message(self, *args, **kwargs) -> Message:
         return self.updater.bot.send_message(*args, **kwargs)
@@ -490,18 +636,19 @@ class Bot:
         chat: Chat = context.chat_data["chat"]
 
         message = ""
-        events: List[Event] = chat.events
+        events: List[Event] = list(chat.events)
         if chat.current_event:
-            events += [chat.current_event]
+            events.append(chat.current_event)
 
+        event_count = len(chat.events) + chat.archive_summary.event_count
         sorted_users: List[User] = sorted(chat.users, key=lambda _user: _user.name)
         for user in sorted_users:
-            attendance_count = 0
+            attendance_count = chat.archive_summary.attended(user.id)
             for event in events:
                 if user in event.attendees:
                     attendance_count += 1
 
-            message += f"\n{str(user)} ({attendance_count}/{len(chat.events)})"
+            message += f"\n{str(user)} ({attendance_count}/{event_count})"
 
         if not message:
             message = "No active users. Users need to write a message in the chat to be recognized (not just a command)"
@@ -516,7 +663,7 @@ class Bot:
 
         for member in update.effective_message.new_chat_members:
             if member.id != self.updater.bot.id:
-                chat.users.add(User.from_tuser(member))
+                chat.add_user(User.from_tuser(member))
                 message = f"Welcome, fellow alcoholic [{member.first_name}](tg://user?id={member.id})"
                 update.effective_message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
 
@@ -538,7 +685,69 @@ class Bot:
 
     @Command()
     def status(self, update: Update, context: CallbackContext) -> Message:
-        return update.effective_message.reply_text(text=f"{context.chat_data['chat']}")
+        tenant = f"Tenant: {self.name}\n\n" if self.name else ""
+        # Clients are created on their first request
+        endpoints = "".join(f"\n{client}" for client in graphql.clients())
+        return update.effective_message.reply_text(
+            text=f"{tenant}{context.chat_data['chat']}\n\n{self.chats}\n{self.state_store}\n\n{self.worker_pool}\n\n"
+                 f"{self.errors}{endpoints}")
+
+    @Command(chat_admin=True)
+    def dump_log(self, update: Update, context: CallbackContext) -> Message:
+        chat: Chat = context.chat_data["chat"]
+        user: User = context.user_data["user"]
+        chat_id = chat.id
+
+        # The main chat can dump the records of any chat
+        if context.args and chat.id == self.state.get("main_id"):
+            try:
+                chat_id = None if context.args[0] == "all" else int(context.args[0])
+            except ValueError:
+                return update.effective_message.reply_text("Usage: `/dump_log [<chat id>|all]`",
+                                                           parse_mode=ParseMode.MARKDOWN)
+
+        path = recorder.dump(chat_id, reason=f"Requested by {user.name}", tenant=self.name)
+        if not path:
+            return update.effective_message.reply_text("There are no records (is `logging.flight_recorder` enabled?)",
+                                                       parse_mode=ParseMode.MARKDOWN)
+
+        with open(path, "rb") as f:
+            return self.updater.bot.send_document(chat_id=chat.id, document=f, filename=os.path.basename(path))
+
+    @Command(main_admin=True)
+    def profile(self, update: Update, context: CallbackContext) -> Message:
+        chat: Chat = context.chat_data["chat"]
+        action = context.args[0] if context.args else "status"
+
+        if action == "start":
+            try:
+                duration = int(context.args[1])
+            except (IndexError, ValueError):
+                duration = None
+
+            def _send_summary(path: Optional[str]) -> None:
+                self.send_message(chat_id=chat.id, text=self.profiler.summary(path), parse_mode=ParseMode.MARKDOWN)
+
+            try:
+                duration = self.profiler.start(duration, on_stop=_send_summary)
+            except ProfilerError as e:
+                return update.effective_message.reply_text(str(e))
+
+            return update.effective_message.reply_text(f"Profiling all handlers for {duration}s.")
+        elif action == "stop":
+            try:
+                path = self.profiler.stop()
+            except ProfilerError as e:
+                return update.effective_message.reply_text(str(e))
+
+            return update.effective_message.reply_text(self.profiler.summary(path), parse_mode=ParseMode.MARKDOWN)
+
+        if self.profiler.running:
+            message = f"Profiling since {self.profiler.elapsed():.0f}s ({self.profiler.calls} calls profiled)."
+        else:
+            message = "Profiler is not running (`/profile start [<seconds>]`, `/profile stop`)."
+
+        return update.effective_message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
 
     @Command()
     def version(self, update: Update, context: CallbackContext) -> Message:
@@ -554,16 +763,15 @@ class Bot:
         chat: Chat = context.chat_data["chat"]
         message = ""
 
-        events: List[Event] = chat.events
+        events: List[Event] = list(chat.events)
         if chat.current_event:
-            events += [chat.current_event]
+            events.append(chat.current_event)
 
         total_attendance = 0
         total_price = 0
         totals: Dict[User, Tuple[int, float, float]] = dict()
         for user in chat.users:
-            total = 0
-            attended = 0
+            attended, total = chat.archive_summary.prices(user.id)
 
             for event in user.get_attended_events(events):
                 event_user: User = [euser for euser in event.attendees if euser == user][0]
@@ -595,30 +803,126 @@ class Bot:
 
         return update.effective_message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
 
+    def event_history(self, chat: Chat) -> EventHistory:
+        """
+        :return: The archived, historical and current events of `chat`
+        """
+        events = chain(self.archive.events(chat), chat.serialized_events())
+        if chat.current_event:
+            events = chain(events, [chat.current_event.serialize()])
+
+        return EventHistory(events, **self.config.get("analytics", {}))
+
+    @Command()
+    def roll_trend(self, update: Update, context: CallbackContext) -> Message:
+        chat: Chat = context.chat_data["chat"]
+        try:
+            window = int(context.args[0]) if context.args else 4
+            if window < 1:
+                raise ValueError
+        except ValueError:
+            return update.effective_message.reply_text("Usage: `/roll_trend [<number of events>]`",
+                                                       parse_mode=ParseMode.MARKDOWN)
+
+        history = self.event_history(chat)
+        rolled = [(day, average, rolling) for day, average, rolling
+                  in zip(history.days, history.average_prices(), history.rolling_average(window))
+                  if average is not None]
+        if not rolled:
+            return update.effective_message.reply_text("There are no stats yet.")
+
+        message = f"Average price (of the last {window} events):"
+        for day, average, rolling in rolled[-10:]:
+            date = datetime.fromordinal(int(day)).strftime(Event.date_format)
+            message += f"\n{date}: `{average:.2f}`€ (`{rolling:.2f}`€)"
+
+        return update.effective_message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+
+    @Command()
+    def roll_histogram(self, update: Update, context: CallbackContext) -> Message:
+        chat: Chat = context.chat_data["chat"]
+        histogram = self.event_history(chat).roll_histogram()
+        total = sum(histogram.rolls)
+        if not total:
+            return update.effective_message.reply_text("There are no stats yet.")
+
+        message = "Rolls:"
+        for roll, count in enumerate(histogram.rolls, start=1):
+            bar = "█" * round(20 * count / max(histogram.rolls))
+            message += f"\n{roll}: `{bar:<20}` {count} ({count / total:.0%})"
+        message += f"\nJumbo: {histogram.jumbo}/{total}, without alcohol: {histogram.non_alcoholic}"
+
+        return update.effective_message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+
+    @Command()
+    def streaks(self, update: Update, context: CallbackContext) -> Message:
+        chat: Chat = context.chat_data["chat"]
+        history = self.event_history(chat)
+        streaks = sorted(((history.names[user_id], current, longest)
+                          for user_id, (current, longest) in history.streaks().items() if longest),
+                         key=lambda item: (item[2], item[1]), reverse=True)
+        if not streaks:
+            return update.effective_message.reply_text("There are no stats yet.")
+
+        message = "Events attended in a row (current/longest):"
+        for name, current, longest in streaks:
+            message += f"\n{name}: `{current}`/`{longest}`"
+
+        return update.effective_message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+
+    @Command()
+    def weekdays(self, update: Update, context: CallbackContext) -> Message:
+        chat: Chat = context.chat_data["chat"]
+        weekdays = self.event_history(chat).weekdays()
+        if not weekdays:
+            return update.effective_message.reply_text("There are no stats yet.")
+
+        message = "Events per weekday:"
+        for stats in weekdays:
+            price = f"`{stats.average_price:.2f}`€" if stats.average_price is not None else "no rolls"
+            message += (f"\n{WEEKDAYS[stats.weekday]}: `{stats.events}` events, "
+                        f"`{stats.average_attendees:.1f}` attendees, {price}")
+
+        return update.effective_message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+
     @Command()
     def get_data(self, update: Update, context: CallbackContext) -> Message:
         chat: Chat = context.chat_data["chat"]
-        data = [_chat for _chat in self.state.get("chats", []) if _chat.get("id") == chat.id]
+        args = list(context.args or [])
 
-        if data:
-            with tempfile.TemporaryFile() as temp:
-                temp.write(json.dumps(data[0]).encode("utf-8"))
-                temp.seek(0)
-                return self.updater.bot.send_document(chat_id=chat.id, document=temp, filename=f"{chat.title}.json")
-        else:
-            return update.effective_message.reply_text("Couldn't find any data for this chat.")
+        try:
+            # The format is optional, `/get_data 01.01.2020` exports everything since then as json
+            export_format = ExportFormat.JSON
+            if args and args[0].lower() in {member.value for member in ExportFormat}:
+                export_format = ExportFormat(args.pop(0).lower())
+            since = datetime.strptime(args[0], Event.date_format) if len(args) > 0 else None
+            until = datetime.strptime(args[1], Event.date_format) if len(args) > 1 else None
+        except ValueError:
+            message = "Usage: `/get_data [json|jsonl|csv] [<from: dd.mm.yyyy>] [<until: dd.mm.yyyy>]`"
+            return update.effective_message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+
+        with tempfile.TemporaryFile() as temp:
+            text = io.TextIOWrapper(temp, encoding="utf-8", newline="")
+            export_chat(chat, text, export_format, since, until, archived=self.archive.events(chat, since, until))
+            text.flush()
+            text.detach()
+
+            temp.seek(0)
+            filename = f"{chat.title or chat.id}.{export_format.value}"
+            return self.updater.bot.send_document(chat_id=chat.id, document=temp, filename=filename)
 
     @Command()
     def add_insult(self, update: Update, context: CallbackContext) -> Message:
+        chat: Chat = context.chat_data["chat"]
         text = " ".join(context.args)
 
         self.logger.debug(f"Add insult ({text}) from {context.user_data['user'].name}")
-        if text and Insult.add(text):
+        if text and self.insults.add(text, chat.id):
             self.logger.debug("Insult added successfully")
             message = update.effective_message.reply_text("Successfully added new insult")
         else:
             self.logger.debug("Insult was not added")
-            insult = Insult.random().text
+            insult = self.insults.random(chat.id)
             if "{username}" in insult:
                 insult = insult.replace("{username}", update.effective_user.first_name)
             message = update.effective_message.reply_text(f"Not a new insult\n{insult}")
@@ -640,8 +944,7 @@ class Bot:
         try:
             minutes = int(context.args[1])
         except (IndexError, ValueError):
-            sentry_sdk.capture_exception()
-            self.logger.error("Exception while getting time string from mute command", exc_info=True)
+            self.logger.debug(f"No valid timeout given, mute for {minutes} minutes")
 
         mute_time = timedelta(minutes=minutes)
         chat = context.chat_data["chat"]
@@ -649,8 +952,7 @@ class Bot:
         try:
             user = next(filter(lambda x: x.name == username, chat.users))
         except StopIteration:
-            sentry_sdk.capture_exception()
-            self.logger.warn(f"Couldn't find user {username} in users for chat {update.message.chat_id}", exc_info=True)
+            self.logger.warning(f"Couldn't find user {username} in users for chat {update.message.chat_id}")
             update.effective_message.reply_text(f"Can't mute {username} (not found in current chat).")
         else:
             self.mute_user(update.message.chat_id, user, until_date=mute_time, reason=reason)
@@ -667,22 +969,22 @@ class Bot:
 
         # @all is an unusable username
         if username == "@all":
-            for user in chat.users:
-                try:
-                    self.unmute_user(chat.id, user)
-                except BadRequest:
-                    self.logger.error(f"Failed to unmute user ({user})")
+            restricted = len(chat.restrictions)
+            failed = self.unmute_restricted(chat)
+            message = f"Unmuted {restricted - len(failed)} users."
+            if failed:
+                message += f"\nCouldn't unmute {', '.join(user.name for user in failed)}."
 
-            return
+            return update.effective_message.reply_text(message)
 
         try:
             user = next(filter(lambda x: x.name.lower() == username.lower(), chat.users))
         except StopIteration:
-            sentry_sdk.capture_exception()
-            self.logger.warn(f"Couldn't find user {username} in users for chat {update.message.chat_id}", exc_info=True)
+            self.logger.warning(f"Couldn't find user {username} in users for chat {update.message.chat_id}")
             update.effective_message.reply_text(f"Can't unmute {username} (not found in current chat).")
         else:
-            if self.unmute_user(chat.id, user):
+            # Explicit unmutes also cover restrictions which have been set outside of the bot
+            if self.unmute_user(chat.id, user, force=True):
                 update.effective_message.reply_text(f"Successfully unmuted {username}.")
             else:
                 update.effective_message.reply_text(f"Failed to unmute {username}.")
@@ -725,7 +1027,8 @@ class Bot:
 
     @Command()
     def list_insults(self, update: Update, context: CallbackContext):
-        message = "\n".join([f"`{insult.text}`" for insult in Insult.read_all()])
+        chat: Chat = context.chat_data["chat"]
+        message = "\n".join([f"`{insult}`" for insult in self.insults.all(chat.id)])
 
         if not message:
             message = "There are no insults yet"
@@ -764,9 +1067,7 @@ class Bot:
         try:
             user: User = next(filter(lambda x: x.name == username, chat.users))
         except StopIteration:
-            sentry_sdk.capture_exception()
-            self.logger.warning(f"Couldn't find user {username} in users for chat {update.message.chat_id}",
-                                exc_info=True)
+            self.logger.warning(f"Couldn't find user {username} in users for chat {update.message.chat_id}")
             update.effective_message.reply_text(f"Can't kick {username} (not found in current chat).")
         else:
             try:
@@ -780,7 +1081,7 @@ class Bot:
                     message = f"{user.name} was kicked from chat"
                     message += f" due to {reason}." if reason else "."
                     self.logger.debug(message)
-                    chat.users.remove(user)
+                    chat.remove_user(user)
                     update.message.reply_text(message)
                 else:
                     message = f"{user.name} couldn't be kicked from chat"
@@ -801,22 +1102,26 @@ class Bot:
 
             return None
 
-        messages = []
-        for category, cocktails in itertools.groupby(get_cocktails(), key=lambda x: x.category):
-            cocktails: List[str] = [f"({cocktail.id}) {str(cocktail)}" for cocktail in cocktails]
+        page, index = self.cocktail_browser.page(0)
+        if not page:
+            return self.send_message(chat_id=chat.id, text="Cocktails couldn't be fetched")
 
-            split_messages: List[List[str]] = _split_messages([f"*{category}*\n{'‾' * len(category) * 2}"] + cocktails)
-            for m in split_messages:
-                messages.append("\n".join(m))
+        return self.send_message(chat_id=chat.id, text=page.text, parse_mode=ParseMode.MARKDOWN,
+                                 reply_markup=self.cocktail_browser.keyboard(index), disable_notification=True)
 
-        if not messages:
-            messages = ["Cocktails couldn't be fetched"]
+    @Command()
+    def handle_cocktails_callback(self, update: Update, context: CallbackContext) -> None:
+        callback: CallbackQuery = update.callback_query
+        self.answer_callback(callback)
+        page, index = self.cocktail_browser.page(int(callback.data[len(CocktailBrowser.CALLBACK_PREFIX):]))
 
-        first = True
-        for message in messages:
-            self.send_message(chat_id=chat.id, text=message, parse_mode=ParseMode.MARKDOWN, disable_notification=first)
-            first = False
-            time.sleep(0.5)
+        if page:
+            try:
+                callback.edit_message_text(text=page.text, parse_mode=ParseMode.MARKDOWN,
+                                           reply_markup=self.cocktail_browser.keyboard(index))
+            except BadRequest:
+                # This will happen if the message didn't change
+                self.logger.debug("edit_message_text failed", exc_info=True)
 
     # @Command()
     def handle_inline_query(self, update: Update, context: CallbackContext):
@@ -837,22 +1142,3 @@ class Bot:
 
         update.inline_query.answer(results)
 
-
-def _split_messages(lines):
-    message_length = 1024
-    messages = []
-    current_length = 0
-    current_message = 0
-    for line in lines:
-        if len(messages) <= current_message:
-            messages.append([])
-
-        line_length = len(line)
-        if current_length + line_length < message_length:
-            current_length += line_length
-            messages[current_message].append(line)
-        else:
-            current_length = 0
-            current_message += 1
-
-    return messages
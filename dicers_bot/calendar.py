@@ -1,11 +1,15 @@
+import hashlib
+import os
 from datetime import datetime
-
-from googleapiclient.discovery import build
-from httplib2 import Http
-from oauth2client import file, client, tools
+from enum import Enum
+from threading import Thread, Event
+from typing import Optional, TYPE_CHECKING
 
 from .logger import create_logger
 
+if TYPE_CHECKING:
+    from oauth2client.client import Credentials
+
 SCOPES = "https://www.googleapis.com/auth/calendar"
 base_event = {
     "summary": "Würfeln",
@@ -22,30 +26,100 @@ base_event = {
 }
 
 
+class CalendarState(Enum):
+    PENDING = 0
+    READY = 1
+    DISABLED = 2
+
+
 class Calendar:
-    def __init__(self, filename: str = "credentials.json"):
+    """
+    The Google calendar client is initialized in a background thread, so the bot doesn't wait for Google on startup.
+    The discovery document is cached in `discovery_cache` after it has been fetched once.
+    The Google client libraries take longer to import than the rest of the bot, they are only imported by the
+    background thread and only if there are credentials.
+    """
+
+    def __init__(self, filename: str = "credentials.json", discovery_cache: str = "calendar_discovery.json",
+                 timeout: int = 10):
         self.event = base_event
         self.last_event = None
         self.logger = create_logger("calendar")
+        self.filename = filename
+        self.discovery_cache = discovery_cache
+        self.timeout = timeout
+        self.service = None
+        self.state = CalendarState.PENDING
+        self._initialized = Event()
+
+        Thread(target=self._initialize, name="calendar_init", daemon=True).start()
 
+    def _initialize(self) -> None:
         # noinspection PyBroadException
         try:
-            credentials = self._load_credentials(filename)
-            self.service = build("calendar", "v3", http=credentials.authorize(Http()))
+            if not os.path.exists(self.filename):
+                raise FileNotFoundError(f"{self.filename} doesn't exist")
+
+            from googleapiclient.discovery import build_from_document
+            from httplib2 import Http
+
+            credentials = self._load_credentials(self.filename)
+            self.service = build_from_document(self._discovery_document(),
+                                               http=credentials.authorize(Http(timeout=self.timeout)))
+            self.state = CalendarState.READY
             self.logger.debug("Calendar initialized.")
         except Exception as e:
             self.logger.warning("Calendar module is disabled. Reason: %s", str(e))
-            self.service = None
+            self.state = CalendarState.DISABLED
+        finally:
+            self._initialized.set()
+
+    def _discovery_document(self) -> str:
+        from googleapiclient.discovery import DISCOVERY_URI
+        from httplib2 import Http
+
+        if os.path.exists(self.discovery_cache):
+            with open(self.discovery_cache) as f:
+                return f.read()
+
+        self.logger.debug("Fetch calendar discovery document")
+        response, content = Http(timeout=self.timeout).request(DISCOVERY_URI.format(api="calendar", apiVersion="v3"))
+        if response.status != 200:
+            raise ConnectionError(f"Couldn't fetch discovery document ({response.status})")
+
+        document = content.decode("utf-8")
+        temp_path = f"{self.discovery_cache}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(document)
+        os.replace(temp_path, self.discovery_cache)
+
+        return document
+
+    def wait_until_initialized(self, timeout: Optional[float] = None) -> bool:
+        """
+        :return: Whether the initialization has finished (successfully or not)
+        """
+        return self._initialized.wait(timeout)
+
+    def create(self, event_id: Optional[str] = None, day: Optional[datetime] = None) -> None:
+        """
+        Creates the calendar event for `day` (default: today).
+
+        :param event_id: Idempotency key for the event, creating an event with an existing id is a no-op
+        :raises: TimeoutError if the calendar is still initializing
+        """
+        if not self.wait_until_initialized(self.timeout):
+            raise TimeoutError("Calendar is still initializing")
 
-    def create(self) -> None:
         service = self.service
         if not service:
             return None
 
-        if datetime.today().weekday() != 0:
-            print("Not monday ({})".format(datetime.today().weekday()))
+        day = day or datetime.today()
+        if day.weekday() != 0:
+            print("Not monday ({})".format(day.weekday()))
             return None
-        self.fill_base_event()
+        self.fill_base_event(day)
 
         if self.last_event and self.event["start"]["dateTime"] == self.last_event["start"]["dateTime"]:
             print("Event already exists(now | last): {} == {}".format(
@@ -54,15 +128,32 @@ class Calendar:
             )
             return None
 
-        gevent = service.events().insert(calendarId="43httl0ouo48t260oqturfrs84@group.calendar.google.com",
-                                         body=self.event).execute()
+        from googleapiclient.errors import HttpError
+
+        body = dict(self.event)
+        if event_id:
+            # Event ids may only contain the characters a-v and 0-9
+            body["id"] = hashlib.sha1(event_id.encode("utf-8")).hexdigest()
+
+        try:
+            gevent = service.events().insert(calendarId="43httl0ouo48t260oqturfrs84@group.calendar.google.com",
+                                             body=body).execute()
+        except HttpError as e:
+            if e.resp.status != 409:
+                raise
+
+            self.logger.info(f"Event {event_id} exists already")
+            gevent = {}
+
         self.last_event = self.event
         self.event = base_event
 
         gevent.get("htmlLink")
 
     @staticmethod
-    def _load_credentials(filename) -> client.Credentials:
+    def _load_credentials(filename) -> "Credentials":
+        from oauth2client import file
+
         store = file.Storage(filename)
 
         try:
@@ -71,27 +162,40 @@ class Calendar:
             credentials = None
 
         if not credentials or credentials.invalid:
-            flow = client.flow_from_clientsecrets(filename, SCOPES)
-            flow.user_agent = "regular_dicers_bot"
-            return tools.run_flow(flow, store)
+            raise ValueError(f"No valid credentials in {filename}, run `python -m dicers_bot.calendar` to authorize")
 
         return credentials
 
     @staticmethod
-    def _get_start_time() -> datetime:
-        today = datetime.today()
-        start = today.replace(hour=21, minute=0, second=0, microsecond=0)
+    def authorize(filename: str = "credentials.json") -> "Credentials":
+        """
+        Runs the interactive OAuth flow and stores the credentials in `filename`.
+        """
+        from oauth2client import file, client, tools
+
+        store = file.Storage(filename)
+        flow = client.flow_from_clientsecrets(filename, SCOPES)
+        flow.user_agent = "regular_dicers_bot"
+
+        return tools.run_flow(flow, store)
+
+    @staticmethod
+    def _get_start_time(day: datetime) -> datetime:
+        start = day.replace(hour=21, minute=0, second=0, microsecond=0)
 
         return start
 
     @staticmethod
-    def _get_end_time() -> datetime:
-        today = datetime.today()
-        end = today.replace(hour=23, minute=30, second=0, microsecond=0)
+    def _get_end_time(day: datetime) -> datetime:
+        end = day.replace(hour=23, minute=30, second=0, microsecond=0)
 
         return end
 
-    def fill_base_event(self) -> None:
+    def fill_base_event(self, day: datetime) -> None:
         date_format = "%Y-%m-%dT%H:%M:%S"
-        self.event["start"]["dateTime"] = self._get_start_time().strftime(date_format)
-        self.event["end"]["dateTime"] = self._get_end_time().strftime(date_format)
+        self.event["start"]["dateTime"] = self._get_start_time(day).strftime(date_format)
+        self.event["end"]["dateTime"] = self._get_end_time(day).strftime(date_format)
+
+
+if __name__ == "__main__":
+    Calendar.authorize()
@@ -1,16 +1,20 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import Optional, Set, List, Dict, Any, Callable
+from datetime import datetime
+from typing import Optional, Set, List, Dict, Any, Callable, Iterator
 
 from telegram import Bot as TBot, Update, ParseMode
 from telegram import Chat as TChat
 from telegram import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, TelegramError
 from telegram.error import BadRequest
 
+from .archive import ArchiveSummary
 from .decorators import group
 from .event import Event
 from .logger import create_logger
+from .restrictions import Restrictions, FOREVER
+from .tracking import Tracked
 from .user import User
 
 
@@ -35,12 +39,27 @@ class ChatType(Enum):
 
         return self.value == other
 
+    @classmethod
+    def parse(cls, value: Optional[str]) -> ChatType:
+        try:
+            return cls(value)
+        except ValueError:
+            return cls.UNDEFINED
+
+
+class Chat(Tracked):
+    __slots__ = ("_events", "_serialized_events", "pinned_message_id", "current_event", "attend_callback",
+                 "dice_callback", "current_keyboard", "id", "bot", "users", "title", "type", "spam_detection", "restrictions",
+                 "archive_summary")
+
+    logger = create_logger("chat")
+    tracked = frozenset({"pinned_message_id", "current_event", "id", "users", "title", "spam_detection"})
 
-class Chat:
-    def __init__(self, _id: str, bot: TBot):
-        self.logger = create_logger("chat_{}".format(_id))
-        self.logger.debug("Create chat")
-        self.events: List[Event] = []
+    def __init__(self, _id: str, bot: TBot, create_event: bool = True):
+        self.dirty = True
+        # Historical events are kept serialized until `events` is accessed
+        self._events: Optional[List[Event]] = []
+        self._serialized_events: List[Dict[str, Any]] = []
         self.pinned_message_id: Optional[int] = None
         self.current_event: Optional[Event] = None
         self.attend_callback: Optional[CallbackQuery] = None
@@ -48,18 +67,70 @@ class Chat:
         self.current_keyboard = Keyboard.NONE
         self.id: str = _id
         self.bot: TBot = bot
-        self.start_event()
+        if create_event:
+            self.start_event()
         self.users: Set[User] = set()
         self.title = None
         self.type = ChatType.UNDEFINED
         self.spam_detection = True
+        self.restrictions = Restrictions()
+        self.archive_summary = ArchiveSummary()
+
+    @property
+    def events(self) -> List[Event]:
+        if self._events is None:
+            self.logger.debug(f"Deserialize {len(self._serialized_events)} events")
+            self._events = [Event.deserialize(event) for event in self._serialized_events]
+            self._serialized_events = []
+
+        return self._events
+
+    @events.setter
+    def events(self, events: List[Event]) -> None:
+        self._events = events
+        self._serialized_events = []
+        self.dirty = True
+
+    @property
+    def event_count(self) -> int:
+        if self._events is None:
+            return len(self._serialized_events)
+
+        return len(self._events)
 
     def get_user_by_id(self, _id: int) -> Optional[User]:
         result = next(filter(lambda user: user.id == _id, self.users), None)
 
         return result
 
-    def serialize(self) -> Dict[str, Any]:
+    def is_dirty(self) -> bool:
+        """
+        :return: Whether anything which is part of `serialize` has changed since the last `clean`
+        """
+        if self.dirty or self.restrictions.dirty or self.archive_summary.dirty:
+            return True
+        if any(user.dirty for user in self.users):
+            return True
+
+        return bool(self.current_event and self.current_event.is_dirty())
+
+    def is_evictable(self) -> bool:
+        """
+        :return: Whether the chat can be deserialized again without losing anything, which isn't the case while the
+                 message of a keyboard is being updated (the callback queries aren't serialized)
+        """
+        return self.current_keyboard == Keyboard.NONE and not self.attend_callback and not self.dice_callback
+
+    def clean(self) -> None:
+        self.dirty = False
+        self.restrictions.dirty = False
+        self.archive_summary.dirty = False
+        for user in self.users:
+            user.dirty = False
+        if self.current_event:
+            self.current_event.clean()
+
+    def serialize(self, include_events: bool = True) -> Dict[str, Any]:
         serialized_event = None
         if self.current_event:
             serialized_event = self.current_event.serialize()
@@ -68,29 +139,83 @@ class Chat:
             "id": self.id,
             "current_event": serialized_event,
             "pinned_message_id": self.pinned_message_id,
-            "events": [event.serialize() for event in self.events],
             "users": [user.serialize() for user in self.users],
             "title": self.title,
-            "spam_detection": self.spam_detection
+            "spam_detection": self.spam_detection,
+            "restrictions": self.restrictions.serialize(),
+            "archive": self.archive_summary.serialize()
         }
 
+        if include_events:
+            serialized["events"] = list(self.serialized_events())
+
         return serialized
 
+    def serialized_events(self) -> Iterator[Dict[str, Any]]:
+        """
+        Serializes the historical events one by one, events which haven't been deserialized yet are returned as is.
+        """
+        if self._events is None:
+            yield from self._serialized_events
+        else:
+            for event in self._events:
+                yield event.serialize()
+
+    def archive_events(self, before: datetime, store: Callable[[List[Dict[str, Any]]], None]) -> int:
+        """
+        Removes the historical events which took place before `before` after passing them (serialized) to `store`
+        and adds them to `archive_summary`.
+
+        :return: The number of removed events
+        """
+        archived = [event for event in self.serialized_events()
+                    if datetime.strptime(event["timestamp"], Event.date_format) < before]
+        if not archived:
+            return 0
+
+        store(archived)
+        for event in archived:
+            self.archive_summary.add(event)
+
+        if self._events is None:
+            self._serialized_events = [event for event in self._serialized_events
+                                       if datetime.strptime(event["timestamp"], Event.date_format) >= before]
+        else:
+            self._events = [event for event in self._events if event.timestamp >= before]
+        self.dirty = True
+
+        return len(archived)
+
     def add_user(self, user: User):
-        self.users.add(user)
+        if user not in self.users:
+            self.users.add(user)
+            self.dirty = True
+
+    def remove_user(self, user: User):
+        self.users.remove(user)
+        self.dirty = True
 
     @classmethod
     def deserialize(cls, json_object: Dict, bot: TBot) -> Chat:
         chat = Chat(
             json_object["id"],
-            bot
+            bot,
+            create_event=False
         )
         chat.pinned_message_id = json_object.get("pinned_message_id")
         chat.current_event = Event.deserialize(json_object.get("current_event"))
-        chat.events = [Event.deserialize(event_json_object) for event_json_object in json_object.get("events", [])]
+        chat._events = None
+        chat._serialized_events = json_object.get("events", [])
         chat.users = {User.deserialize(user_json_object) for user_json_object in json_object.get("users", [])}
         chat.title = json_object.get("title", None)
         chat.spam_detection = json_object.get("spam_detection", True)
+        if "restrictions" in json_object:
+            chat.restrictions = Restrictions.deserialize(json_object["restrictions"])
+        else:
+            # Older states only know which users are muted, not until when
+            chat.restrictions = Restrictions({user.id: FOREVER for user in chat.users if user.muted})
+        chat.archive_summary = ArchiveSummary.deserialize(json_object.get("archive"))
+        chat.clean()
 
         return chat
 
@@ -136,7 +261,12 @@ class Chat:
     def close_current_event(self) -> None:
         self.logger.info("Close current event")
         if self.current_event:
-            self.events.append(self.current_event)
+            # Store a snapshot, the event's users are reset afterwards
+            serialized_event = self.current_event.serialize()
+            if self._events is None:
+                self._serialized_events.append(serialized_event)
+            else:
+                self._events.append(Event.deserialize(serialized_event))
         self.current_event = None
 
     def start_event(self, event: Optional[Event] = None) -> None:
@@ -195,29 +325,25 @@ class Chat:
             self.logger.debug("No current event, emptying old attend message.")
             try:
                 self.attend_callback.edit_message_reply_markup(reply_markup=None)
-                self.attend_callback.answer()
                 self.attend_callback = None
             except BadRequest:
                 self.logger.warning("Could not use attend_callback", exc_info=True)
             return
 
         message = self._build_attend_message()
-        self.logger.info("Edit message (%s)", message)
+        self.logger.debug("Edit message (%s)", message)
 
         try:
             result: Message = self.attend_callback.edit_message_text(text=message,
                                                                      reply_markup=self.get_attend_keyboard(),
                                                                      parse_mode=ParseMode.MARKDOWN)
-            self.logger.info("edit_message_text returned: %s", result)
+            self.logger.debug("edit_message_text returned: %s", result)
         except BadRequest:
             # This will happen if the message didn't change
             self.logger.debug("edit_message_text failed", exc_info=True)
 
-        self.logger.info("Answer attend callback")
-        self.attend_callback.answer()
-
     def _build_attend_message(self, message: Optional[str] = None) -> str:
-        self.logger.info("Build attend message for event: %s", self.current_event)
+        self.logger.debug("Build attend message for event: %s", self.current_event)
         if not message:
             message = "Wer ist dabei?"
 
@@ -256,7 +382,7 @@ class Chat:
         else:
             self.logger.debug("everyone has voted")
 
-        self.logger.info("Successfully built the attend message: %s", message)
+        self.logger.debug("Successfully built the attend message: %s", message)
         return message
 
     def update_dice_message(self) -> None:
@@ -270,7 +396,6 @@ class Chat:
             self.logger.debug("No current event, emptying old dice message.")
             try:
                 self.dice_callback.edit_message_reply_markup(reply_markup=None)
-                self.dice_callback.answer()
                 self.dice_callback = None
             except BadRequest:
                 self.logger.warning("Could not use dice_callback", exc_info=True)
@@ -278,19 +403,15 @@ class Chat:
             return None
 
         message = self._build_dice_message()
-        self.logger.info("Edit message (%s)", message)
+        self.logger.debug("Edit message (%s)", message)
 
         try:
             result = self.dice_callback.edit_message_text(text=message, reply_markup=self.get_dice_keyboard())
-            self.logger.info("edit_message_text returned: %s", result)
+            self.logger.debug("edit_message_text returned: %s", result)
         except BadRequest:
             # This will happen if the message didn't change
             self.logger.debug("edit_message_text failed", exc_info=True)
 
-        self.logger.info("Answer dice callback")
-
-        self.dice_callback.answer()
-
     def _build_dice_message(self) -> str:
         self.logger.info("Build price message")
         message = "Was hast du gewürfelt?\n"
@@ -317,12 +438,11 @@ class Chat:
         :raises: TelegramError Raises TelegramError if the message couldn't be sent
         :return:
         """
-        message = " | ".join(["{}: {}".format(key, val) for key, val in kwargs.items()])
-        self.logger.info(f"Send message with: {message}")
+        self.logger.debug("Send message with: %s", kwargs)
 
         result = self.bot.send_message(chat_id=self.id, **kwargs)
 
-        self.logger.info("Result of sending message: {}".format(result))
+        self.logger.debug("Result of sending message: %s", result)
         return result
 
     def show_dice(self) -> Optional[Message]:
@@ -333,7 +453,7 @@ class Chat:
             return None
 
         if not self.current_event.attendees:
-            self.current_keyboard = None
+            self.current_keyboard = Keyboard.NONE
             self.logger.info("No attendees -> skip showing dice")
             return
 
@@ -341,11 +461,10 @@ class Chat:
         result = self._send_message(text=self._build_dice_message(), reply_markup=self.get_dice_keyboard())
         if result:
             self.current_keyboard = Keyboard.DICE
-            self.logger.info("Successfully shown dice: {}".format(result))
-            self.logger.info("Assigning internal id and pin message: {}".format(result))
+            self.logger.debug("Successfully shown dice: %s", result)
             self.pin_message(result.message_id, unpin=True)
         else:
-            self.logger.info("Failed to send dice message: {}".format(result))
+            self.logger.info("Failed to send dice message: %s", result)
 
         return result
 
@@ -364,11 +483,10 @@ class Chat:
 
         if result:
             self.current_keyboard = Keyboard.ATTEND
-            self.logger.info("Successfully shown attend: {}".format(result))
-            self.logger.info("Assigning internal id and pin message: {}".format(result))
+            self.logger.debug("Successfully shown attend: %s", result)
             self.pin_message(result.message_id)
         else:
-            self.logger.info("Failed to send attend message: {}".format(result))
+            self.logger.info("Failed to send attend message: %s", result)
 
         return result
 
@@ -389,6 +507,8 @@ class Chat:
             return administrators
 
         for admin in chat_administrators:
+            # Administrators can't be restricted
+            self.restrictions.reconcile(admin)
             try:
                 # noinspection PyShadowingNames
                 # we don't actually shadow `user` (lhs) with the `user` inside the lambda (rhs).
@@ -441,7 +561,7 @@ class Chat:
         for user in self.users:
             user.roll = -1
             user.jumbo = False
-            user.muted = False
+            user.muted = self.restrictions.is_restricted(user.id)
 
     def __repr__(self) -> str:
         return f"<{self.id} | {self.title}>"
@@ -0,0 +1,202 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import RLock
+from typing import Dict, Any, Iterable, Iterator, MutableMapping, List, Optional, Callable, Set
+
+from telegram import Bot as TBot
+
+from .chat import Chat
+
+
+class ChatStore(MutableMapping):
+    """
+    Mapping of chat ids to `Chat`s which only deserializes a chat the first time it is accessed.
+
+    Chats are either given in their serialized form or as ids only, in which case `load` is called with the id to
+    get the serialized chat on first access.
+
+    With `idle_time` (and `load`), `evict` drops the chats which haven't been accessed for `idle_time` seconds from
+    memory, least recently used first and only while more than `max_loaded` chats are loaded (if given). An evicted
+    chat is loaded again with `load` on its next access.
+    """
+
+    def __init__(self, bot: TBot, serialized_chats: Iterable[Dict[str, Any]] = (),
+                 load: Optional[Callable[[Any], Dict[str, Any]]] = None, chat_ids: Iterable[Any] = (),
+                 max_loaded: Optional[int] = None, idle_time: Optional[float] = None):
+        self.bot = bot
+        self.max_loaded = max_loaded
+        self.idle_time = idle_time
+        self._load = load
+        self._lock = RLock()
+        # Least recently used first, only kept in order if chats are evicted
+        self._chats: "OrderedDict[str, Chat]" = OrderedDict()
+        self._accessed: Dict[str, float] = {}
+        self._serialized: Dict[str, Optional[Dict[str, Any]]] = {chat_id: None for chat_id in chat_ids}
+        self._serialized.update({chat["id"]: chat for chat in serialized_chats})
+        self._evicted: Set[str] = set()
+        self._counts = {"hits": 0, "loads": 0, "evictions": 0, "reloads": 0}
+        self._reload_seconds = 0.0
+        self._max_reload_seconds = 0.0
+
+    @property
+    def evicting(self) -> bool:
+        return self.idle_time is not None and self._load is not None
+
+    def __getitem__(self, key: str) -> Chat:
+        if not self.evicting:
+            chat = self._chats.get(key)
+            if chat is not None:
+                self._counts["hits"] += 1
+                return chat
+
+        # Evicting chats reads the access times, the lock makes sure a chat isn't evicted while it's accessed
+        with self._lock:
+            chat = self._chats.get(key)
+            if chat is None:
+                start = time.perf_counter()
+                serialized = self._serialized[key]
+                if serialized is None:
+                    serialized = self._load(key)
+
+                chat = Chat.deserialize(serialized, self.bot)
+                self._chats[key] = chat
+                del self._serialized[key]
+                self._counts["loads"] += 1
+                if key in self._evicted:
+                    self._evicted.discard(key)
+                    duration = time.perf_counter() - start
+                    self._counts["reloads"] += 1
+                    self._reload_seconds += duration
+                    self._max_reload_seconds = max(self._max_reload_seconds, duration)
+            else:
+                self._counts["hits"] += 1
+                self._chats.move_to_end(key)
+
+            self._accessed[key] = time.monotonic()
+
+        return chat
+
+    def __setitem__(self, key: str, chat: Chat) -> None:
+        with self._lock:
+            self._serialized.pop(key, None)
+            self._evicted.discard(key)
+            self._chats[key] = chat
+            self._chats.move_to_end(key)
+            self._accessed[key] = time.monotonic()
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            found = self._chats.pop(key, None) is not None
+            found = self._serialized.pop(key, _MISSING) is not _MISSING or found
+            self._accessed.pop(key, None)
+            self._evicted.discard(key)
+
+        if not found:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._chats or key in self._serialized
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            keys = list(self._chats.keys()) + list(self._serialized.keys())
+
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return len(self._chats) + len(self._serialized)
+
+    def loaded(self) -> List[Chat]:
+        """
+        :return: Every chat which has been deserialized already
+        """
+        with self._lock:
+            return list(self._chats.values())
+
+    @contextmanager
+    def borrow(self, key: str) -> Iterator[Chat]:
+        """
+        Gives access to the chat `key` for a background task. If the chat had to be loaded for it, it's evicted again
+        afterwards, unless it has been accessed by someone else, changed (`Chat.is_dirty`, it's evicted once it has
+        been saved and is idle) or can't be evicted (`Chat.is_evictable`).
+        """
+        with self._lock:
+            borrowed = self.evicting and key not in self._chats
+            chat = self[key]
+            accessed = self._accessed[key]
+
+        yield chat
+
+        if not borrowed:
+            return
+
+        with self._lock:
+            if (self._chats.get(key) is chat and self._accessed.get(key) == accessed and not chat.is_dirty()
+                    and chat.is_evictable()):
+                self._drop(key)
+
+    def evict(self) -> List[str]:
+        """
+        Evicts the idle chats (see `ChatStore`). The chats must have been saved, chats which have changed since
+        (`Chat.is_dirty`) or can't be deserialized without losing anything (`Chat.is_evictable`) are kept.
+
+        :return: The ids of the evicted chats
+        """
+        if not self.evicting:
+            return []
+
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            for key, chat in list(self._chats.items()):
+                if self.max_loaded is not None and len(self._chats) <= self.max_loaded:
+                    break
+                if now - self._accessed.get(key, now) < self.idle_time:
+                    # The remaining chats have been accessed more recently
+                    break
+                if chat.is_dirty() or not chat.is_evictable():
+                    continue
+
+                self._drop(key)
+                evicted.append(key)
+
+        return evicted
+
+    def _drop(self, key: str) -> None:
+        """
+        Evicts the loaded chat `key`, the caller holds the lock.
+        """
+        del self._chats[key]
+        del self._accessed[key]
+        self._serialized[key] = None
+        self._evicted.add(key)
+        self._counts["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counts)
+            stats["loaded"] = len(self._chats)
+            stats["chats"] = len(self)
+            stats["reload_seconds"] = self._reload_seconds
+            stats["max_reload_seconds"] = self._max_reload_seconds
+
+        accesses = stats["hits"] + stats["loads"]
+        stats["hit_rate"] = stats["hits"] / accesses if accesses else None
+        return stats
+
+    def __str__(self) -> str:
+        stats = self.stats()
+        text = f"Chats: {stats['loaded']}/{stats['chats']} loaded"
+        if stats["hit_rate"] is not None:
+            text += f", {stats['hit_rate']:.1%} hits"
+        if self.evicting:
+            text += f", {stats['evictions']} evicted, {stats['reloads']} reloaded"
+            if stats["reloads"]:
+                text += (f" (avg {stats['reload_seconds'] / stats['reloads'] * 1000:.1f}ms, "
+                         f"max {stats['max_reload_seconds'] * 1000:.1f}ms)")
+
+        return text
+
+
+_MISSING = object()
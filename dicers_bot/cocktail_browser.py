@@ -0,0 +1,104 @@
+import itertools
+from dataclasses import dataclass
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+
+from .cocktails import get_cocktails, Cocktail
+
+
+@dataclass
+class Page:
+    text: str
+    category: str
+
+
+def _split_lines(lines: List[str], max_length: int) -> List[List[str]]:
+    """
+    Groups `lines` into chunks of at most `max_length` characters (joined by newlines).
+    A single line longer than `max_length` gets a chunk of its own.
+    """
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    current_length = 0
+    for line in lines:
+        line_length = len(line) + 1
+        if current and current_length + line_length > max_length:
+            chunks.append(current)
+            current = []
+            current_length = 0
+
+        current.append(line)
+        current_length += line_length
+
+    if current:
+        chunks.append(current)
+
+    return chunks
+
+
+class CocktailBrowser:
+    """
+    Renders the cocktail list into pages once per catalog (`get_cocktails` result) and builds the inline keyboard
+    to browse them, so a listing is a single message which is edited in place.
+    """
+    CALLBACK_PREFIX = "cocktails_"
+
+    def __init__(self, page_length: int = 1024, categories_per_row: int = 3):
+        self.page_length = page_length
+        self.categories_per_row = categories_per_row
+        self._lock = Lock()
+        self._catalog: Optional[List[Cocktail]] = None
+        self._pages: List[Page] = []
+        self._categories: List[Tuple[str, int]] = []
+
+    def pages(self) -> List[Page]:
+        cocktails = get_cocktails()
+
+        with self._lock:
+            if cocktails is not self._catalog:
+                self._render(cocktails)
+                self._catalog = cocktails
+
+            return self._pages
+
+    def _render(self, cocktails: List[Cocktail]) -> None:
+        pages = []
+        categories = []
+        for category, category_cocktails in itertools.groupby(cocktails, key=lambda x: x.category):
+            lines = [f"({cocktail.id}) {str(cocktail)}" for cocktail in category_cocktails]
+            header = f"*{category}*\n{'‾' * len(category) * 2}"
+
+            categories.append((category, len(pages)))
+            for chunk in _split_lines(lines, self.page_length - len(header) - 1):
+                pages.append(Page("\n".join([header] + chunk), category))
+
+        self._pages = pages
+        self._categories = categories
+
+    def page(self, index: int) -> Tuple[Optional[Page], int]:
+        """
+        :return: The page at `index` (clamped to the available pages) and the effective index
+        """
+        pages = self.pages()
+        if not pages:
+            return None, 0
+
+        index = max(0, min(index, len(pages) - 1))
+        return pages[index], index
+
+    def keyboard(self, index: int) -> InlineKeyboardMarkup:
+        pages = self.pages()
+        navigation = [
+            InlineKeyboardButton(text="«", callback_data=f"{self.CALLBACK_PREFIX}{max(index - 1, 0)}"),
+            InlineKeyboardButton(text=f"{index + 1}/{len(pages)}", callback_data=f"{self.CALLBACK_PREFIX}{index}"),
+            InlineKeyboardButton(text="»", callback_data=f"{self.CALLBACK_PREFIX}{min(index + 1, len(pages) - 1)}"),
+        ]
+
+        category_buttons = [InlineKeyboardButton(text=category, callback_data=f"{self.CALLBACK_PREFIX}{first_page}")
+                            for category, first_page in self._categories]
+        rows = [category_buttons[i:i + self.categories_per_row]
+                for i in range(0, len(category_buttons), self.categories_per_row)]
+
+        return InlineKeyboardMarkup([navigation] + rows)
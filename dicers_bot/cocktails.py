@@ -1,10 +1,9 @@
-import json
 from dataclasses import dataclass
 from functools import lru_cache
+from http.client import HTTPException
 from typing import Dict, List
 
-from graphqlclient import GraphQLClient
-
+from . import graphql
 from .logger import create_logger
 
 
@@ -42,39 +41,37 @@ class Cocktail:
         return " ".join([f"*{self.name}*", jumbo, alcoholic, ingredients])
 
 
+COCKTAILS_ENDPOINT = "https://rd-backend.carstens.tech/graphql"
+COCKTAILS_QUERY = """
+{
+  cocktails {
+    id
+    name
+    jumbo
+    alcoholic
+    category
+    ingredients {
+      name
+    }
+  }
+}
+"""
+
+
 @lru_cache(maxsize=None)
 def get_cocktails() -> List[Cocktail]:
     logger = create_logger("get_cocktails")
     logger.debug("Start")
 
-    client = GraphQLClient('https://rd-backend.carstens.tech/graphql')
-    # client = GraphQLClient('http://localhost:8000/graphql')
-
-    i = '''
-    {
-      cocktails {
-        id
-        name
-        jumbo
-        alcoholic
-        category
-        ingredients {
-            name
-        }
-      }
-    }
-    '''
+    client = graphql.get_client(COCKTAILS_ENDPOINT)
 
-    # TODO: find out what this throws, probably URLError
-    # noinspection PyBroadException 
     try:
-        result = json.loads(client.execute(i))
-        errors = result.get("errors")
-        if errors:
-            logger.error(f"Couldn't fetch cocktails: {errors}")
-            return []
-
-        return [Cocktail.from_dict(d) for d in result.get("data", {}).get("cocktails", [])]
-    except Exception:
+        data = client.execute(COCKTAILS_QUERY)
+    except graphql.GraphQLError as e:
+        logger.error(f"Couldn't fetch cocktails: {e.errors}")
+        return []
+    except (OSError, HTTPException, ValueError):
         logger.error(f"Couldn't fetch cocktails", exc_info=True)
         return []
+
+    return [Cocktail.from_dict(d) for d in data.get("cocktails", [])]
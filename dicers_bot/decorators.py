@@ -2,15 +2,19 @@ from __future__ import annotations
 
 import inspect
 from datetime import timedelta
+from typing import TYPE_CHECKING
 
 from telegram import Update
 from telegram.ext import CallbackContext
 
-from . import bot
 from . import chat
+from . import flight_recorder
 from . import logger
 from . import user
 
+if TYPE_CHECKING:
+    from . import bot
+
 
 class Command:
     def __init__(self, chat_admin: bool = False, main_admin: bool = False):
@@ -27,7 +31,7 @@ class Command:
         context.chat_data["chat"] = new_chat
 
         new_chat.title = update.effective_chat.title
-        new_chat.type = update.effective_chat.type
+        new_chat.type = chat.ChatType.parse(update.effective_chat.type)
 
         return new_chat
 
@@ -40,7 +44,7 @@ class Command:
             exception = None
             log = logger.create_logger(f"command_{func.__name__}")
             log.debug("Start")
-            log.debug(f"args: {args} | kwargs: {kwargs}")
+            log.debug("args: %s | kwargs: %s", args, kwargs)
 
             signature = inspect.signature(func)
             arguments = signature.bind(*args, **kwargs).arguments
@@ -55,72 +59,79 @@ class Command:
                 log.debug("Execute function due to coming directly from the bot.")
 
                 log.debug(execution_message)
-                result = func(*args, **kwargs)
+                result = clazz.profiler.run(func, *args, **kwargs)
                 log.debug(finished_execution_message)
 
                 return result
 
-            log.debug(f"message from user: {update.effective_user.first_name}")
-            current_chat = context.chat_data.get("chat")
-            if not current_chat:
-                current_chat = self._add_chat(clazz, update, context)
-            current_chat.type = update.effective_chat.type
-
-            if not clazz.chats.get(current_chat.id):
-                clazz.chats[current_chat.id] = current_chat
-
-            current_user = current_chat.get_user_by_id(update.effective_user.id)
-            if not current_user:
-                current_user = self._add_user(update, context)
-
-            current_chat.add_user(current_user)
-            context.user_data["user"] = current_user
-
-            if self.main_admin:
-                if current_chat.id == clazz.state.get("main_id"):
-                    log.debug("Execute function due to coming from the main_chat")
-                else:
-                    message = f"Chat {chat} is not allowed to perform this action."
-                    log.warning(message)
-                    clazz.mute_user(chat_id=current_chat.id, user=current_user, until_date=timedelta(minutes=15),
-                                    reason=message)
-                    exception = PermissionError()
-
-            if self.chat_admin:
-                if current_chat.type == chat.ChatType.PRIVATE:
-                    log.debug("Execute function due to coming from a private chat")
-                elif current_user in current_chat.administrators():
-                    log.debug(
-                        f"User ({current_user.name}) is a chat admin and therefore allowed to perform this action, executing")
-                else:
-                    log.error(
-                        f"User ({current_user.name}) isn't a chat_admin and is not allowed to perform this action.")
-                    exception = PermissionError()
-
-            if update.effective_message:
-                log.debug(f"Message: {update.effective_message.text}")
-                current_chat.add_message(update)  # Needs user in chat
-
-            log.debug(execution_message)
-            try:
-                if exception:
-                    raise exception
-
-                result = func(*args, **kwargs)
-                log.debug(finished_execution_message)
-                return result
-            except PermissionError:
+            chat_id = update.effective_chat.id if update.effective_chat else None
+            with flight_recorder.chat_context(chat_id, clazz.name):
+                log.debug(f"message from user: {update.effective_user.first_name}")
+                current_chat = clazz.chats.get(chat_id)
+                if not current_chat:
+                    current_chat = self._add_chat(clazz, update, context)
+                elif context.chat_data.get("chat") is not current_chat:
+                    # After a restart, or the chat has been evicted (and reloaded) since
+                    context.chat_data["chat"] = current_chat
+                    current_chat.title = update.effective_chat.title
+                current_chat.type = chat.ChatType.parse(update.effective_chat.type)
+
+                current_user = current_chat.get_user_by_id(update.effective_user.id)
+                if not current_user:
+                    current_user = self._add_user(update, context)
+
+                current_chat.add_user(current_user)
+                context.user_data["user"] = current_user
+
+                if self.main_admin:
+                    if current_chat.id == clazz.state.get("main_id"):
+                        log.debug("Execute function due to coming from the main_chat")
+                    else:
+                        message = f"Chat {chat} is not allowed to perform this action."
+                        log.warning(message)
+                        clazz.mute_user(chat_id=current_chat.id, user=current_user, until_date=timedelta(minutes=15),
+                                        reason=message)
+                        exception = PermissionError()
+
+                if self.chat_admin:
+                    if current_chat.type == chat.ChatType.PRIVATE:
+                        log.debug("Execute function due to coming from a private chat")
+                    elif current_user in current_chat.administrators():
+                        log.debug(
+                            f"User ({current_user.name}) is a chat admin and therefore allowed to perform this action, executing")
+                    else:
+                        log.error(
+                            f"User ({current_user.name}) isn't a chat_admin and is not allowed to perform this action.")
+                        exception = PermissionError()
+
                 if update.effective_message:
-                    update.effective_message.reply_text(
-                        f"You ({current_user.name}) are not allowed to perform this action.")
-            except Exception as e:
-                # Log for debugging purposes
-                log.error(str(e), exc_info=True)
-
-                raise e
-            finally:
-                clazz.save_state()
-                log.debug("End")
+                    log.debug(f"Message: {update.effective_message.text}")
+                    current_chat.add_message(update)  # Needs user in chat
+
+                log.debug(execution_message)
+                try:
+                    if exception:
+                        raise exception
+
+                    result = clazz.profiler.run(func, *args, **kwargs)
+                    log.debug(finished_execution_message)
+                    return result
+                except PermissionError:
+                    if update.effective_message:
+                        update.effective_message.reply_text(
+                            f"You ({current_user.name}) are not allowed to perform this action.")
+                except Exception as e:
+                    # Log for debugging purposes
+                    log.error(str(e), exc_info=True)
+                    path = logger.recorder.dump(chat_id, reason=f"Unhandled exception in {func.__name__}: {e!r}",
+                                                tenant=clazz.name)
+                    if path:
+                        log.info(f"Dumped the flight recorder to {path}")
+
+                    raise e
+                finally:
+                    clazz.save_state()
+                    log.debug("End")
 
         return wrapped_f
 
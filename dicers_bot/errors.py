@@ -0,0 +1,163 @@
+import random
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from queue import Queue, Full
+from threading import Lock, Thread
+from typing import Dict, Any, Optional, Tuple
+
+from telegram.error import TimedOut, RetryAfter, Unauthorized
+
+from .logger import create_logger
+
+# Errors which are part of normal operation (timeouts, flood control, chats which have blocked/removed the bot)
+EXPECTED_ERRORS = (TimedOut, RetryAfter, Unauthorized)
+
+Fingerprint = Tuple[Any, ...]
+
+
+class _Occurrences:
+    __slots__ = ("count", "last_reported", "period_start", "period_reports")
+
+    def __init__(self):
+        self.count = 0
+        self.last_reported: Optional[float] = None
+        self.period_start = 0.0
+        self.period_reports = 0
+
+
+class ErrorReporter:
+    """
+    Reports errors to Sentry from a background thread, so the handlers don't wait for building and sending the event.
+
+    Errors are grouped by a fingerprint (type and the innermost `frames` frames of the traceback). An error is not
+    reported if it is expected (`EXPECTED_ERRORS` or `expected=True`), if the same fingerprint has been reported in
+    the last `dedup_window` seconds, if the fingerprint has been reported `max_per_period` times in the current
+    `period` seconds or if it isn't sampled (`sample_rate`). At most `queue_size` errors wait to be sent, further
+    errors are dropped, as are all errors while Sentry hasn't been initialized (no `sentry_dsn`). Every suppressed
+    error is counted, see `stats`.
+    `sentry_sdk` is imported by the thread, which is started with the first reported error.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, dedup_window: float = 60, max_per_period: int = 10,
+                 period: float = 3600, queue_size: int = 100, frames: int = 5, max_fingerprints: int = 1000):
+        self.sample_rate = sample_rate
+        self.dedup_window = dedup_window
+        self.max_per_period = max_per_period
+        self.period = period
+        self.frames = frames
+        self.max_fingerprints = max_fingerprints
+        self.logger = create_logger("errors")
+        self._lock = Lock()
+        self._queue: "Queue[BaseException]" = Queue(maxsize=queue_size)
+        self._occurrences: "OrderedDict[Fingerprint, _Occurrences]" = OrderedDict()
+        self._counts = {"reported": 0, "expected": 0, "deduplicated": 0, "rate_limited": 0, "sampled_out": 0,
+                        "dropped": 0, "failed": 0}
+        self._thread: Optional[Thread] = None
+
+    def fingerprint(self, error: BaseException) -> Fingerprint:
+        frames = [(frame.f_code.co_filename, frame.f_code.co_name, lineno)
+                  for frame, lineno in traceback.walk_tb(error.__traceback__)]
+
+        return (type(error).__module__, type(error).__qualname__) + tuple(frames[-self.frames:])
+
+    def report(self, error: BaseException, expected: bool = False) -> bool:
+        """
+        :param expected: The error is caused by the user or otherwise part of normal operation, it's only counted
+        :return: Whether the error is going to be sent
+        """
+        if expected or isinstance(error, EXPECTED_ERRORS):
+            self._count("expected")
+            return False
+
+        fingerprint = self.fingerprint(error)
+        now = time.monotonic()
+        with self._lock:
+            occurrences = self._occurrences.get(fingerprint)
+            if occurrences is None:
+                occurrences = self._occurrences[fingerprint] = _Occurrences()
+                if len(self._occurrences) > self.max_fingerprints:
+                    self._occurrences.popitem(last=False)
+            else:
+                self._occurrences.move_to_end(fingerprint)
+            occurrences.count += 1
+
+            if occurrences.last_reported is not None and now - occurrences.last_reported < self.dedup_window:
+                self._counts["deduplicated"] += 1
+                return False
+
+            if now - occurrences.period_start >= self.period:
+                occurrences.period_start = now
+                occurrences.period_reports = 0
+            if occurrences.period_reports >= self.max_per_period:
+                self._counts["rate_limited"] += 1
+                return False
+
+            if random.random() >= self.sample_rate:
+                self._counts["sampled_out"] += 1
+                return False
+
+            occurrences.last_reported = now
+            occurrences.period_reports += 1
+
+        if not self.enabled:
+            self._count("dropped")
+            return False
+
+        self._start()
+        try:
+            self._queue.put_nowait(error)
+        except Full:
+            self._count("dropped")
+            return False
+
+        return True
+
+    @property
+    def enabled(self) -> bool:
+        """
+        :return: Whether Sentry has been initialized, without importing `sentry_sdk` if it hasn't been imported yet
+        """
+        sentry_sdk = sys.modules.get("sentry_sdk")
+        return sentry_sdk is not None and sentry_sdk.Hub.current.client is not None
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+    def _start(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = Thread(target=self._send_loop, name="error_reporter", daemon=True)
+                    self._thread.start()
+
+    def _send_loop(self) -> None:
+        import sentry_sdk
+
+        while True:
+            error = self._queue.get()
+            try:
+                sentry_sdk.capture_exception(error)
+                self._count("reported")
+            except Exception:
+                self._count("failed")
+                self.logger.warning("Couldn't report error", exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counts)
+            stats["fingerprints"] = len(self._occurrences)
+
+        stats["queued"] = self._queue.qsize()
+        stats["suppressed"] = sum(stats[key] for key in ("expected", "deduplicated", "rate_limited", "sampled_out",
+                                                          "dropped"))
+        return stats
+
+    def __str__(self) -> str:
+        stats = self.stats()
+        return (f"Errors: {stats['reported']} reported, {stats['suppressed']} suppressed ("
+                f"{stats['expected']} expected, {stats['deduplicated']} duplicates, "
+                f"{stats['rate_limited']} rate limited, {stats['sampled_out']} not sampled, "
+                f"{stats['dropped']} dropped)")
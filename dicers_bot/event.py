@@ -5,27 +5,33 @@ from typing import Set, Dict, Any, Optional
 
 from . import user
 from .logger import create_logger
+from .tracking import Tracked
 
 
-class Event:
-    def __init__(self):
-        self.date_format = "%d.%m.%Y"
-        self.timestamp = self._next_monday()
-        self.logger = create_logger("event_{}".format(self.timestamp))
-        self.logger.info("Create event")
+class Event(Tracked):
+    __slots__ = ("timestamp", "attendees", "absentees", "remote_created")
+
+    date_format = "%d.%m.%Y"
+    logger = create_logger("event")
+    tracked = frozenset({"timestamp", "attendees", "absentees"})
+
+    def __init__(self, timestamp: Optional[datetime] = None):
+        self.dirty = True
+        self.timestamp = timestamp or self._next_monday()
         self.attendees: Set[user.User] = set()
         self.absentees: Set = set()
-        self.logger.info("Created event for {}".format(self.timestamp))
         self.remote_created = False
 
     def add_absentee(self, user) -> None:
         self.logger.info("Add absentee {} to event".format(user))
 
         self.absentees.add(user)
+        self.dirty = True
 
     def remove_absentee(self, user) -> None:
         self.logger.info("Remove absentee {} from event".format(user))
         self.absentees.remove(user)
+        self.dirty = True
         self.add_attendee(user)
 
     def add_attendee(self, user: user.User) -> None:
@@ -35,10 +41,23 @@ class Event:
         except KeyError:
             self.logger.info("User was not in absentees: {}".format(user))
         self.attendees.add(user)
+        self.dirty = True
 
     def remove_attendee(self, user) -> None:
         self.logger.info("Remove {} from event".format(user))
         self.attendees.remove(user)
+        self.dirty = True
+
+    def is_dirty(self) -> bool:
+        """
+        :return: Whether the event or one of its attendees/absentees has changed since the last `clean`
+        """
+        return self.dirty or any(user.dirty for user in self.attendees) or any(user.dirty for user in self.absentees)
+
+    def clean(self) -> None:
+        self.dirty = False
+        for user in self.attendees | self.absentees:
+            user.dirty = False
 
     def serialize(self) -> Dict[str, Any]:
         # self.logger.info("Serialize event")
@@ -55,10 +74,10 @@ class Event:
         if not json_object:
             return None
 
-        event = Event()
-        event.timestamp = datetime.strptime(json_object.get("timestamp"), event.date_format)
+        event = Event(datetime.strptime(json_object.get("timestamp"), cls.date_format))
         event.attendees = set([user.User.deserialize(attendee) for attendee in json_object.get("attendees", [])])
         event.absentees = set([user.User.deserialize(absentee) for absentee in json_object.get("absentees", [])])
+        event.dirty = False
 
         return event
 
@@ -0,0 +1,86 @@
+import csv
+import itertools
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Dict, Any, Iterable, Iterator, Optional, TextIO
+
+from .chat import Chat
+from .event import Event
+
+
+class ExportFormat(Enum):
+    JSON = "json"
+    JSONL = "jsonl"
+    CSV = "csv"
+
+
+CSV_FIELDS = ["date", "user_id", "name", "attended", "roll", "jumbo", "alcoholic", "drink_name"]
+
+
+def write_chat_json(chat: Chat, f: TextIO, events: Optional[Iterable[Dict[str, Any]]] = None) -> None:
+    """
+    Writes the chat in the format of `Chat.serialize` without building the serialized form of its whole history,
+    the events are encoded one by one.
+
+    :param events: Serialized events to write instead of all historical events of the chat
+    """
+    if events is None:
+        events = chat.serialized_events()
+
+    header = json.dumps(chat.serialize(include_events=False))
+    f.write(header[:-1])
+    f.write(', "events": [')
+    for i, event in enumerate(events):
+        if i:
+            f.write(", ")
+        json.dump(event, f)
+    f.write("]}")
+
+
+def filter_events(chat: Chat, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  include_current: bool = False,
+                  archived: Iterable[Dict[str, Any]] = ()) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the serialized events of `chat` which took place between `since` and `until` (both inclusive).
+
+    :param archived: The archived events of the chat (see `EventArchive.events`), they precede the chat's events
+    """
+    events: Iterable[Dict[str, Any]] = itertools.chain(archived, chat.serialized_events())
+    if include_current and chat.current_event:
+        events = itertools.chain(events, [chat.current_event.serialize()])
+
+    for event in events:
+        if since or until:
+            timestamp = datetime.strptime(event["timestamp"], Event.date_format)
+            if (since and timestamp < since) or (until and timestamp > until):
+                continue
+
+        yield event
+
+
+def export_chat(chat: Chat, f: TextIO, export_format: ExportFormat = ExportFormat.JSON,
+                since: Optional[datetime] = None, until: Optional[datetime] = None,
+                archived: Iterable[Dict[str, Any]] = ()) -> None:
+    """
+    Streams the history of `chat` (preceded by the `archived` events) into `f`.
+
+    - `JSON`: The chat as in the state file, restricted to the events in the date range
+    - `JSONL`: One event per line, including the current event
+    - `CSV`: One row per vote (attendee or absentee) and event, including the current event
+    """
+    if export_format == ExportFormat.JSON:
+        write_chat_json(chat, f, filter_events(chat, since, until, archived=archived))
+    elif export_format == ExportFormat.JSONL:
+        for event in filter_events(chat, since, until, include_current=True, archived=archived):
+            json.dump(event, f)
+            f.write("\n")
+    elif export_format == ExportFormat.CSV:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for event in filter_events(chat, since, until, include_current=True, archived=archived):
+            for attended, users in ((True, event.get("attendees", [])), (False, event.get("absentees", []))):
+                for user in users:
+                    writer.writerow(dict(user, date=event["timestamp"], user_id=user.get("id"), attended=attended))
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
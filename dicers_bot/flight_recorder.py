@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, List, Optional, Iterator, Tuple
+
+_context = threading.local()
+
+# Key of the records which haven't been logged while handling an update of a chat
+GLOBAL = "global"
+
+
+def current_chat() -> Any:
+    return getattr(_context, "chat_id", None)
+
+
+def current_tenant() -> Optional[str]:
+    return getattr(_context, "tenant", None)
+
+
+@contextmanager
+def chat_context(chat_id: Any, tenant: Optional[str] = None) -> Iterator[None]:
+    """
+    Attributes the records logged by this thread to `chat_id` of the bot `tenant` until the context is left.
+    """
+    previous = current_chat(), current_tenant()
+    _context.chat_id, _context.tenant = chat_id, tenant
+    try:
+        yield
+    finally:
+        _context.chat_id, _context.tenant = previous
+
+
+class FlightRecorder(logging.Handler):
+    """
+    Keeps the last `capacity` records of each chat (see `chat_context`) in memory for the `max_chats` chats which have
+    logged last. Only their messages are rendered when they are recorded, the formatting (timestamp, logger name, ...)
+    is done when the records of a chat are written to `directory` with `dump`, e.g. after an unhandled exception.
+    The buffers are kept per tenant, since the bots of a process can share chat ids.
+    """
+
+    def __init__(self, capacity: int = 500, max_chats: int = 200, directory: str = "logs"):
+        super().__init__(logging.DEBUG)
+        self.capacity = capacity
+        self.max_chats = max_chats
+        self.directory = directory
+        # (tenant, chat id) -> records
+        self._buffers: "OrderedDict[Tuple[Optional[str], Any], Deque[logging.LogRecord]]" = OrderedDict()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            # Don't keep the arguments (updates, chats, ...) alive or render them in a later state when dumping
+            record.msg = record.getMessage()
+            record.args = None
+        except Exception:
+            self.handleError(record)
+            return
+
+        if record.exc_info:
+            # Don't keep the frames of the traceback alive
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        # `handle` holds `self.lock`
+        chat_id = current_chat()
+        key = current_tenant(), GLOBAL if chat_id is None else chat_id
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = deque(maxlen=self.capacity)
+            if len(self._buffers) > self.max_chats:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(key)
+
+        buffer.append(record)
+
+    def records(self, chat_id: Any = None, tenant: Optional[str] = None) -> List[logging.LogRecord]:
+        """
+        :return: The records of `chat_id` of `tenant`, or of every chat of `tenant` if it's `None`, oldest first
+        """
+        with self.lock:
+            if chat_id is None:
+                records = [record for key, buffer in self._buffers.items() if key[0] == tenant for record in buffer]
+            else:
+                records = list(self._buffers.get((tenant, chat_id), ()))
+
+        return sorted(records, key=lambda record: record.created)
+
+    def dump(self, chat_id: Any = None, reason: Optional[str] = None, tenant: Optional[str] = None) -> Optional[str]:
+        """
+        Writes the records of `chat_id` of `tenant` (every chat of `tenant` if `None`) to a new file in `directory`.
+
+        :return: The path of the file, `None` if there are no records
+        """
+        records = self.records(chat_id, tenant)
+        if not records:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        prefix = f"{timestamp}_{tenant}" if tenant else timestamp
+        path = os.path.join(self.directory, f"{prefix}_{'all' if chat_id is None else chat_id}.log")
+        formatter = self.formatter or logging.Formatter()
+        with open(path, "w") as f:
+            if reason:
+                f.write(f"{reason}\n\n")
+            for record in records:
+                f.write(formatter.format(record))
+                f.write("\n")
+
+        return path
@@ -0,0 +1,186 @@
+import http.client
+import json
+import time
+from queue import LifoQueue, Empty, Full
+from threading import Lock
+from typing import Dict, Any, Optional, List, Tuple
+from urllib.parse import urlsplit
+
+from .logger import create_logger
+
+
+class GraphQLError(Exception):
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"GraphQL errors: {errors}")
+        self.errors = errors
+
+
+class GraphQLClient:
+    """
+    GraphQL client for a single endpoint which keeps up to `pool_size` idle keep-alive connections.
+
+    Failed requests (connection errors and 5xx responses) are retried `retries` times with exponential backoff,
+    errors in the GraphQL response are raised as `GraphQLError` without retrying.
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 10, retries: int = 2, backoff: float = 0.5,
+                 pool_size: int = 4):
+        url = urlsplit(endpoint)
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.logger = create_logger(f"graphql_{url.netloc}")
+        self._host = url.netloc
+        self._path = url.path or "/"
+        self._connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self._pool: LifoQueue = LifoQueue(maxsize=pool_size)
+        self._metrics_lock = Lock()
+        self._metrics = {"requests": 0, "failures": 0, "retries": 0, "connections": 0, "seconds": 0.0,
+                         "last_seconds": 0.0}
+
+    def _acquire(self, reuse: bool = True) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        :return: An idle connection from the pool (if `reuse` is set) or a new one and whether it has been reused
+        """
+        if reuse:
+            try:
+                return self._pool.get_nowait(), True
+            except Empty:
+                pass
+
+        self._count("connections")
+        return self._connection_class(self._host, timeout=self.timeout), False
+
+    def _release(self, connection: http.client.HTTPConnection) -> None:
+        try:
+            self._pool.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def _count(self, key: str, value: float = 1) -> None:
+        with self._metrics_lock:
+            self._metrics[key] += value
+
+    def metrics(self) -> Dict[str, float]:
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+
+        metrics["average_seconds"] = metrics["seconds"] / metrics["requests"] if metrics["requests"] else 0.0
+        return metrics
+
+    def __str__(self) -> str:
+        metrics = self.metrics()
+        return (f"GraphQL {self._host}: {metrics['requests']} requests ({metrics['average_seconds'] * 1000:.0f}ms avg, "
+                f"last {metrics['last_seconds'] * 1000:.0f}ms), {metrics['failures']} failed, "
+                f"{metrics['retries']} retries, {metrics['connections']} connections")
+
+    def _post(self, body: bytes, reuse: bool = True) -> Dict[str, Any]:
+        connection, reused = self._acquire(reuse)
+        # Only a reused connection which the server has closed before it got the request is retried right away.
+        # Timeouts and errors after the request has been sent aren't, the server might have processed the request.
+        stale = False
+        try:
+            try:
+                connection.request("POST", self._path, body=body, headers={
+                    "Content-Type": "application/json",
+                    "Accept": "application/json",
+                })
+            except (BrokenPipeError, ConnectionResetError):
+                stale = reused
+                raise
+
+            try:
+                response = connection.getresponse()
+            except http.client.RemoteDisconnected:
+                # Closed without sending anything, which is how servers close idle keep-alive connections
+                stale = reused
+                raise
+
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            if stale:
+                return self._post(body, reuse=False)
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+
+        if response.status >= 500:
+            raise ConnectionError(f"{self.endpoint} responded with {response.status}")
+
+        return json.loads(content.decode("utf-8"))
+
+    def execute(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        :return: The `data` of the response
+        :raises: GraphQLError if the response contains errors, OSError or `http.client.HTTPException` if the request
+                 failed after all retries
+        """
+        body = json.dumps({"query": query, "variables": variables or {}}).encode("utf-8")
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                result = self._post(body)
+            except (OSError, http.client.HTTPException) as e:
+                self._count("failures")
+                if attempt >= self.retries:
+                    raise
+
+                delay = self.backoff * 2 ** attempt
+                self.logger.warning(f"Request to {self.endpoint} failed ({e}), retry in {delay}s")
+                self._count("retries")
+                attempt += 1
+                time.sleep(delay)
+                continue
+            finally:
+                duration = time.perf_counter() - start
+                self._count("requests")
+                self._count("seconds", duration)
+                with self._metrics_lock:
+                    self._metrics["last_seconds"] = duration
+
+            errors = result.get("errors")
+            if errors:
+                raise GraphQLError(errors)
+
+            return result.get("data") or {}
+
+
+_defaults: Dict[str, Any] = {}
+_clients: Dict[str, GraphQLClient] = {}
+_clients_lock = Lock()
+
+
+def configure(**options) -> None:
+    """
+    Sets the default options (see `GraphQLClient`) for clients which haven't been created yet.
+    """
+    _defaults.update(options)
+
+
+def get_client(endpoint: str, **options) -> GraphQLClient:
+    """
+    :return: The shared client (and connection pool) for `endpoint`, created with `options` on first use
+    """
+    with _clients_lock:
+        client = _clients.get(endpoint)
+        if client is None:
+            client = GraphQLClient(endpoint, **dict(_defaults, **options))
+            _clients[endpoint] = client
+
+        return client
+
+
+def clients() -> List[GraphQLClient]:
+    with _clients_lock:
+        return list(_clients.values())
+
+
+def metrics() -> Dict[str, Dict[str, float]]:
+    return {client.endpoint: client.metrics() for client in clients()}
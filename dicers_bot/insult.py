@@ -1,39 +1,149 @@
+import os
 import random
+from collections import OrderedDict
+from threading import RLock
+from typing import List, Optional, Set, Dict, Tuple
 
-from typing import List
+from .logger import create_logger
 
 
-class Insult:
-    FILENAME = "insults"
-    cache = list()
+class InsultPool:
+    """
+    The insults of a single file, kept in memory and only read again if the file has been changed.
+    """
 
-    def __init__(self, text: str):
-        self.text = text
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._version: Optional[Tuple[int, int]] = None
+        self._insults: List[str] = []
+        self._texts: Set[str] = set()
 
-    @staticmethod
-    def read_all() -> List["Insult"]:
-        with open(Insult.FILENAME) as file:
-            insults = [Insult(line.strip()) for line in file.readlines() if line.strip()]
-            Insult.cache = insults
+    def _file_version(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
 
-            return insults
+        return stat.st_mtime_ns, stat.st_size
 
-    @classmethod
-    def random(cls) -> "Insult":
-        insults = Insult.read_all()
+    def refresh(self) -> bool:
+        """
+        Reads the file again if it has been changed since it has been read last.
 
-        return insults[random.randint(0, len(insults) - 1)]
+        :return: Whether the insults have changed
+        """
+        version = self._file_version()
+        if version == self._version:
+            return False
 
-    @staticmethod
-    def add(text: str) -> bool:
-        if not Insult.cache:
-            Insult.cache = Insult.read_all()
+        insults = []
+        if version:
+            with open(self.filename) as file:
+                insults = [line.strip() for line in file if line.strip()]
 
-        if text not in [insult.text for insult in Insult.cache]:
-            Insult.cache.append(Insult(text))
-            with open(Insult.FILENAME, "a+") as file:
-                file.writelines("\n" + text)
+        self._version = version
+        self._insults = insults
+        self._texts = set(insults)
 
-            return True
+        return True
+
+    def all(self) -> List[str]:
+        return self._insults
+
+    def __contains__(self, text: str) -> bool:
+        return text in self._texts
+
+    def append(self, text: str) -> None:
+        with open(self.filename, "a+") as file:
+            file.writelines("\n" + text)
+
+        self._insults = self._insults + [text]
+        self._texts.add(text)
+        self._version = self._file_version()
+
+
+class InsultStore:
+    """
+    Insults from `filename` and, with `per_chat`, per chat from `<filename>.<chat_id>`.
+
+    The files are only read again if they changed, `random` doesn't repeat an insult
+    before every insult of the chat has been used. Without `per_chat` every chat draws from the same deck, otherwise
+    the decks of the `max_decks` chats which have been insulted last are kept.
+    """
+
+    def __init__(self, filename: str = "insults", per_chat: bool = False, max_decks: int = 200):
+        self.filename = filename
+        self.per_chat = per_chat
+        self.max_decks = max_decks
+        self.logger = create_logger("insults")
+        self._lock = RLock()
+        self._pool = InsultPool(filename)
+        self._chat_pools: Dict[str, InsultPool] = {}
+        self._decks: "OrderedDict[Optional[str], List[str]]" = OrderedDict()
+
+    def _chat_pool(self, chat_id: Optional[str]) -> Optional[InsultPool]:
+        if chat_id is None or not self.per_chat:
+            return None
+
+        pool = self._chat_pools.get(chat_id)
+        if pool is None:
+            pool = InsultPool(f"{self.filename}.{chat_id}")
+            self._chat_pools[chat_id] = pool
 
-        return False
+        return pool
+
+    def _refresh(self, chat_id: Optional[str]) -> None:
+        changed = self._pool.refresh()
+        if changed:
+            self.logger.debug(f"Reloaded {self.filename}")
+            self._decks.clear()
+
+        chat_pool = self._chat_pool(chat_id)
+        if chat_pool and chat_pool.refresh():
+            self._decks.pop(chat_id, None)
+
+    def all(self, chat_id: Optional[str] = None) -> List[str]:
+        with self._lock:
+            self._refresh(chat_id)
+            chat_pool = self._chat_pool(chat_id)
+
+            return self._pool.all() + (chat_pool.all() if chat_pool else [])
+
+    def random(self, chat_id: Optional[str] = None) -> str:
+        """
+        :raises: IndexError if there are no insults
+        """
+        key = chat_id if self.per_chat else None
+        with self._lock:
+            deck = self._decks.get(key)
+            self._refresh(key)
+            if not deck or deck is not self._decks.get(key):
+                deck = self.all(key)[:]
+                random.shuffle(deck)
+                self._decks[key] = deck
+                if len(self._decks) > self.max_decks:
+                    self._decks.popitem(last=False)
+            else:
+                self._decks.move_to_end(key)
+
+            return deck.pop()
+
+    def add(self, text: str, chat_id: Optional[str] = None) -> bool:
+        """
+        Adds the insult to the chat's pool if `per_chat` is set, otherwise to the shared insults.
+
+        :return: Whether the insult has been added (`False` if it exists already)
+        """
+        with self._lock:
+            self._refresh(chat_id)
+            chat_pool = self._chat_pool(chat_id)
+            if text in self._pool or (chat_pool and text in chat_pool):
+                return False
+
+            pool = chat_pool or self._pool
+            pool.append(text)
+            for key, deck in self._decks.items():
+                if pool is self._pool or key == chat_id:
+                    deck.insert(random.randint(0, len(deck)), text)
+
+            return True
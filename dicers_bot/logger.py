@@ -1,16 +1,38 @@
 import logging
+import sys
+from typing import Union
 
+from .flight_recorder import FlightRecorder
 
-def create_logger(name: str, level: int = logging.DEBUG) -> logging.Logger:
-    import sys
-    logger = logging.Logger(name)
-    ch = logging.StreamHandler(sys.stdout)
+FORMAT = "[%(name)s] %(asctime)s\t%(levelname)s\t%(module)s.%(funcName)s#%(lineno)d | %(message)s"
+DISABLED = logging.CRITICAL + 1
 
-    formatting = "[{}] %(asctime)s\t%(levelname)s\t%(module)s.%(funcName)s#%(lineno)d | %(message)s".format(name)
-    formatter = logging.Formatter(formatting)
-    ch.setFormatter(formatter)
+# Shared by every logger, so `configure_logging` also applies to the loggers which have been created before
+_stdout = logging.StreamHandler(sys.stdout)
+_stdout.setFormatter(logging.Formatter(FORMAT))
+recorder = FlightRecorder()
+recorder.setFormatter(logging.Formatter(FORMAT))
+recorder.setLevel(DISABLED)
 
-    logger.addHandler(ch)
+
+def create_logger(name: str, level: int = logging.DEBUG) -> logging.Logger:
+    logger = logging.Logger(name)
+    logger.addHandler(_stdout)
+    logger.addHandler(recorder)
     logger.setLevel(level)
 
     return logger
+
+
+def configure_logging(level: Union[int, str] = logging.DEBUG, flight_recorder: bool = False,
+                      capacity: int = 500, max_chats: int = 200, directory: str = "logs") -> None:
+    """
+    Writes the records of at least `level` to stdout. With `flight_recorder`, every record is also kept in
+    the in-memory ring buffer of its chat (see `FlightRecorder`), so the debug records of a chat are available after
+    an error without writing all of them out.
+    """
+    _stdout.setLevel(level)
+    recorder.setLevel(logging.DEBUG if flight_recorder else DISABLED)
+    recorder.capacity = capacity
+    recorder.max_chats = max_chats
+    recorder.directory = directory
@@ -0,0 +1,164 @@
+import json
+import os
+import random
+import time
+from threading import Condition, Thread
+from typing import Dict, Any, Callable, Optional
+
+from .logger import create_logger
+
+
+class Outbox:
+    """
+    Persistent queue for side effects of handlers which talk to third party services (calendar, partyamt).
+
+    Entries are written to `filename` before they are executed by a background worker, failed entries are retried
+    with exponential backoff. Every entry has an idempotency key: enqueueing a key which is pending or has been
+    completed within `keep_completed` seconds is a no-op, and the key is passed to the handler so it can deduplicate
+    on the remote side as well. If `enabled` isn't set, entries are only stored (e.g. for load tests).
+    """
+
+    def __init__(self, filename: str = "state/outbox.json", max_attempts: int = 10, base_delay: float = 5,
+                 max_delay: float = 3600, keep_completed: float = 30 * 24 * 60 * 60, enabled: bool = True):
+        self.filename = filename
+        self.enabled = enabled
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.keep_completed = keep_completed
+        self.logger = create_logger("outbox")
+        self._handlers: Dict[str, Callable[[str, Dict[str, Any]], Any]] = {}
+        self._condition = Condition()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._completed: Dict[str, float] = {}
+        self._running = False
+        self._thread: Optional[Thread] = None
+        self._load()
+
+    def register(self, kind: str, handler: Callable[[str, Dict[str, Any]], Any]) -> None:
+        """
+        :param handler: Called with the idempotency key and the payload of an entry, raises to signal a failure
+        """
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind: str, key: str, payload: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        :return: Whether a new entry has been added
+        """
+        with self._condition:
+            if key in self._pending or key in self._completed:
+                self.logger.debug(f"{key} is already in the outbox")
+                return False
+
+            self._pending[key] = {
+                "kind": kind,
+                "key": key,
+                "payload": payload or {},
+                "attempts": 0,
+                "next_attempt": time.time()
+            }
+            self._save()
+            self._condition.notify()
+
+        self.logger.info(f"Enqueued {kind} ({key})")
+        return True
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        if self._running or not self.enabled:
+            return
+
+        self._running = True
+        self._thread = Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _next_entry(self) -> Optional[Dict[str, Any]]:
+        """
+        Waits for the next due entry, returns `None` if the outbox has been stopped.
+        """
+        with self._condition:
+            while self._running:
+                now = time.time()
+                due = min(self._pending.values(), key=lambda entry: entry["next_attempt"], default=None)
+                if due and due["next_attempt"] <= now:
+                    return due
+
+                self._condition.wait(due["next_attempt"] - now if due else None)
+
+        return None
+
+    def _run(self) -> None:
+        while True:
+            entry = self._next_entry()
+            if entry is None:
+                return
+
+            self._execute(entry)
+
+    def _execute(self, entry: Dict[str, Any]) -> None:
+        key = entry["key"]
+        handler = self._handlers.get(entry["kind"])
+
+        # noinspection PyBroadException
+        try:
+            if not handler:
+                raise LookupError(f"No handler for {entry['kind']}")
+
+            handler(key, entry["payload"])
+        except Exception:
+            attempts = entry["attempts"] + 1
+            with self._condition:
+                if attempts >= self.max_attempts:
+                    self.logger.error(f"Giving up on {key} after {attempts} attempts", exc_info=True)
+                    del self._pending[key]
+                else:
+                    delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+                    delay += random.uniform(0, delay / 10)
+                    self.logger.warning(f"{key} failed (attempt {attempts}), retry in {delay:.0f}s", exc_info=True)
+                    entry["attempts"] = attempts
+                    entry["next_attempt"] = time.time() + delay
+                self._save()
+        else:
+            self.logger.info(f"Completed {key}")
+            with self._condition:
+                del self._pending[key]
+                self._completed[key] = time.time()
+                self._save()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename) as f:
+                content = json.load(f)
+        except json.decoder.JSONDecodeError:
+            self.logger.error(f"Couldn't read {self.filename}", exc_info=True)
+            return
+
+        self._pending = {entry["key"]: entry for entry in content.get("pending", [])}
+        self._completed = content.get("completed", {})
+        self.logger.info(f"Loaded {len(self._pending)} pending entries")
+
+    def _save(self) -> None:
+        now = time.time()
+        self._completed = {key: completed for key, completed in self._completed.items()
+                           if now - completed < self.keep_completed}
+
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        temp_path = f"{self.filename}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"pending": list(self._pending.values()), "completed": self._completed}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.filename)
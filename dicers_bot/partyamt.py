@@ -1,26 +1,40 @@
-from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict
 
-from graphqlclient import GraphQLClient
+from . import graphql
+from .logger import create_logger
 
+PARTYAMT_ENDPOINT = "https://partyamt.carstens.tech/graphql"
+ADD_EVENT_MUTATION = """
+mutation AddEvent($time: Int!) {
+  addEvent(input: {
+    title: "Würfeln",
+    time: $time,
+    location: {name: "Kasinostr. 5, Darmstadt"},
+    partyamtId: 0,
+    url: "https://www.enchilada.de",
+    description: "awesome possum",
+    icsLink: "",
+    mapsLink: "https://www.google.com/maps/place/Kasinostra%C3%9Fe+5,+64293+Darmstadt/@49.8726113,8.6423045,17z/data=!3m1!4b1!4m5!3m4!1s0x47bd708841ee43a5:0x5629d5367ee8115e!8m2!3d49.8726113!4d8.6444985",
+    tags: []
+  }) {
+    id
+  }
+}
+"""
 
-def add_event() -> Optional[Dict]:
-    log = dicers_bot.create_logger("partyamt")
-    client = GraphQLClient('https://partyamt.carstens.tech/graphql')
 
-    i = '''
-    mutation {
-      addEvent(input:{title:"Würfeln",time:{{timestamp}},location:{name:"Kasinostr. 5, Darmstadt"},partyamtId:0,url:"https://www.enchilada.de",description:"awesome possum",icsLink:"", mapsLink:"https://www.google.com/maps/place/Kasinostra%C3%9Fe+5,+64293+Darmstadt/@49.8726113,8.6423045,17z/data=!3m1!4b1!4m5!3m4!1s0x47bd708841ee43a5:0x5629d5367ee8115e!8m2!3d49.8726113!4d8.6444985",tags:[]}) {
-        id
-      }
-    }
-    '''.replace("{{timestamp}}", str(int(datetime.now().replace(hour=22, minute=0).timestamp())))
+def add_event(timestamp: int) -> Dict:
+    """
+    Adds the event starting at `timestamp` to partyamt.
+    The request isn't retried by the client since it isn't idempotent, the caller (`Outbox`) retries instead.
+    partyamt has no idempotency key, so if partyamt has added the event but the response is lost (e.g. a timeout),
+    the retry of the outbox adds it a second time.
 
-    # TODO: find out what this throws, probably URLError
-    # noinspection PyBroadException
-    try:
-        log.debug("Executing graphql query")
-        return client.execute(i)
-    except Exception as e:
-        log.error(f"Error while sending graphql {e}", exc_info=True)
-        pass
+    :raises: OSError or `http.client.HTTPException` if the request failed, `graphql.GraphQLError` if the response
+             contains errors
+    """
+    log = create_logger("partyamt")
+    client = graphql.get_client(PARTYAMT_ENDPOINT, retries=0)
+
+    log.debug("Executing graphql query")
+    return client.execute(ADD_EVENT_MUTATION, {"time": timestamp})
@@ -0,0 +1,172 @@
+import cProfile
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Callable, List, Tuple
+
+from .logger import create_logger
+
+
+class ProfilerError(Exception):
+    pass
+
+
+class Profiler:
+    """
+    On-demand `cProfile` profiler for the bot's handlers.
+
+    `cProfile` only sees the thread it has been enabled in, so every call passed to `run` is profiled on its own
+    (dispatcher threads, job queue callbacks, timers, ...) and merged into a single `pstats.Stats` afterwards.
+
+    A session is always bounded: it stops after `max_duration` seconds and stops collecting after `max_calls`
+    profiled calls, which caps the overhead in production.
+    """
+
+    def __init__(self, directory: str = "profiles", max_duration: int = 300, max_calls: int = 5000, top: int = 15):
+        self.directory = directory
+        self.max_duration = max_duration
+        self.max_calls = max_calls
+        self.top = top
+        self.logger = create_logger("profiler")
+        self._lock = threading.Lock()
+        self._stats: Optional[pstats.Stats] = None
+        self._running = False
+        self._started: Optional[float] = None
+        self._calls = 0
+        self._timer: Optional[threading.Timer] = None
+        self._on_stop: Optional[Callable[[Optional[str]], None]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    def elapsed(self) -> float:
+        if self._started is None:
+            return 0.0
+
+        return time.monotonic() - self._started
+
+    def start(self, duration: Optional[int] = None, on_stop: Optional[Callable[[Optional[str]], None]] = None) -> int:
+        """
+        Starts a profiling session.
+
+        :param duration: Seconds to profile for, capped at `max_duration`
+        :param on_stop: Called with the path of the written stats file once the session has been stopped by the timer
+        :raises: ProfilerError if a session is already running
+        :return: The effective duration in seconds
+        """
+        duration = min(duration or self.max_duration, self.max_duration)
+        if duration <= 0:
+            raise ProfilerError("Duration has to be positive")
+
+        with self._lock:
+            if self._running:
+                raise ProfilerError("Profiler is already running")
+
+            self._stats = None
+            self._calls = 0
+            self._started = time.monotonic()
+            self._on_stop = on_stop
+            self._running = True
+
+        self._timer = threading.Timer(duration, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+        self.logger.info(f"Started profiling for {duration}s")
+
+        return duration
+
+    def stop(self) -> Optional[str]:
+        """
+        Stops the running session and writes the collected stats to `directory`.
+
+        :raises: ProfilerError if there is no running session
+        :return: Path of the written stats file or `None` if nothing has been profiled
+        """
+        with self._lock:
+            if not self._running:
+                raise ProfilerError("Profiler is not running")
+
+            self._running = False
+            stats = self._stats
+
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        self.logger.info(f"Stopped profiling after {self.elapsed():.1f}s and {self._calls} calls")
+        if not stats:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "profile_{}.prof".format(datetime.now().strftime("%Y%m%d-%H%M%S")))
+        stats.dump_stats(path)
+        self.logger.info(f"Wrote profile to {path}")
+
+        return path
+
+    def _expire(self) -> None:
+        try:
+            path = self.stop()
+        except ProfilerError:
+            return
+
+        if self._on_stop:
+            # noinspection PyBroadException
+            try:
+                self._on_stop(path)
+            except Exception:
+                self.logger.error("Error in profiler stop callback", exc_info=True)
+
+    def run(self, func: Callable, *args, **kwargs):
+        """
+        Calls `func` and profiles it if a session is running and the call limit hasn't been reached yet.
+        """
+        if not self._running or self._calls >= self.max_calls:
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            self._collect(profile)
+
+    def _collect(self, profile: cProfile.Profile) -> None:
+        with self._lock:
+            if not self._running:
+                return
+
+            self._calls += 1
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def top_functions(self, path: str, n: Optional[int] = None) -> List[Tuple[float, int, str]]:
+        """
+        :return: The top `n` functions of the stats file by cumulative time as `(cumulative, calls, location)`
+        """
+        stats = pstats.Stats(path)
+        entries = []
+        # noinspection PyUnresolvedReferences
+        for (filename, line, function), (_, calls, _, cumulative, _) in stats.stats.items():
+            entries.append((cumulative, calls, f"{function} ({os.path.basename(filename)}:{line})"))
+
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+
+        return entries[:n or self.top]
+
+    def summary(self, path: Optional[str], n: Optional[int] = None) -> str:
+        if not path:
+            return "Nothing has been profiled."
+
+        lines = [f"{cumulative:8.3f}s {calls:6d} {location}" for cumulative, calls, location in
+                 self.top_functions(path, n)]
+
+        return "Profile: `{}`\n```\n{}\n```".format(path, "\n".join(lines))
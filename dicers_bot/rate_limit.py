@@ -0,0 +1,54 @@
+import time
+from threading import Lock
+from typing import Callable, TypeVar
+
+from telegram.error import RetryAfter
+
+from .logger import create_logger
+
+R = TypeVar("R")
+
+
+class RateLimiter:
+    """
+    Token bucket for bulk Telegram API calls: at most `rate` calls per second on average, with bursts of up to
+    `burst` calls. Calls which hit Telegram's flood control (`RetryAfter`) are retried after the requested time,
+    at most `max_retries` times. `call` blocks the calling thread while it waits.
+    """
+
+    def __init__(self, rate: float = 20, burst: int = 20, max_retries: int = 3):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.logger = create_logger("rate_limit")
+        self._lock = Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def acquire(self) -> None:
+        """
+        Blocks until a call may be made.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+    def call(self, func: Callable[..., R], *args, **kwargs) -> R:
+        retries = 0
+        while True:
+            self.acquire()
+            try:
+                return func(*args, **kwargs)
+            except RetryAfter as e:
+                if retries >= self.max_retries:
+                    raise
+
+                retries += 1
+                self.logger.warning(f"Flood control, retrying in {e.retry_after}s")
+                time.sleep(e.retry_after)
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+from typing import Dict, Any, Optional, IO
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from .logger import create_logger
+
+# Keys of objects whose `id` identifies a person or chat
+IDENTITY_KEYS = {"from", "user", "chat", "left_chat_member", "new_chat_members", "new_chat_member",
+                 "forward_from", "forward_from_chat", "via_bot"}
+NAME_KEYS = {"first_name", "last_name", "username", "title"}
+TEXT_KEYS = {"text", "caption", "query"}
+
+
+class UpdateRecorder:
+    """
+    Appends every incoming update with the time it has been handled to `filename` (JSON lines), see
+    `benchmarks.replay` to feed a recording back into the handlers.
+
+    Recording is disabled unless `filename` is set. With `anonymize`, user and chat ids are replaced by stable
+    pseudonyms (keyed with `salt`, random per process if not set), names are replaced and texts are replaced by a hash,
+    so equal messages stay equal for the spam detection. Of commands, only the command (without `@botname`) is kept,
+    each argument is replaced by a hash.
+    """
+
+    def __init__(self, filename: Optional[str] = None, anonymize: bool = True, salt: Optional[str] = None):
+        self.filename = filename
+        self.anonymize = anonymize
+        self.salt = (salt or os.urandom(16).hex()).encode("utf-8")
+        self.logger = create_logger("recorder")
+        self._lock = Lock()
+        self._file: Optional[IO[str]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.filename)
+
+    def _hash(self, value: Any) -> str:
+        return hashlib.sha256(self.salt + str(value).encode("utf-8")).hexdigest()
+
+    def _pseudonym(self, _id: int) -> int:
+        # Keeps the sign, negative ids are groups
+        pseudonym = int(self._hash(_id)[:12], 16) % 10 ** 12 + 1
+        return -pseudonym if _id < 0 else pseudonym
+
+    def _anonymize(self, value: Any, identity: bool = False) -> Any:
+        if isinstance(value, list):
+            return [self._anonymize(item, identity) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        result = {}
+        for key, item in value.items():
+            if key == "id" and identity and isinstance(item, int):
+                result[key] = self._pseudonym(item)
+            elif key in NAME_KEYS and isinstance(item, str):
+                result[key] = f"{key}_{self._hash(item)[:8]}"
+            elif key in TEXT_KEYS and isinstance(item, str):
+                result[key] = self._anonymize_text(item)
+            elif key in ("chat_id", "user_id") and isinstance(item, int):
+                result[key] = self._pseudonym(item)
+            else:
+                result[key] = self._anonymize(item, key in IDENTITY_KEYS)
+
+        text = value.get("text")
+        if isinstance(text, str) and text.startswith("/") and "entities" in value:
+            # Only the command is left of the text, the other entities would point into the hashed arguments
+            command_length = len(result["text"].split()[0])
+            result["entities"] = [dict(entity, length=command_length) for entity in value["entities"]
+                                  if entity.get("type") == "bot_command" and entity.get("offset") == 0]
+
+        return result
+
+    def _anonymize_text(self, text: str) -> str:
+        if not text.startswith("/"):
+            return f"text_{self._hash(text)[:8]}"
+
+        # Arguments can contain names, dates, ..., the bot's username would identify the recording's bot
+        command, *arguments = text.split()
+        return " ".join([command.split("@")[0]] + [f"arg_{self._hash(argument)[:8]}" for argument in arguments])
+
+    def record(self, update: Update, context: CallbackContext) -> None:
+        # `to_dict` includes cached private attributes like `_effective_user`
+        content = {key: value for key, value in update.to_dict().items() if not key.startswith("_")}
+        if self.anonymize:
+            content = self._anonymize(content)
+
+        line = json.dumps({"time": time.time(), "update": content})
+        with self._lock:
+            try:
+                if not self._file:
+                    os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+                    self._file = open(self.filename, "a", buffering=1)
+
+                self._file.write(line + "\n")
+            except OSError:
+                self.logger.error(f"Couldn't record update to {self.filename}", exc_info=True)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(filename: str):
+    """
+    :return: A generator of `(time, update dict)` tuples of a recording written by `UpdateRecorder`
+    """
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                entry: Dict[str, Any] = json.loads(line)
+                yield entry["time"], entry["update"]
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import time
+from typing import Dict, Any, List, Optional
+
+from telegram import ChatMember
+from telegram.utils.helpers import to_timestamp
+
+from .tracking import Tracked
+
+# Telegram treats restrictions for less than 30 seconds or more than 366 days as forever
+FOREVER = 0
+
+
+class Restrictions(Tracked):
+    """
+    The members of a chat which are restricted (muted) and until when (unix time, `FOREVER` if unknown/permanent),
+    updated from the results of the restrict API calls and the chat members the bot sees.
+    """
+    __slots__ = ("_until",)
+
+    def __init__(self, until: Optional[Dict[int, float]] = None):
+        self.dirty = True
+        self._until: Dict[int, float] = dict(until or {})
+
+    def restrict(self, user_id: int, until: float = FOREVER) -> None:
+        if self._until.get(user_id) != until:
+            self._until[user_id] = until
+            self.dirty = True
+
+    def lift(self, user_id: int) -> None:
+        if self._until.pop(user_id, None) is not None:
+            self.dirty = True
+
+    def until(self, user_id: int) -> Optional[float]:
+        """
+        :return: When the restriction of the user ends, `None` if the user isn't restricted
+        """
+        self._expire()
+        return self._until.get(user_id)
+
+    def is_restricted(self, user_id: int) -> bool:
+        return self.until(user_id) is not None
+
+    def restricted(self) -> List[int]:
+        self._expire()
+        return list(self._until)
+
+    def reconcile(self, member: ChatMember) -> None:
+        """
+        Updates the restriction of `member.user` from a chat member returned by the API.
+        """
+        if member.status == ChatMember.RESTRICTED and member.can_send_messages is False:
+            until = to_timestamp(member.until_date) or FOREVER
+            self.restrict(member.user.id, until)
+        else:
+            self.lift(member.user.id)
+
+    def _expire(self) -> None:
+        now = time.time()
+        expired = [user_id for user_id, until in self._until.items() if until != FOREVER and until <= now]
+        for user_id in expired:
+            self.lift(user_id)
+
+    def __len__(self) -> int:
+        return len(self.restricted())
+
+    @classmethod
+    def deserialize(cls, json: Dict[str, Any]) -> Restrictions:
+        restrictions = Restrictions({int(user_id): until for user_id, until in json.items()})
+        restrictions.dirty = False
+
+        return restrictions
+
+    def serialize(self) -> Dict[str, Any]:
+        return {str(user_id): until for user_id, until in self._until.items()}
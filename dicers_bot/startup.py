@@ -0,0 +1,82 @@
+import builtins
+import threading
+import time
+from typing import Dict, List, Tuple, Optional, Any
+
+
+class StartupReport:
+    """
+    Measures the phases of the start until the bot polls for updates (see `mark`).
+    With `time_imports`, `builtins.__import__` is wrapped until `finish` to measure how long the imports of the main
+    thread take per top-level package. The time of a package excludes the packages it imports, so the time of
+    `dicers_bot` is the time of its own modules.
+    """
+
+    def __init__(self, time_imports: bool = False):
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self._last_mark = self.started
+        self.phases: List[Tuple[str, float]] = []
+        self.imports: Dict[str, float] = {}
+        self._thread = threading.get_ident()
+        # [package, seconds of the nested imports] of the imports in progress
+        self._stack: List[List[Any]] = []
+        self._import = None
+        if time_imports:
+            self._import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if threading.get_ident() != self._thread:
+            return self._import(name, globals, locals, fromlist, level)
+
+        module = ((globals or {}).get("__package__") or name) if level else name
+        frame = [module.partition(".")[0], 0.0]
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            self.imports[frame[0]] = self.imports.get(frame[0], 0.0) + elapsed - frame[1]
+            if self._stack:
+                self._stack[-1][1] += elapsed
+
+    def mark(self, name: str) -> None:
+        """
+        Records the phase `name`, which has started with the end of the previous phase and ends now.
+        """
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last_mark))
+        self._last_mark = now
+
+    def finish(self) -> float:
+        """
+        Stops measuring the imports.
+
+        :return: The seconds since the report has been created
+        """
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+        return self.finished - self.started
+
+    def __str__(self) -> str:
+        total = (self.finished or time.perf_counter()) - self.started
+        lines = [f"Startup: {total * 1000:.0f}ms until polling (without starting the interpreter)"]
+        if self.imports:
+            imports = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)
+            lines.append(f"Imports (main thread): {sum(self.imports.values()) * 1000:.0f}ms")
+            lines.extend(f"  {package:<20} {seconds * 1000:8.1f}ms" for package, seconds in imports[:10])
+            if len(imports) > 10:
+                rest = sum(seconds for _, seconds in imports[10:])
+                lines.append(f"  {f'{len(imports) - 10} others':<20} {rest * 1000:8.1f}ms")
+
+        lines.append("Phases:")
+        lines.extend(f"  {name:<20} {seconds * 1000:8.1f}ms" for name, seconds in self.phases)
+
+        return "\n".join(lines)
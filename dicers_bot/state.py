@@ -0,0 +1,341 @@
+import gc
+import json
+import os
+import signal
+import time
+import traceback
+from threading import Condition, Lock, Thread
+from typing import Dict, Any, Tuple, Set, Optional, List, Iterable
+
+from telegram import Bot as TBot
+
+from .chat import Chat
+from .chat_store import ChatStore
+from .export import write_chat_json
+from .logger import create_logger
+
+
+class StateStore:
+    """
+    Persists the bot state in `directory` as a small index file (`index.json`, containing the `main_id` and the ids of
+    all chats) and one file per chat (`chats/<id>.json`).
+
+    Only chats which have been created or changed since they have been loaded (see `Chat.is_dirty`) are written,
+    every file is replaced atomically.
+    A single state file in the old format (`legacy_file`) is migrated when there is no index yet.
+    Chats which haven't been accessed for `idle_time` seconds are evicted from memory after they have been saved,
+    while more than `max_loaded_chats` are loaded (see `ChatStore`).
+
+    With `fork_snapshots`, the files are written by a forked child process from its copy-on-write view of the
+    parent's memory, so `save` only waits for the fork. Saves while a snapshot is being written are deferred, their
+    changes are written by the next snapshot, which is started when the running one has finished. If the child fails,
+    its chats are marked as changed again. A child which hasn't finished after `snapshot_timeout` seconds (e.g. since
+    it's stuck on a lock which another thread of the parent held while forking) is killed and its chats are saved
+    in-process. Without `os.fork` or if it fails, the state is saved in-process.
+    """
+    INDEX = "index.json"
+
+    def __init__(self, directory: str = "state", legacy_file: str = "state.json",
+                 max_loaded_chats: Optional[int] = None, idle_time: Optional[float] = None,
+                 fork_snapshots: bool = False, snapshot_timeout: float = 60):
+        self.directory = directory
+        self.legacy_file = legacy_file
+        self.max_loaded_chats = max_loaded_chats
+        self.idle_time = idle_time
+        self.fork_snapshots = fork_snapshots
+        self.snapshot_timeout = snapshot_timeout
+        self.logger = create_logger("state")
+        self._lock = Lock()
+        self._idle = Condition(self._lock)
+        self._chat_ids: Set[Any] = set()
+        self._index: Optional[Dict[str, Any]] = None
+        # Pid of the child which is writing a snapshot
+        self._child: Optional[int] = None
+        self._pending: Optional[Tuple[Dict[str, Any], ChatStore]] = None
+        self._counts = {"in_process": 0, "forks": 0, "snapshots": 0, "failed": 0, "deferred": 0, "fallbacks": 0,
+                        "timeouts": 0}
+        self._seconds = {"snapshot": 0.0, "max_snapshot": 0.0, "fork": 0.0, "max_fork": 0.0}
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, self.INDEX)
+
+    def chat_path(self, chat_id: Any) -> str:
+        return os.path.join(self.directory, "chats", f"{chat_id}.json")
+
+    def load(self, bot: TBot) -> Tuple[Dict[str, Any], ChatStore]:
+        """
+        :return: The state without chats and a `ChatStore` which loads the chats from their files on first access
+        """
+        if os.path.exists(self.index_path):
+            self.logger.debug(f"Read state index from {self.index_path}")
+            state = self._read(self.index_path)
+            if state is None:
+                # Starting without the chats would overwrite their files with empty chats on the next save
+                chat_ids = self._scan_chat_ids()
+                self.logger.error(f"Rebuilt the index from {len(chat_ids)} chat files, the main chat is lost")
+                state = {"main_id": None}
+            else:
+                chat_ids = state.pop("chats", [])
+                self._index = dict(state, chats=chat_ids)
+            self._chat_ids = set(chat_ids)
+
+            return state, self._chat_store(bot, chat_ids=chat_ids)
+
+        # A bind mount of a missing file (e.g. with docker-compose) is an empty directory
+        if os.path.isfile(self.legacy_file):
+            self.logger.info(f"Migrate state from {self.legacy_file} to {self.directory}")
+            state = self._read(self.legacy_file) or {"main_id": None}
+            chats = state.pop("chats", [])
+            for chat in chats:
+                self._write(self.chat_path(chat["id"]), chat)
+                self._chat_ids.add(chat["id"])
+            self._write_index(state, [chat["id"] for chat in chats])
+
+            return state, self._chat_store(bot, chats)
+
+        return {"main_id": None}, self._chat_store(bot)
+
+    def _chat_store(self, bot: TBot, serialized_chats=(), chat_ids=()) -> ChatStore:
+        return ChatStore(bot, serialized_chats, load=self.read_chat, chat_ids=chat_ids,
+                         max_loaded=self.max_loaded_chats, idle_time=self.idle_time)
+
+    def _scan_chat_ids(self) -> List[Any]:
+        chat_ids: List[Any] = []
+        directory = os.path.dirname(self.chat_path(0))
+        for filename in os.listdir(directory) if os.path.isdir(directory) else []:
+            name, extension = os.path.splitext(filename)
+            if extension == ".json":
+                try:
+                    chat_ids.append(int(name))
+                except ValueError:
+                    chat_ids.append(name)
+
+        return chat_ids
+
+    def read_chat(self, chat_id: Any) -> Dict[str, Any]:
+        with open(self.chat_path(chat_id)) as f:
+            return json.load(f)
+
+    def save(self, state: Dict[str, Any], chats: ChatStore) -> List[Any]:
+        """
+        :return: The ids of the chats which have been evicted
+        """
+        with self._lock:
+            if self._child is not None:
+                self._pending = (state, chats)
+                self._counts["deferred"] += 1
+                return []
+
+            # Every chat which is clean now has been written, none of them is being written by a snapshot
+            evicted = chats.evict()
+            self._save(state, chats)
+
+            return evicted
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until no snapshot is being written, including the snapshot of the changes made meanwhile.
+
+        :return: Whether no snapshot is being written
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._child is None, timeout)
+
+    def _save(self, state: Dict[str, Any], chats: ChatStore) -> None:
+        changed = [chat for chat in chats.loaded() if chat.id not in self._chat_ids or chat.is_dirty()]
+        # Clean first, changes made while writing mark the chats as dirty again
+        for chat in changed:
+            chat.clean()
+
+        chat_ids = list(chats.keys())
+        index = dict(state, chats=chat_ids)
+        removed = self._chat_ids.difference(chat_ids)
+        if not changed and not removed and index == self._index:
+            return
+
+        for chat_id in removed:
+            self.logger.info(f"Remove state of chat {chat_id}")
+
+        if self.fork_snapshots and hasattr(os, "fork"):
+            try:
+                self._fork(changed, index, removed)
+                return
+            except OSError:
+                self._counts["fallbacks"] += 1
+                self.logger.warning("Couldn't fork, saving the state in-process", exc_info=True)
+
+        try:
+            for chat in changed:
+                self.logger.debug(f"Write state of chat {chat.id}")
+            self._write_snapshot(changed, index, removed)
+        except Exception:
+            for chat in changed:
+                chat.dirty = True
+            raise
+
+        self._counts["in_process"] += 1
+        self._saved(changed, index, removed)
+
+    def _saved(self, chats: List[Chat], index: Dict[str, Any], removed: Set[Any]) -> None:
+        self._chat_ids.update(chat.id for chat in chats)
+        self._chat_ids.difference_update(removed)
+        self._index = index
+
+    def _write_snapshot(self, chats: Iterable[Chat], index: Dict[str, Any], removed: Set[Any]) -> None:
+        """
+        Writes `chats` (without building the serialized form of their whole history, events are encoded one by one),
+        the index and removes the files of the `removed` chats. Doesn't log, it's also run by the forked child.
+        """
+        for chat in chats:
+            self._replace(self.chat_path(chat.id), lambda f: write_chat_json(chat, f))
+
+        if index != self._index:
+            self._write(self.index_path, index)
+
+        for chat_id in removed:
+            try:
+                os.remove(self.chat_path(chat_id))
+            except FileNotFoundError:
+                pass
+
+    def _fork(self, chats: List[Chat], index: Dict[str, Any], removed: Set[Any]) -> None:
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            # The child must not return into the parent's code or run its cleanup (atexit, flushing buffers, ...)
+            status = 1
+            try:
+                # Collecting would write to every object and thereby copy most of the parent's memory
+                gc.disable()
+                self._write_snapshot(chats, index, removed)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+
+        fork_seconds = time.perf_counter() - start
+        self._counts["forks"] += 1
+        self._seconds["fork"] += fork_seconds
+        self._seconds["max_fork"] = max(self._seconds["max_fork"], fork_seconds)
+        self._child = pid
+        Thread(target=self._wait_for_child, args=(pid, start, chats, index, removed), name="state_snapshot",
+               daemon=True).start()
+
+    def _wait_for_child(self, pid: int, start: float, chats: List[Chat], index: Dict[str, Any],
+                        removed: Set[Any]) -> None:
+        status = self._reap(pid, start + self.snapshot_timeout)
+        duration = time.perf_counter() - start
+
+        with self._lock:
+            self._seconds["snapshot"] += duration
+            self._seconds["max_snapshot"] = max(self._seconds["max_snapshot"], duration)
+            if status is None:
+                self._counts["timeouts"] += 1
+                self.logger.error(f"Snapshot of {len(chats)} chats didn't finish within {self.snapshot_timeout}s, "
+                                  f"killed it, saving the state in-process")
+                try:
+                    self._write_snapshot(chats, index, removed)
+                    self._counts["in_process"] += 1
+                    self._saved(chats, index, removed)
+                except Exception:
+                    self.logger.error("Couldn't save the state in-process", exc_info=True)
+                    for chat in chats:
+                        chat.dirty = True
+            elif os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                self._counts["snapshots"] += 1
+                self._saved(chats, index, removed)
+                self.logger.debug(f"Wrote snapshot of {len(chats)} chats in {duration:.3f}s")
+            else:
+                self._counts["failed"] += 1
+                reason = (f"signal {os.WTERMSIG(status)}" if os.WIFSIGNALED(status)
+                          else f"exit status {os.WEXITSTATUS(status)}")
+                self.logger.error(f"Snapshot of {len(chats)} chats failed ({reason})")
+                for chat in chats:
+                    chat.dirty = True
+
+            self._child = None
+            pending, self._pending = self._pending, None
+            if pending:
+                try:
+                    self._save(*pending)
+                except Exception:
+                    self.logger.error("Couldn't save the deferred changes", exc_info=True)
+
+            self._idle.notify_all()
+
+    @staticmethod
+    def _reap(pid: int, deadline: float) -> Optional[int]:
+        """
+        Waits for the child `pid` until `deadline` (`time.perf_counter`), kills it if it hasn't exited by then.
+
+        :return: The exit status of the child, `None` if it has been killed
+        """
+        delay = 0.001
+        while time.perf_counter() < deadline:
+            finished, status = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                return status
+            time.sleep(min(delay, max(deadline - time.perf_counter(), 0)))
+            delay = min(delay * 2, 0.1)
+
+        finished, status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            return status
+
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counts, **self._seconds)
+            stats["writing"] = self._child is not None
+
+        return stats
+
+    def __str__(self) -> str:
+        stats = self.stats()
+        if not self.fork_snapshots:
+            return f"State: saved {stats['in_process']} times"
+
+        finished = stats["snapshots"] + stats["failed"]
+        text = f"State: {stats['snapshots']} snapshots"
+        if finished:
+            text += (f" (avg {stats['snapshot'] / finished * 1000:.0f}ms, max {stats['max_snapshot'] * 1000:.0f}ms, "
+                     f"fork avg {stats['fork'] / stats['forks'] * 1000:.1f}ms, max {stats['max_fork'] * 1000:.1f}ms)")
+
+        return (f"{text}, {stats['failed']} failed, {stats['timeouts']} timed out, {stats['deferred']} saves deferred, "
+                f"{stats['fallbacks'] + stats['in_process']} saved in-process")
+
+    def _write_index(self, state: Dict[str, Any], chat_ids) -> None:
+        index = dict(state, chats=chat_ids)
+        if index != self._index:
+            self._write(self.index_path, index)
+            self._index = index
+
+    def _write(self, path: str, content: Dict[str, Any]) -> None:
+        self._replace(path, lambda f: json.dump(content, f))
+
+    @staticmethod
+    def _replace(path: str, write) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, path)
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        :return: The content of `path`, `None` if it isn't valid json
+        """
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except json.decoder.JSONDecodeError as e:
+            self.logger.warning(f"Unable to load previous state from {path}: {e}")
+            return None
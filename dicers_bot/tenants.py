@@ -0,0 +1,67 @@
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+from .config import Config
+
+# Section, option and default of the files a bot writes, which can't be shared with another bot of the process
+_FILES = [
+    ("state", "directory", "state"),
+    ("state", "legacy_file", "state.json"),
+    ("archive", "directory", "state/archive"),
+    ("outbox", "filename", "state/outbox.json"),
+    ("recording", "filename", None),
+]
+
+
+@dataclass
+class Tenant:
+    """
+    A bot hosted by the process. Its config file sets its state directory (and thereby its main chat), archive,
+    outbox, ... `workers` is taken from the first tenant's config, the other process-wide sections (`logging`,
+    `graphql`) should be the same in every tenant's config.
+    """
+    name: str
+    token: str
+    config: str = "config.json"
+
+
+def load_tenants(secrets: Dict[str, Any], config_file: str = "config.json") -> List[Tenant]:
+    """
+    :param secrets: Content of `secrets.json`, with either a `token` (or the environment variable `BOT_TOKEN`) for a
+                    single bot or a list of `tenants` (`name`, `token` and optionally `config`, default `config_file`)
+    :raises ValueError: If there's no token, or if two tenants have the same name or would write the same files
+    """
+    if not secrets.get("tenants"):
+        token = secrets.get("token") or os.getenv("BOT_TOKEN")
+        if not token:
+            raise ValueError("`token` not defined, either set `BOT_TOKEN` or `token` in `secrets.json`")
+
+        return [Tenant("default", token, config_file)]
+
+    tenants = []
+    for entry in secrets["tenants"]:
+        if not entry.get("name") or not entry.get("token"):
+            raise ValueError(f"Every tenant needs a `name` and a `token`, got {sorted(entry)}")
+        tenants.append(Tenant(entry["name"], entry["token"], entry.get("config", config_file)))
+
+    names = [tenant.name for tenant in tenants]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Tenant names have to be unique: {', '.join(sorted(duplicates))}")
+
+    # Path -> name of the tenant which writes it
+    paths: Dict[str, str] = {}
+    for tenant in tenants:
+        config = Config(tenant.config)
+        for section, option, default in _FILES:
+            path = config.get(section, {}).get(option, default)
+            if path is None:
+                continue
+
+            path = os.path.abspath(path)
+            if path in paths:
+                raise ValueError(f"The tenants {paths[path]} and {tenant.name} both use {path} ({section}.{option})")
+            paths[path] = tenant.name
+
+    return tenants
@@ -0,0 +1,19 @@
+from typing import FrozenSet
+
+_MISSING = object()
+
+
+class Tracked:
+    """
+    Sets `dirty` whenever one of the attributes in `tracked` is assigned a different value.
+    Subclasses have to set `dirty` themselves for in-place changes (e.g. adding to a set).
+    """
+    __slots__ = ("dirty",)
+
+    tracked: FrozenSet[str] = frozenset()
+
+    def __setattr__(self, key: str, value) -> None:
+        if key in self.tracked and getattr(self, key, _MISSING) != value:
+            object.__setattr__(self, "dirty", True)
+
+        object.__setattr__(self, key, value)
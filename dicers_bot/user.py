@@ -1,15 +1,23 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Optional, Set, Iterator, List
+from typing import Any, Dict, Optional, Set, Iterator, List, TYPE_CHECKING
 
 from telegram import Message
 from telegram import User as TUser
 
-from .event import Event
+from .tracking import Tracked
 
+if TYPE_CHECKING:
+    from .event import Event
+
+
+class User(Tracked):
+    __slots__ = ("name", "roll", "jumbo", "alcoholic", "id", "_internal", "muted", "_messages", "spamming", "drink")
+
+    tracked = frozenset({"name", "roll", "jumbo", "alcoholic", "id", "muted", "drink"})
 
-class User:
     def __init__(self, name: str, _id: int, chat_user: Optional[TUser] = None):
+        self.dirty = True
         self.name = name
         self.roll = -1
         self.jumbo = False
@@ -17,10 +25,18 @@ class User:
         self.id = _id
         self._internal = chat_user
         self.muted = False
-        self.messages: Set[Message] = set()
+        self._messages: Optional[Set[Message]] = None
         self.spamming = False
         self.drink = None
 
+    @property
+    def messages(self) -> Set[Message]:
+        # Most users (e.g. every attendee of a historical event) never get any messages
+        if self._messages is None:
+            self._messages = set()
+
+        return self._messages
+
     def set_roll(self, roll: int) -> None:
         self.roll = roll
 
@@ -67,6 +83,7 @@ class User:
         user.jumbo = bool(json.get("jumbo", False))
         user.alcoholic = bool(json.get("alcoholic", True))
         user.drink = json.get("drink_name", None)
+        user.dirty = False
 
         return user
 
@@ -0,0 +1,291 @@
+import heapq
+import itertools
+import time
+from collections import deque
+from enum import IntEnum
+from queue import PriorityQueue
+from threading import Lock, Thread, Event
+from typing import Any, Callable, Deque, Dict, Optional, List, Tuple
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from .logger import create_logger
+
+
+class Lane(IntEnum):
+    """
+    Priority of an update, lower lanes are handled first.
+    """
+    # Keyboards and inline queries, Telegram clients wait for the answer
+    CALLBACK = 0
+    COMMAND = 1
+    # Plain text and status updates (new/left members)
+    MESSAGE = 2
+
+
+def update_lane(update: Any) -> Lane:
+    if isinstance(update, Update):
+        if update.callback_query or update.inline_query or update.chosen_inline_result:
+            return Lane.CALLBACK
+
+        message = update.effective_message
+        if message and message.text and message.text.startswith("/"):
+            return Lane.COMMAND
+
+    return Lane.MESSAGE
+
+
+def update_key(update: Any) -> Optional[int]:
+    """
+    :return: The key updates are ordered by (the chat, or the user for inline queries), `None` if unordered
+    """
+    if isinstance(update, Update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+
+    return None
+
+
+def _percentile(values, percentile: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+class _Task:
+    __slots__ = ("key", "lane", "func", "args", "tenant", "submitted")
+
+    def __init__(self, key: Any, lane: Lane, func: Callable, args: tuple, tenant: Optional[str] = None):
+        self.key = key
+        self.lane = lane
+        self.func = func
+        self.args = args
+        self.tenant = tenant
+        self.submitted = time.perf_counter()
+
+
+# (priority, sequence number, task), `None` tells a worker to exit
+_Entry = Tuple[int, int, Optional[_Task]]
+
+
+class WorkerPool:
+    """
+    Handles updates on a pool of worker threads instead of PTB's single dispatcher thread, so a slow handler only
+    delays the updates of its own chat. Updates with the same key (see `update_key`) are handled one after another.
+
+    With `lanes`, updates are prioritized by their `Lane` (see `update_lane`): callback queries go before commands,
+    commands before plain messages, both in the shared queue and among the updates waiting for their chat.
+    Without `lanes`, updates are handled in the order they arrived.
+
+    Without `adaptive` the pool has a fixed number of `workers`. With `adaptive`, it is resized every `interval`
+    seconds between `min_workers` and `max_workers`: it grows while updates wait longer than `target_wait` seconds
+    for a worker and shrinks by one worker once there haven't been enough updates to keep all workers busy for
+    `idle_timeout` seconds. The wait is the (moving) average wait of the last updates or, if higher, the wait
+    predicted from the backlog and the average handler duration.
+
+    Several dispatchers (one per bot, see `attach`) can share a pool, their updates are counted per tenant.
+    """
+
+    def __init__(self, workers: int = 4, adaptive: bool = False, min_workers: int = 2, max_workers: int = 16,
+                 target_wait: float = 0.1, interval: float = 1, idle_timeout: float = 30, window: int = 1000,
+                 lanes: bool = True):
+        self.adaptive = adaptive
+        self.lanes = lanes
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.initial_workers = max(min_workers, min(workers, max_workers)) if adaptive else workers
+        self.target_wait = target_wait
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.logger = create_logger("worker_pool")
+        self._queue: "PriorityQueue[_Entry]" = PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = Lock()
+        # Key -> heap of the updates waiting for the running update of the same key
+        self._waiting: Dict[Any, List[_Entry]] = {}
+        self._queued = {lane: 0 for lane in Lane}
+        self._workers = 0
+        self._busy = 0
+        self._processed = 0
+        self._average_wait = 0.0
+        self._average_duration = 0.0
+        self._waits: Deque[float] = deque(maxlen=window)
+        self._durations: Deque[float] = deque(maxlen=window)
+        self._lane_waits: Dict[Lane, Deque[float]] = {lane: deque(maxlen=window) for lane in Lane}
+        # Tenant -> [processed updates, seconds spent in handlers]
+        self._tenants: Dict[str, List[float]] = {}
+        self._last_saturated = time.monotonic()
+        self._stopped = Event()
+        self._dispatchers: List[Dispatcher] = []
+
+    def attach(self, dispatcher: Dispatcher, tenant: Optional[str] = None) -> None:
+        """
+        Makes `dispatcher` hand its updates to this pool instead of handling them in its own thread.
+
+        :param tenant: Name of the bot if the pool is shared, its updates are ordered separately from those of the
+                       other bots (which might be in the same chats) and counted in `stats`
+        """
+        process_update = dispatcher.process_update
+
+        def _submit(update):
+            key = update_key(update)
+            if tenant is not None and key is not None:
+                key = (tenant, key)
+            self.submit(key, process_update, update, lane=update_lane(update), tenant=tenant)
+
+        dispatcher.process_update = _submit
+        self._dispatchers.append(dispatcher)
+        if tenant is not None:
+            with self._lock:
+                self._tenants.setdefault(tenant, [0, 0.0])
+
+    def start(self) -> None:
+        self._resize(self.initial_workers)
+        if self.adaptive:
+            Thread(target=self._scale_loop, name="worker_pool_scaler", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._resize(0)
+
+    def submit(self, key: Any, func: Callable, *args, lane: Lane = Lane.MESSAGE, tenant: Optional[str] = None) -> None:
+        task = _Task(key, lane, func, args, tenant)
+        entry = (lane if self.lanes else 0, next(self._sequence), task)
+        with self._lock:
+            if key is not None:
+                waiting = self._waiting.get(key)
+                if waiting is not None:
+                    heapq.heappush(waiting, entry)
+                    return
+
+                self._waiting[key] = []
+
+            self._queued[lane] += 1
+
+        self._queue.put(entry)
+
+    def _resize(self, workers: int) -> None:
+        with self._lock:
+            difference = workers - self._workers
+            self._workers = workers
+
+        for _ in range(difference):
+            Thread(target=self._work, name="worker", daemon=True).start()
+        for _ in range(-difference):
+            # Every worker exits after taking one of these
+            self._queue.put((-1, next(self._sequence), None))
+
+        if difference:
+            self.logger.info(f"Resized to {workers} workers")
+
+    def _work(self) -> None:
+        while True:
+            _, _, task = self._queue.get()
+            if task is None:
+                return
+
+            start = time.perf_counter()
+            with self._lock:
+                self._busy += 1
+                self._queued[task.lane] -= 1
+
+            try:
+                task.func(*task.args)
+            except Exception:
+                self.logger.error("Uncaught exception in worker", exc_info=True)
+            finally:
+                end = time.perf_counter()
+                self._finish(task, start - task.submitted, end - start)
+
+    def _finish(self, task: _Task, wait: float, duration: float) -> None:
+        following = None
+        with self._lock:
+            self._busy -= 1
+            self._processed += 1
+            self._waits.append(wait)
+            self._lane_waits[task.lane].append(wait)
+            self._durations.append(duration)
+            self._average_wait += 0.2 * (wait - self._average_wait)
+            self._average_duration += 0.2 * (duration - self._average_duration)
+            if task.tenant is not None:
+                counts = self._tenants.setdefault(task.tenant, [0, 0.0])
+                counts[0] += 1
+                counts[1] += duration
+
+            if task.key is not None:
+                waiting = self._waiting[task.key]
+                if waiting:
+                    following = heapq.heappop(waiting)
+                    self._queued[following[2].lane] += 1
+                else:
+                    del self._waiting[task.key]
+
+        if following:
+            self._queue.put(following)
+
+    def _scale(self) -> None:
+        with self._lock:
+            queued = sum(self._queued.values())
+            demand = self._busy + queued
+            workers = self._workers
+            wait = max(self._average_wait, queued * self._average_duration / max(workers, 1))
+
+        now = time.monotonic()
+        if demand >= workers:
+            self._last_saturated = now
+
+        if queued and wait > self.target_wait and workers < self.max_workers:
+            self._resize(min(self.max_workers, max(demand, workers + 1)))
+        elif workers > self.min_workers and now - self._last_saturated > self.idle_timeout:
+            self._resize(workers - 1)
+            self._last_saturated = now
+
+    def _scale_loop(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self._scale()
+            except Exception:
+                self.logger.error("Failed to resize the worker pool", exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = list(self._waits)
+            durations = list(self._durations)
+            lane_waits = {lane: list(values) for lane, values in self._lane_waits.items()}
+            stats = {
+                "workers": self._workers,
+                "busy": self._busy,
+                "queued": sum(self._queued.values()),
+                "queued_per_lane": {lane.name.lower(): queued for lane, queued in self._queued.items()},
+                "waiting": sum(len(waiting) for waiting in self._waiting.values()),
+                "processed": self._processed,
+                "average_wait": self._average_wait,
+                "average_duration": self._average_duration,
+                "per_tenant": {tenant: {"processed": processed, "average_duration": seconds / max(processed, 1)}
+                               for tenant, (processed, seconds) in self._tenants.items()},
+            }
+
+        stats["update_queue"] = sum(dispatcher.update_queue.qsize() for dispatcher in self._dispatchers)
+        stats["wait_p95"] = _percentile(waits, 95)
+        stats["duration_p95"] = _percentile(durations, 95)
+        stats["wait_p95_per_lane"] = {lane.name.lower(): _percentile(values, 95) for lane, values in lane_waits.items()}
+
+        return stats
+
+    def __str__(self) -> str:
+        stats = self.stats()
+        bounds = f" ({self.min_workers}-{self.max_workers}, adaptive)" if self.adaptive else ""
+        return (f"Workers: {stats['workers']}{bounds}, {stats['busy']} busy\n"
+                f"Queue: {stats['update_queue'] + stats['queued']} updates, {stats['waiting']} behind their chat\n"
+                f"Wait: {stats['average_wait'] * 1000:.0f}ms avg, {stats['wait_p95'] * 1000:.0f}ms p95 ("
+                + ", ".join(f"{lane} {wait * 1000:.0f}ms" for lane, wait in stats["wait_p95_per_lane"].items())
+                + ")\n"
+                f"Handlers: {stats['average_duration'] * 1000:.0f}ms avg, {stats['duration_p95'] * 1000:.0f}ms p95\n"
+                f"Processed: {stats['processed']}"
+                + "".join(f"\n  {tenant}: {counts['processed']} ({counts['average_duration'] * 1000:.0f}ms avg)"
+                          for tenant, counts in stats["per_tenant"].items()))
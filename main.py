@@ -2,12 +2,24 @@ import os
 import sys
 import threading
 from datetime import datetime
+from typing import Optional, List
 
-import sentry_sdk
-from telegram import TelegramError
-from telegram.ext import CommandHandler, Updater, CallbackQueryHandler, MessageHandler, Filters, InlineQueryHandler
+from dicers_bot.startup import StartupReport
 
-from dicers_bot import Bot, create_logger
+# Created before the imports below, so `--startup-report` can measure them
+startup = StartupReport(time_imports="--startup-report" in sys.argv)
+
+import telegram  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import CommandHandler, Dispatcher, Updater, CallbackQueryHandler, MessageHandler, Filters, \
+    InlineQueryHandler, TypeHandler, CallbackContext  # noqa: E402
+from telegram.utils.request import Request  # noqa: E402
+
+from dicers_bot import Bot, create_logger  # noqa: E402
+from dicers_bot.cocktail_browser import CocktailBrowser  # noqa: E402
+from dicers_bot.config import Config  # noqa: E402
+from dicers_bot.tenants import Tenant, load_tenants  # noqa: E402
+from dicers_bot.worker_pool import WorkerPool  # noqa: E402
 
 
 def schedule_jobs(bot: Bot, updater: Updater):
@@ -18,6 +30,7 @@ def schedule_jobs(bot: Bot, updater: Updater):
     attend_time = today.replace(hour=14, minute=0)
     dice_time = today.replace(hour=21, minute=0)
     reset_time = today.replace(hour=0, minute=0)
+    archive_time = today.replace(hour=4, minute=0)
 
     logger.info("Set schedule")
 
@@ -27,30 +40,31 @@ def schedule_jobs(bot: Bot, updater: Updater):
     updater.job_queue.run_daily(callback=lambda _: bot.remind_users(None, None), time=attend_time, days=monday)
     updater.job_queue.run_daily(callback=lambda _: bot.show_dice_keyboards(None, None), time=dice_time, days=monday)
     updater.job_queue.run_daily(callback=lambda _: bot.reset_all(None, None), time=reset_time, days=tuesday)
+    updater.job_queue.run_daily(callback=lambda _: bot.archive_events(), time=archive_time)
 
     logger.info("Updated job_queue")
 
 
-def handle_telegram_error(error: TelegramError):
-    create_logger("handle_telegram_error").error(error)
-
-
-def start(bot_token: str):
-    logger = create_logger("start")
-    logger.debug("Start bot")
+def handle_error(bot: Bot, update: Optional[Update], context: CallbackContext):
+    create_logger("handle_error").error(f"Error while handling {update}: {context.error!r}")
+    bot.errors.report(context.error)
 
-    updater = Updater(token=bot_token, use_context=True)
-    bot = Bot(updater)
 
-    dispatcher = updater.dispatcher
+def register_handlers(dispatcher: Dispatcher, bot: Bot):
+    if bot.recorder.enabled:
+        # Group -1 runs before the handlers below, regardless of which of them handles the update
+        dispatcher.add_handler(TypeHandler(Update, bot.recorder.record), group=-1)
 
-    logger.debug("Register command handlers")
     # CommandHandler
     dispatcher.add_handler(CommandHandler("register_main", bot.register_main))
     dispatcher.add_handler(CommandHandler("remind_me", bot.remind_chat, pass_args=True))
     dispatcher.add_handler(CommandHandler("show_dice", bot.show_dice))
     dispatcher.add_handler(CommandHandler("users", bot.show_users))
     dispatcher.add_handler(CommandHandler("price_stats", bot.price_stats))
+    dispatcher.add_handler(CommandHandler("roll_trend", bot.roll_trend, pass_args=True))
+    dispatcher.add_handler(CommandHandler("roll_histogram", bot.roll_histogram))
+    dispatcher.add_handler(CommandHandler("streaks", bot.streaks))
+    dispatcher.add_handler(CommandHandler("weekdays", bot.weekdays))
     dispatcher.add_handler(CommandHandler("set_cocktail", bot.set_cocktail))
     dispatcher.add_handler(CommandHandler("add_insult", bot.add_insult, pass_args=True))
     dispatcher.add_handler(CommandHandler("list_insults", bot.list_insults))
@@ -62,15 +76,17 @@ def start(bot_token: str):
     dispatcher.add_handler(CommandHandler("delete_chat", bot.delete_chat))
     dispatcher.add_handler(CommandHandler("enable_spam_detection", bot.enable_spam_detection))
     dispatcher.add_handler(CommandHandler("disable_spam_detection", bot.disable_spam_detection))
-    dispatcher.add_handler(CommandHandler("get_data", bot.get_data))
+    dispatcher.add_handler(CommandHandler("get_data", bot.get_data, pass_args=True))
     dispatcher.add_handler(CommandHandler("mute", bot.mute, pass_args=True))
     dispatcher.add_handler(CommandHandler("unmute", bot.unmute, pass_args=True))
     dispatcher.add_handler(CommandHandler("kick", bot.kick, pass_args=True))
+    dispatcher.add_handler(CommandHandler("dump_log", bot.dump_log, pass_args=True))
 
     # main_admin
     dispatcher.add_handler(CommandHandler("remind_all", bot.remind_users))
     dispatcher.add_handler(CommandHandler("reset_all", bot.reset_all))
     dispatcher.add_handler(CommandHandler("unregister_main", bot.unregister_main))
+    dispatcher.add_handler(CommandHandler("profile", bot.profile, pass_args=True))
 
     # Debugging
     dispatcher.add_handler(CommandHandler("status", bot.status))
@@ -80,6 +96,7 @@ def start(bot_token: str):
     # CallbackQueryHandler
     dispatcher.add_handler(CallbackQueryHandler(bot.handle_attend_callback, pattern="attend_(.*)"))
     dispatcher.add_handler(CallbackQueryHandler(bot.handle_dice_callback, pattern="dice_(.*)"))
+    dispatcher.add_handler(CallbackQueryHandler(bot.handle_cocktails_callback, pattern="cocktails_([0-9]+)"))
 
     # InlineQueryHandler
     dispatcher.add_handler(InlineQueryHandler(bot.handle_inline_query))
@@ -93,64 +110,124 @@ def start(bot_token: str):
     dispatcher.add_handler(MessageHandler(Filters.status_update.new_chat_members, bot.new_member))
 
     # ErrorHandler
-    dispatcher.add_error_handler(
-        lambda _bot, _update, error: handle_telegram_error(error)
-    )
+    dispatcher.add_error_handler(lambda update, context: handle_error(bot, update, context))
 
-    state_file = "state.json"
-    logger.debug(f"Read state from {state_file}")
-    if os.path.exists(state_file):
-        with open(state_file) as file:
-            try:
-                state = json.load(file)
-            except json.decoder.JSONDecodeError as e:
-                logger.warning(f"Unable to load previous state: {e}")
-                state = {"main_id": None}
 
-        bot.set_state(state)
+def start(tenants: List[Tenant], base_url: Optional[str] = None, testrun: bool = False,
+          startup_report: bool = False):
+    """
+    Runs a bot per tenant. The bots poll for their own updates but share the worker pool, the connection pool to the
+    Bot API, the job queue and the rendered cocktail list.
 
-    schedule_jobs(bot, updater)
+    :param base_url: Bot API url (without the token) to use instead of Telegram's, e.g. `http://127.0.0.1:8081/bot` of
+                     `benchmarks.fake_telegram`
+    :param startup_report: Print how long the phases of the start (and the imports) took once polling has started
+    """
+    logger = create_logger("start")
+    logger.debug(f"Start {', '.join(tenant.name for tenant in tenants)}")
+
+    workers = Config(tenants[0].config).get("workers", {})
+    # Every worker of the pool might make requests at the same time, as well as the polling and dispatcher thread of
+    # each bot and the job queue
+    con_pool_size = max(workers.get("workers", 4), workers.get("max_workers", 16)) + 2 * len(tenants) + 2
+    request = Request(con_pool_size=con_pool_size)
+    # The updates are handled by the worker pool, PTB's own workers (`run_async`) aren't used
+    updaters = [Updater(bot=telegram.Bot(tenant.token, base_url, request=request), workers=0, use_context=True)
+                for tenant in tenants]
+    job_queue = updaters[0].job_queue
+    for updater in updaters[1:]:
+        updater.job_queue = updater.dispatcher.job_queue = job_queue
+    startup.mark("updater")
+
+    worker_pool = WorkerPool(**workers)
+    cocktail_browser = CocktailBrowser()
+    # Only multiple tenants are counted separately by the worker pool and shown in `/status`
+    names = [tenant.name if len(tenants) > 1 else None for tenant in tenants]
+    bots = [Bot(updater, tenant.config, name=name, worker_pool=worker_pool, cocktail_browser=cocktail_browser)
+            for updater, tenant, name in zip(updaters, tenants, names)]
+    startup.mark("bot")
 
-    try:
-        if sys.argv[1] == "--testrun":
-            logger.info("Scheduling exit in 5 seconds")
+    logger.debug("Register command handlers")
+    for bot, updater, name in zip(bots, updaters, names):
+        register_handlers(updater.dispatcher, bot)
+        worker_pool.attach(updater.dispatcher, tenant=name)
+    worker_pool.start()
+    startup.mark("handlers")
 
-            def _exit():
-                logger.info("Exiting")
+    logger.debug("Load state")
+    for bot in bots:
+        bot.load_state()
+    startup.mark("load state")
+
+    for bot, updater in zip(bots, updaters):
+        schedule_jobs(bot, updater)
+
+    # `idle` of the first updater handles the signals
+    updaters[0].user_sig_handler = lambda signum, frame: [updater.stop() for updater in updaters[1:]]
+
+    if testrun:
+        logger.info("Scheduling exit in 5 seconds")
+
+        def _exit():
+            logger.info("Exiting")
+            for updater in updaters:
                 updater.stop()
-                updater.is_idle = False
+            updaters[0].is_idle = False
 
-            timer = threading.Timer(5, _exit)
-            timer.setDaemon(True)
-            timer.start()
-    except IndexError:
-        pass
+        timer = threading.Timer(5, _exit)
+        timer.setDaemon(True)
+        timer.start()
 
-    logger.info("Running")
-    updater.start_polling()
-    updater.idle()
+    for updater in updaters:
+        updater.start_polling()
+    startup.mark("start polling")
+    logger.info(f"Running, started in {startup.finish():.2f}s")
+    if startup_report:
+        print(startup, flush=True)
+
+    updaters[0].idle()
+    # A snapshot of the state might still be written by a child process, followed by the snapshot of the changes made
+    # meanwhile, each of them is killed after `snapshot_timeout`
+    for bot in bots:
+        if not bot.state_store.wait(2 * bot.state_store.snapshot_timeout + 5):
+            logger.error("Snapshot of the state didn't finish, exiting anyway")
 
 
 if __name__ == "__main__":
+    import argparse
     import json
 
-    with open("secrets.json") as f:
-        content = json.load(f)
-        token = content.get('token', os.getenv("BOT_TOKEN"))
-        if not token:
-            raise ValueError("`token` not defined, either set `BOT_TOKEN` or `token` in `secrets.json`")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--testrun", action="store_true", help="Exit after 5 seconds")
+    parser.add_argument("--base-url", help="Bot API url to use instead of Telegram's, e.g. http://127.0.0.1:8081/bot")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Print how long the imports and the phases of the start took")
+    args = parser.parse_args()
+
+    content = {}
+    if os.path.exists("secrets.json"):
+        with open("secrets.json") as f:
+            content = json.load(f)
+
+    tenants = load_tenants(content, args.config)
+
+    startup.mark("imports")
 
-        try:
-            sentry_dsn = content['sentry_dsn']
-        except KeyError:
-            sentry_dsn = None
+    sentry_dsn = content.get('sentry_dsn')
+    if sentry_dsn:
+        import sentry_sdk
+        from sentry_sdk.integrations.logging import LoggingIntegration
 
-    sentry_sdk.init(sentry_dsn)
+        # Errors are reported by `bot.errors`, logged errors are only added as breadcrumbs
+        sentry_sdk.init(sentry_dsn, integrations=[LoggingIntegration(event_level=None)])
+        startup.mark("sentry")
 
     # noinspection PyBroadException
     try:
-        start(token)
+        start(tenants, args.base_url, args.testrun, args.startup_report)
     except Exception as e:
-        sentry_sdk.capture_exception()
+        if sentry_dsn:
+            sentry_sdk.capture_exception()
         create_logger("__main__").error(e)
         sys.exit(1)
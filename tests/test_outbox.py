@@ -0,0 +1,250 @@
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+import pytest
+
+from dicers_bot import bot as bot_module, partyamt
+from dicers_bot.bot import Bot
+from dicers_bot.calendar import Calendar, CalendarState
+from dicers_bot.event import Event
+from dicers_bot.logger import create_logger
+from dicers_bot.outbox import Outbox
+
+MONDAY = "2020-01-06"
+# The keys `Bot.create_remote_events` uses for events on `MONDAY`
+CALENDAR_KEY = f"calendar_{MONDAY}"
+PARTYAMT_KEY = f"partyamt_{MONDAY}"
+PARTYAMT_TIMESTAMP = int(datetime(2020, 1, 6, 22).timestamp())
+
+
+class Monday(datetime):
+    @classmethod
+    def today(cls):
+        return cls(2020, 1, 6, 19, 30)
+
+
+class StandIn:
+    """
+    Local HTTP server standing in for partyamt and the Google calendar API. The first `failures[kind]` requests of
+    each kind (`calendar`, `partyamt`) are answered with a 500, calendar events with an id which exists already with
+    a 409.
+    """
+
+    def __init__(self):
+        self.failures: Dict[str, int] = {}
+        self.requests: Dict[str, List[Dict[str, Any]]] = {"calendar": [], "partyamt": []}
+        self.events: Dict[str, Dict[str, Dict[str, Any]]] = {"calendar": {}, "partyamt": {}}
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status, response = stand_in.handle(self.path, body)
+                content = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, path: str, body: Dict[str, Any]):
+        kind = "calendar" if path.startswith("/calendar/") else "partyamt"
+        requests, events = self.requests[kind], self.events[kind]
+        requests.append(body)
+        if len(requests) <= self.failures.get(kind, 0):
+            return 500, {"error": "unavailable"}
+
+        if kind == "calendar":
+            if body["id"] in events:
+                return 409, {"error": {"code": 409, "message": "The requested identifier already exists."}}
+            events[body["id"]] = body
+            return 200, dict(body, htmlLink=f"{self.url}/event/{body['id']}")
+
+        event_id = str(len(events) + 1)
+        events[event_id] = body["variables"]
+        return 200, {"data": {"addEvent": {"id": event_id}}}
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def discovery_document(root_url: str) -> str:
+    """
+    The part of the calendar API's discovery document `Calendar.create` uses.
+    """
+    return json.dumps({
+        "kind": "discovery#restDescription",
+        "discoveryVersion": "v1",
+        "id": "calendar:v3",
+        "name": "calendar",
+        "version": "v3",
+        "protocol": "rest",
+        "rootUrl": f"{root_url}/",
+        "servicePath": "calendar/v3/",
+        "resources": {"events": {"methods": {"insert": {
+            "id": "calendar.events.insert",
+            "path": "calendars/{calendarId}/events",
+            "httpMethod": "POST",
+            "parameters": {"calendarId": {"type": "string", "required": True, "location": "path"}},
+            "parameterOrder": ["calendarId"],
+            "request": {"$ref": "Event"},
+            "response": {"$ref": "Event"}
+        }}}},
+        "schemas": {"Event": {"id": "Event", "type": "object", "properties": {
+            "id": {"type": "string"},
+            "htmlLink": {"type": "string"}
+        }}}
+    })
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+
+    return condition()
+
+
+@pytest.fixture
+def stand_in():
+    server = StandIn()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def calendar(stand_in, tmp_path):
+    from googleapiclient.discovery import build_from_document
+    from httplib2 import Http
+
+    calendar = Calendar(filename=str(tmp_path / "missing_credentials.json"), timeout=5)
+    calendar.wait_until_initialized()
+    calendar.service = build_from_document(discovery_document(stand_in.url), http=Http(timeout=5))
+    calendar.state = CalendarState.READY
+    return calendar
+
+
+@pytest.fixture
+def partyamt_endpoint(stand_in, monkeypatch):
+    monkeypatch.setattr(partyamt, "PARTYAMT_ENDPOINT", f"{stand_in.url}/graphql")
+
+
+@pytest.fixture(autouse=True)
+def monday(monkeypatch):
+    # The calendar event is only created on Mondays, for today
+    monkeypatch.setattr(bot_module, "datetime", Monday)
+
+
+def create_bot(tmp_path, calendar: Calendar) -> Bot:
+    """
+    :return: A bot with the parts of `Bot.__init__` the remote events need, its outbox isn't started
+    """
+    bot = Bot.__new__(Bot)
+    bot.logger = create_logger("test_outbox")
+    bot.calendar = calendar
+    bot.outbox = Outbox(str(tmp_path / "outbox.json"), base_delay=0.01, max_delay=0.05)
+    bot.outbox.register("calendar", bot._create_calendar_event)
+    bot.outbox.register("partyamt", bot._create_partyamt_event)
+    return bot
+
+
+def run_outbox(bot: Bot) -> None:
+    bot.outbox.start()
+    try:
+        assert wait_for(lambda: not bot.outbox.pending())
+    finally:
+        bot.outbox.stop(1)
+
+
+def test_remote_events_are_retried_until_created(stand_in, calendar, partyamt_endpoint, tmp_path):
+    stand_in.failures = {"calendar": 2, "partyamt": 1}
+    bot = create_bot(tmp_path, calendar)
+    bot.create_remote_events(Event(Monday.today()))
+    run_outbox(bot)
+
+    assert len(stand_in.requests["calendar"]) == 3
+    assert len(stand_in.events["calendar"]) == 1
+    # One failed attempt (the client doesn't retry the mutation itself) and one successful retry of the outbox
+    assert len(stand_in.requests["partyamt"]) == 2
+    assert list(stand_in.events["partyamt"].values()) == [{"time": PARTYAMT_TIMESTAMP}]
+
+
+def test_remote_events_arent_duplicated(stand_in, calendar, partyamt_endpoint, tmp_path):
+    bot = create_bot(tmp_path, calendar)
+    # Two chats attend on the same day
+    bot.create_remote_events(Event(Monday.today()))
+    bot.create_remote_events(Event(Monday.today()))
+    run_outbox(bot)
+    # Completed keys are remembered
+    assert not bot.outbox.enqueue("calendar", CALENDAR_KEY, {"day": MONDAY})
+    assert not bot.outbox.enqueue("partyamt", PARTYAMT_KEY, {"timestamp": PARTYAMT_TIMESTAMP})
+
+    assert len(stand_in.requests["calendar"]) == 1
+    assert len(stand_in.requests["partyamt"]) == 1
+
+    # Another instance (e.g. after losing the outbox) creates the event with the same id, which the API rejects.
+    # partyamt can't deduplicate, see `partyamt.add_event`.
+    calendar.last_event = None
+    create_bot(tmp_path / "other", calendar)._create_calendar_event(CALENDAR_KEY, {"day": MONDAY})
+    assert len(stand_in.requests["calendar"]) == 2
+    assert len(stand_in.events["calendar"]) == 1
+
+
+def test_remote_events_of_other_days_arent_created(stand_in, calendar, partyamt_endpoint, tmp_path):
+    bot = create_bot(tmp_path, calendar)
+    bot.create_remote_events(Event(datetime(2020, 1, 13)))
+    assert not bot.outbox.pending()
+
+
+def test_pending_entries_survive_a_restart(stand_in, calendar, partyamt_endpoint, tmp_path):
+    bot = create_bot(tmp_path, calendar)
+    # Not started, like a bot which is stopped before the entries have been executed
+    bot.create_remote_events(Event(Monday.today()))
+    assert not stand_in.requests["calendar"] and not stand_in.requests["partyamt"]
+
+    restarted = create_bot(tmp_path, calendar)
+    assert restarted.outbox.pending() == 2
+    restarted.create_remote_events(Event(Monday.today()))
+    assert restarted.outbox.pending() == 2
+    run_outbox(restarted)
+
+    assert len(stand_in.events["calendar"]) == 1
+    assert list(stand_in.events["partyamt"].values()) == [{"time": PARTYAMT_TIMESTAMP}]
+    # The completed keys are persisted as well
+    assert not create_bot(tmp_path, calendar).outbox.enqueue("partyamt", PARTYAMT_KEY,
+                                                              {"timestamp": PARTYAMT_TIMESTAMP})
+
+
+def test_failed_entries_are_given_up(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.json"), max_attempts=3, base_delay=0.01, max_delay=0.01)
+    attempts = []
+
+    def _fail(key, payload):
+        attempts.append(key)
+        raise ConnectionError("unavailable")
+
+    box.register("partyamt", _fail)
+    box.start()
+    try:
+        box.enqueue("partyamt", "partyamt_-1_06.01.2020", {"timestamp": 1578340800})
+        assert wait_for(lambda: not box.pending())
+    finally:
+        box.stop(1)
+
+    assert len(attempts) == 3